@@ -35,6 +35,8 @@ namespace CelesteBot_2023
         public bool NeedToRestartGame { get; set; }
         public bool NeedGameStateUpdate { get; private set; }
         public Action LatestAction { get; private set; }
+        // Calculation periods the latest action is still held for before the next observation (action repeat)
+        public int HeldCalculationsRemaining { get; private set; }
         public InputPlayer inputPlayer;
 
         public ExternalActionManager ActionManager = new();
@@ -98,7 +100,8 @@ namespace CelesteBot_2023
             if (!Episode.FirstObservationSent)
             {
                 Episode.NewEpisodeSetOriginalDistance();
-                ProcessGameState(false, false);
+                // first observation of the episode, no reward attached
+                GameStateManager.AddObservation(ProcessGameState(false, false));
                 bool observationSent = true;
                 Episode.FirstObservationSent = observationSent;
 
@@ -115,6 +118,7 @@ namespace CelesteBot_2023
                     inputPlayer.UpdateData(nextInput);
                     RunActionInNFrames = -1;
                     LatestAction = nextAction;
+                    HeldCalculationsRemaining = nextAction.RepeatCalculations - 1;
                     NeedGameStateUpdate = true;
                     return;
                 }
@@ -124,14 +128,22 @@ namespace CelesteBot_2023
                 }
             }
 
+            else if (!NeedImmediateGameStateUpdate && NeedGameStateUpdate && Episode.IsCalculateFrame() && HeldCalculationsRemaining > 0 && CelesteBotMain.Settings.TrainingEnabled)
+            {
+                // Action repeat: keep holding the latest action for another calculation period instead of asking
+                // Python for a new one. Its reward covers all the periods it was held for.
+                HeldCalculationsRemaining--;
+                Episode.HoldAction();
+            }
             else if (NeedImmediateGameStateUpdate || (NeedGameStateUpdate && Episode.IsCalculateFrame()) || !CelesteBotMain.Settings.TrainingEnabled)
             {
-                // get reward and observation
-                ProcessGameState(PlayerDied, PlayerFinishedLevel);
+                // get reward and observation, sent to Python together as one transition
+                GameState gameState = ProcessGameState(PlayerDied, PlayerFinishedLevel);
 
-                double reward = Episode.GetReward();
+                gameState.Reward = Episode.GetReward();
 
-                GameStateManager.AddReward(reward);
+                GameStateManager.AddObservation(gameState);
+                HeldCalculationsRemaining = 0;
                 if (!NeedImmediateGameStateUpdate)
                 {
                     RunActionInNFrames = GetActionFrameDelay(true);
@@ -155,7 +167,7 @@ namespace CelesteBot_2023
                 inputPlayer.UpdateData(nextInput, true);
             }
         }
-        public bool ProcessGameState(bool PlayerDied, bool PlayerFinishedLevel)
+        public GameState ProcessGameState(bool PlayerDied, bool PlayerFinishedLevel)
         {
             if (WaitingForRespawn)
             {
@@ -175,9 +187,7 @@ namespace CelesteBot_2023
                 WaitingForRespawn = true;
             }
             cameraManager.UpdateScreenVision(Episode.Target);
-            GameState gameState = new(cameraManager.CameraVision, CelesteGamePlayer, Episode, PlayerDied, PlayerFinishedLevel);
-            GameStateManager.AddObservation(gameState);
-            return true;
+            return new(cameraManager.CameraVision, CelesteGamePlayer, Episode, PlayerDied, PlayerFinishedLevel);
             
         }
         public void SetupVision()
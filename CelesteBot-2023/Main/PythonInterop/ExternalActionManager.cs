@@ -49,6 +49,9 @@ namespace CelesteBot_2023
         readonly SpecialMoveActionType SpecialMoveAction;
         readonly GrabActionType grabAction;
         readonly MenuActionType MenuAction;
+        // Number of calculation periods to hold this action for before the next observation is sent. Optional fifth
+        // element of the action from Python (action repeat), 0 => 1 period.
+        public readonly int RepeatCalculations = 1;
 
         public Action(int[] action)
         {
@@ -57,6 +60,10 @@ namespace CelesteBot_2023
 
             SpecialMoveAction = (SpecialMoveActionType)action[2];
             grabAction = (GrabActionType)action[3];
+            if (action.Length > 4)
+            {
+                RepeatCalculations = action[4] + 1;
+            }
         }
         public Action(MenuActionType menuAction)
         {
@@ -66,7 +73,7 @@ namespace CelesteBot_2023
         }
         public override string ToString()
         {
-            return "Move:" + Enum.GetName(typeof(UpDownActionType), UpDownAction) + " " + Enum.GetName(typeof(LeftRightActionType), LeftRightAction) + "\nSpecial:" + Enum.GetName(typeof(SpecialMoveActionType), SpecialMoveAction) + " Grab:" + Enum.GetName(typeof(GrabActionType), grabAction);
+            return "Move:" + Enum.GetName(typeof(UpDownActionType), UpDownAction) + " " + Enum.GetName(typeof(LeftRightActionType), LeftRightAction) + "\nSpecial:" + Enum.GetName(typeof(SpecialMoveActionType), SpecialMoveAction) + " Grab:" + Enum.GetName(typeof(GrabActionType), grabAction) + " Repeat:" + RepeatCalculations;
         }
 
         public float GetMoveX()
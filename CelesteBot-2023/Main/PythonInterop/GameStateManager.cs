@@ -1,5 +1,7 @@
 ﻿using Celeste;
+using Celeste.Mod;
 using Celeste.Mod.CelesteBot_2023.Main;
+using Monocle;
 using Python.Runtime;
 using System.Collections.Concurrent;
 
@@ -18,6 +20,12 @@ namespace CelesteBot_2023
         public double Stamina { get; }
         public float CanDash { get; }
         public float[] ScreenPosition { get; internal set; }
+        // Reward of the action that led to this state, NaN for the first observation of an episode
+        public double Reward { get; internal set; } = double.NaN;
+        // Stamped when the observation is queued, lets the Python client detect dropped or reordered transitions
+        public long Sequence { get; internal set; }
+        // Map file and room, e.g. "Celeste/1-ForsakenCity/a-00", null outside of a level. Tags recorded transitions
+        public string LevelName { get; }
 
         public GameState(PyList vision, Player player, TrainingEpisodeState episode, bool playerDied, bool playerFinishedLevel)
         {
@@ -42,25 +50,27 @@ namespace CelesteBot_2023
             }
                ScreenPosition = CameraManager.CameraPosition;
             Target = new float[2] { episode.Target.X, episode.Target.Y };
+            Session session = SceneExtensions.GetSession(Engine.Scene);
+            LevelName = session?.MapData != null ? session.MapData.Filename + "/" + session.Level : null;
         }
 
     }
     public class ExternalGameStateManager
     {
         readonly BlockingCollection<GameState> GameStateQueue;
-        readonly BlockingCollection<double> RewardQueue;
         public static int NumSentObservations { get; set; }
+        private long nextSequence = 0;
 
         public ExternalGameStateManager()
         {
             GameStateQueue = new BlockingCollection<GameState>();
-            RewardQueue = new BlockingCollection<double>();
         }
 
         public void AddObservation(GameState obs)
         {
             if (CelesteBotMain.Settings.TrainingEnabled)
             {
+                obs.Sequence = nextSequence++;
                 GameStateQueue.Add(obs);
             }
         }
@@ -70,16 +80,5 @@ namespace CelesteBot_2023
             NumSentObservations++;
             return GameStateQueue.Take();
         }
-        public void AddReward(double reward)
-        {
-            if (CelesteBotMain.Settings.TrainingEnabled)
-            {
-                RewardQueue.Add(reward);
-            }
-        }
-        public double PythonGetNextReward()
-        {
-            return RewardQueue.Take();
-        }
     }
 }
@@ -14,7 +14,6 @@ namespace CelesteBot_2023
         static Thread actionConsumerThread;
         static Thread observationProducerThread;
         static Thread trainingLoop;
-        static Thread rewardQueueProducer;
         public static void Setup()
         {
             // virtual env setup
@@ -36,7 +35,6 @@ namespace CelesteBot_2023
         public static void Unload()
         {
             //trainingLoop.Interrupt();
-            //rewardQueueProducer.Interrupt();
             //actionConsumerThread.Interrupt();
             //observationProducerThread.Interrupt();
             PythonEngine.Shutdown();
@@ -73,11 +71,6 @@ namespace CelesteBot_2023
                 {
                     Name = "TrainingLoop"
                 };
-
-                rewardQueueProducer = new Thread(() => RewardQueueProducer(python_celeste_client))
-                {
-                    Name = "RewardProducer"
-                };
                 CelesteBotRunner.Vision2D = new PyList();
                 for (int i = 0; i < CelesteBotMain.VISION_2D_X_SIZE; i++)
                 {
@@ -92,7 +85,6 @@ namespace CelesteBot_2023
             actionConsumerThread.Start();
             observationProducerThread.Start();
             trainingLoop.Start();
-            rewardQueueProducer.Start();
             CutsceneManager.Log("Python Finished Initializing");
 
         }
@@ -130,25 +122,11 @@ namespace CelesteBot_2023
             }
 
         }
-        static void RewardQueueProducer(dynamic python_celeste_client)
-        {
-            // Sends Rewards to Python client
-            CutsceneManager.Log("Py Reward Producer Loop Initializing");
-
-            while(true)
-            {
-                double reward = CelesteBotMain.AIPlayer.GameStateManager.PythonGetNextReward();
-
-                using (Py.GIL())
-                {
-                    python_celeste_client.ext_add_reward(reward);
-                }
-            }
-        }
         static void ObservationQueueProducer(dynamic python_celeste_client)
         {
-            // Sends Observations of Game State to Python client
+            // Sends Observations of Game State, together with their reward, to Python client
             CutsceneManager.Log("Py Observation Producer Loop Initializing");
+            string lastLevelName = null;
 
 
             // Loop through the Python queue and add each item to the BlockingCollection
@@ -166,13 +144,20 @@ namespace CelesteBot_2023
                     PyList screenPosition = ToPyList(obs.ScreenPosition);
 
                     PyObject canDash = obs.CanDash.ToPython();
-                    //PyObject reward = obs.Reward.ToPython();
+                    PyObject reward = obs.Reward.ToPython();
+                    PyObject sequence = obs.Sequence.ToPython();
                     PyObject deathFlag = obs.DeathFlag.ToPython();
                     PyObject finishedLevel = obs.FinishedLevel.ToPython();
                     PyObject isClimbing = obs.IsClimbing.ToPython();
                     PyObject onGround = obs.OnGround.ToPython();
 
-                    python_celeste_client.ext_add_observation(obs.Vision, speed, canDash, stamina, deathFlag, finishedLevel, target, position, screenPosition, isClimbing, onGround);
+                    if (obs.LevelName != null && obs.LevelName != lastLevelName)
+                    {
+                        // Applies from this transition on, tags the transitions the client records
+                        python_celeste_client.ext_set_level(obs.LevelName, sequence);
+                        lastLevelName = obs.LevelName;
+                    }
+                    python_celeste_client.ext_add_transition(sequence, reward, obs.Vision, speed, canDash, stamina, deathFlag, finishedLevel, target, position, screenPosition, isClimbing, onGround);
 
                 }
             }
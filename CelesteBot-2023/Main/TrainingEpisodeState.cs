@@ -42,6 +42,8 @@ namespace Celeste.Mod.CelesteBot_2023.Main
         private double ClosestDistanceFromTargetReached;
         private Vector2 ClosestVectorDistanceFromTargetReached;
         private int FramesSinceMadeProgress;
+        // Calculation periods since the last reward, more than one when the action was held (action repeat)
+        private int CalculationsSinceReward = 1;
         public static double OriginalDistanceFromTarget;
         private Vector2 OriginalVectorDistanceFromTarget;
         private bool waitForReset = false;
@@ -72,6 +74,12 @@ namespace Celeste.Mod.CelesteBot_2023.Main
             NumFrames = 0;
             ReachedTarget = false;
             FramesSinceMadeProgress = 0;
+            CalculationsSinceReward = 1;
+        }
+
+        public void HoldAction()
+        {
+            CalculationsSinceReward++;
         }
 
         public double GetReward()
@@ -116,8 +124,9 @@ namespace Celeste.Mod.CelesteBot_2023.Main
             }
             else
             {
-                FramesSinceMadeProgress += FramesBetweenCalculations;
+                FramesSinceMadeProgress += FramesBetweenCalculations * CalculationsSinceReward;
             }
+            CalculationsSinceReward = 1;
 
             //CelesteBotManager.Log("changeInVectorDistanceX: " + (-changeInVectorDistance.X).ToString("F2") + "changeInVectorDistanceY: " + changeInVectorDistance.Y.ToString("F2") + " changeInDistance: " + changeInDistance.ToString() + " reward: " + reward.ToString("F2") + " distanceChangeReward: " + distanceChangeReward.ToString("F2") + " distanceFromTarget: " + distanceFromTarget.ToString("F2"));
             //if (reward < 0)
@@ -0,0 +1,81 @@
+"""
+How long a checkpoint blocks the learner: `Algorithm.save_checkpoint` (what Tune and `algo.save()` do) against the
+snapshot taken by `AsyncCheckpointWriter.save` (rl_server/async_checkpoint.py), plus how long the background write
+takes, a check that the written checkpoint restores and one that it holds the weights of when `save` was called,
+even though the model changes while it is written. Uses the stand-in server's algorithm with `--hidden` wide
+fully connected layers to scale the model.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.checkpointing --hidden 1024 --repeats 5
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from ray.rllib.policy.policy import Policy
+
+from python_rl.benchmarks.stand_in_server import STAND_IN_MODEL, build_stand_in_config, get_free_port
+from python_rl.rl_server.async_checkpoint import AsyncCheckpointWriter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    import ray
+    ray.init(num_cpus=2, include_dashboard=False, log_to_driver=False)
+    config = build_stand_in_config(get_free_port())
+    config.training(model=dict(config.model, fcnet_hiddens=[args.hidden, args.hidden]))
+    algo = config.build()
+    parameters = sum(p.numel() for p in algo.get_policy().model.parameters())
+    print(f"model: {parameters / 1e6:.2f}M parameters ({STAND_IN_MODEL['conv_filters']} + {args.hidden}x2)")
+
+    directory = tempfile.mkdtemp(prefix="celestebot_checkpoints_")
+    synchronous = []
+    for i in range(args.repeats):
+        os.makedirs(os.path.join(directory, f"sync_{i}"))
+        start = time.perf_counter()
+        algo.save_checkpoint(os.path.join(directory, f"sync_{i}"))
+        synchronous.append(time.perf_counter() - start)
+
+    writer = AsyncCheckpointWriter(os.path.join(directory, "async"), keep=2)
+    blocked, written = [], []
+    for i in range(args.repeats):
+        algo._iteration = i + 1
+        blocked.append(writer.save(algo))
+        writer.wait()
+        written.append(writer.write_s)
+
+    print(f"{'':<28}{'mean ms':>10}{'max ms':>10}")
+    for name, seconds in (("save_checkpoint (blocking)", synchronous), ("async snapshot (blocking)", blocked),
+                          ("async write (background)", written)):
+        print(f"{name:<28}{np.mean(seconds) * 1e3:>10.1f}{np.max(seconds) * 1e3:>10.1f}")
+
+    kept = sorted(os.listdir(writer.directory))
+    restored = Policy.from_checkpoint(writer.last_checkpoint)["default_policy"]
+    same = all(np.array_equal(a, b) for a, b in zip(
+        restored.get_weights().values(), algo.get_policy().get_weights().values()))
+    print(f"kept {kept}, restored weights match: {same}")
+
+    # An optimizer step right after the snapshot, while the writer is pickling it
+    policy = algo.get_policy()
+    saved = {key: np.array(value, copy=True) for key, value in policy.get_weights().items()}
+    algo._iteration = args.repeats + 1
+    writer.save(algo)
+    with torch.no_grad():
+        for parameter in policy.model.parameters():
+            parameter.add_(1.0)
+    writer.wait()
+    restored = Policy.from_checkpoint(writer.last_checkpoint)["default_policy"].get_weights()
+    isolated = all(np.array_equal(restored[key], value) for key, value in saved.items())
+    print(f"checkpoint unaffected by updates after the snapshot: {isolated}")
+    algo.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cost of the per-step DEBUG log line on the thread that logs it:
+
+    file        logging.basicConfig style FileHandler, message built with an f-string (the client before
+                client_logging.py)
+    queue       SampledQueueHandler, args formatted on the writer thread
+    limited     SampledQueueHandler with the client's rate limit on the message
+
+plus the lines each wrote and how many records were dropped or sampled out.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.client_logging --iterations 100000
+"""
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+
+import numpy as np
+
+from python_rl.rl_client.celestebot_client import STEP_LOG_MESSAGE, STEP_LOG_RATE
+from python_rl.rl_client.client_logging import DEFAULT_QUEUE_SIZE, LogWriter, MessageLimit, SampledQueueHandler
+
+
+def file_handler(path):
+    handler = logging.FileHandler(path, mode="w")
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    return handler, None
+
+
+def queue_handler(path, limits=None):
+    writer, _ = file_handler(path)
+    handler = SampledQueueHandler(queue.Queue(DEFAULT_QUEUE_SIZE), limits)
+    listener = LogWriter(handler.queue, writer)
+    listener.start()
+    return handler, listener
+
+
+def run(name, handler, iterations, lazy):
+    logger = logging.getLogger(f"client_logging_benchmark.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    action = np.array([1, 2, 3, 1])
+    start = time.perf_counter()
+    for i in range(iterations):
+        reward = i * 0.01
+        if lazy:
+            logger.log(logging.DEBUG, STEP_LOG_MESSAGE, action, reward)
+        else:
+            logger.log(logging.DEBUG, f"Reward for Action {action}: {reward}")
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix="celestebot_logging_")
+
+    cases = {
+        "file": (file_handler, {}, False),
+        "queue": (queue_handler, {}, True),
+        "limited": (queue_handler, {"limits": {STEP_LOG_MESSAGE: MessageLimit(per_second=STEP_LOG_RATE)}}, True),
+    }
+    print(f"{'handler':<10}{'us/call':>10}{'lines':>10}{'dropped':>10}{'sampled out':>13}")
+    for name, (make, kwargs, lazy) in cases.items():
+        path = os.path.join(directory, f"{name}.txt")
+        handler, listener = make(path, **kwargs)
+        seconds = run(name, handler, args.iterations, lazy)
+        if listener is not None:
+            listener.stop()
+        handler.close()
+        with open(path) as f:
+            lines = sum(1 for _ in f)
+        stats = handler.stats() if isinstance(handler, SampledQueueHandler) else {"dropped": 0, "sampled_out": 0}
+        print(f"{name:<10}{seconds * 1e6:>10.2f}{lines:>10}{stats['dropped']:>10}{stats['sampled_out']:>13}")
+
+
+if __name__ == "__main__":
+    main()
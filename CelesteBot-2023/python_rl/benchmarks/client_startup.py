@@ -0,0 +1,61 @@
+"""
+Client startup cost: what importing `CelesteClient` (as PythonNETManager.Initialize does while the game loads) and
+then the modules its transport needs to connect costs, in a fresh interpreter per run.
+
+    import ms       importing python_rl.rl_client.celestebot_client
+    connect ms      then importing what the first connection needs (RLlib's PolicyClient for http)
+    process ms      the whole interpreter, start to exit
+    ray             whether Ray ended up imported
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.client_startup --repeats 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import python_rl.rl_client.celestebot_client
+imported = time.perf_counter()
+if {http}:
+    import python_rl.rl_client.celeste_policy_client
+connected = time.perf_counter()
+print(json.dumps({{"import": imported - start, "connect": connected - imported, "ray": "ray" in sys.modules}}))
+"""
+
+TRANSPORTS = ("binary", "http")
+
+
+def measure(transport):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", MEASURE.format(http=transport == "http")], check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'transport':<10}{'import ms':>11}{'connect ms':>12}{'process ms':>12}{'ray':>6}")
+    for transport in TRANSPORTS:
+        # A first run warms the file system cache
+        measure(transport)
+        results = [measure(transport) for _ in range(args.repeats)]
+        median = {key: np.median([result[key] for result in results]) * 1e3 for key in ("import", "connect",
+                                                                                      "process")}
+        print(f"{transport:<10}{median['import']:>11.0f}{median['connect']:>12.0f}{median['process']:>12.0f}"
+              f"{str(results[0]['ray']):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Helpers shared by the benchmarks."""
+import random
+from typing import Dict, Sequence
+
+import numpy as np
+
+from python_rl.rl_common.celestebot_env import CelesteEnv
+
+
+def make_observation_args(vision_size=CelesteEnv.VISION_SIZE):
+    """Arguments for `ext_add_observation`, shaped like the lists PythonNETManager builds."""
+    vision = [[[random.randint(0, 20)] for _ in range(vision_size)] for _ in range(vision_size)]
+    return (vision, [12.5, -40.0], 1.0, 0.5, False, False, [1024.0, 96.0], [980.0, 120.0], [960.0, 90.0],
+            False, True)
+
+
+def latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    """Mean, percentiles (in microseconds) and rate of a series of per-step latencies in seconds."""
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e6
+    return {
+        "steps_per_s": float(1 / latencies.mean()),
+        "mean_us": float(latencies.mean() * 1e6),
+        "p50_us": float(p50),
+        "p95_us": float(p95),
+        "p99_us": float(p99),
+    }
+
+
+def print_latency_table(results: Dict[str, Sequence[float]], label: str = "mode"):
+    """One row per entry of `results` (name -> per-step latencies in seconds), in milliseconds."""
+    width = max(len(label), *(len(name) for name in results)) + 2
+    print(f"{label:<{width}}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'steps/s':>10}")
+    for name, latencies in results.items():
+        summary = latency_summary(latencies)
+        print(f"{name:<{width}}{summary['mean_us'] / 1e3:>10.2f}{summary['p50_us'] / 1e3:>10.2f}"
+              f"{summary['p95_us'] / 1e3:>10.2f}{summary['p99_us'] / 1e3:>10.2f}{summary['steps_per_s']:>10.0f}")
@@ -0,0 +1,50 @@
+"""
+Cost of RLlib's observation preprocessing per observation, for the Dict observation space and the flat layout
+(rl_common/flat_observation.py), and of splitting a batch of flat observations back into vision and scalars.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.flat_observation --iterations 20000
+"""
+import argparse
+import time
+
+import numpy as np
+from ray.rllib.models.preprocessors import get_preprocessor
+
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.flat_observation import split_flat_observation
+
+
+def per_call_us(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    args = parser.parse_args()
+
+    print(f"{'layout':<8}{'transform us':>14}{'check + transform us':>22}")
+    for flat in (False, True):
+        env = CelesteEnv(None, flat_observations=flat)
+        space = env.observation_space
+        preprocessor = get_preprocessor(space)(space)
+        observation = space.sample()
+        transform = per_call_us(lambda: preprocessor.transform(observation), args.iterations)
+        checked = per_call_us(lambda: (preprocessor.check_shape(observation), preprocessor.transform(observation)),
+                              args.iterations)
+        print(f"{'flat' if flat else 'dict':<8}{transform:>14.2f}{checked:>22.2f}")
+
+    env = CelesteEnv(None, flat_observations=True)
+    batch = np.zeros((args.batch_size,) + env.observation_space.shape, dtype=np.float32)
+    split = per_call_us(lambda: split_flat_observation(batch, env.vision_size), args.iterations)
+    print(f"split_flat_observation of {args.batch_size} observations: {split:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
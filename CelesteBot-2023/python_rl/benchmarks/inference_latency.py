@@ -0,0 +1,58 @@
+"""
+Per-step latency of the client training loop (get_action + log_returns) in remote and local inference mode,
+against a local stand-in policy server.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.inference_latency --steps 500
+"""
+import argparse
+import time
+
+import numpy as np
+import requests
+from ray.rllib.env.policy_client import PolicyClient
+
+from python_rl.benchmarks.common import print_latency_table
+from python_rl.benchmarks.stand_in_server import start_stand_in_server, STAND_IN_ADDRESS
+from python_rl.rl_common.celestebot_env import CelesteEnv
+
+
+def run_client(port, inference_mode, steps, weight_sync_interval):
+    env = CelesteEnv(None)
+    observations = [env.observation_space.sample() for _ in range(32)]
+    latencies = np.empty(steps)
+    with requests.Session() as session:
+        client = PolicyClient(f"http://{STAND_IN_ADDRESS}:{port}", inference_mode=inference_mode,
+                              update_interval=weight_sync_interval, session=session)
+        episode_id = client.start_episode(training_enabled=True)
+        # warm up
+        for observation in observations[:8]:
+            client.get_action(episode_id, observation)
+            client.log_returns(episode_id, 0.0)
+        for i in range(steps):
+            start = time.perf_counter()
+            client.get_action(episode_id, observations[i % len(observations)])
+            client.log_returns(episode_id, 1.0)
+            latencies[i] = time.perf_counter() - start
+        client.end_episode(episode_id, observations[0])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--weight-sync-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    algo, port = start_stand_in_server()
+    try:
+        results = {mode: run_client(port, mode, args.steps, args.weight_sync_interval)
+                   for mode in ("remote", "local")}
+    finally:
+        algo.stop()
+
+    print_latency_table(results, "mode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+The Ray-free inference server (rl_server/inference_server.py) serving an exported policy:
+
+    startup     seconds from launching the server process to the first action a client gets, and the resident
+                memory of the process after it (Linux only)
+    throughput  steps/s of `--clients` binary clients stepping concurrently, without batching (--max-batch-size 1)
+                and with it, with the mean number of observations per forward pass and the p50/p99 step latency
+
+Export a policy first, see rl_server/policy_export.py. Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.inference_server exported/policy_fp32.pt --clients 1 4 16
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from python_rl.benchmarks.common import latency_summary
+from python_rl.rl_client.binary_policy_client import BinaryPolicyClient
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.exported_policy import ExportedPolicy
+from python_rl.rl_common.port_registry import REGISTRY_DIR_ENV_VAR
+from python_rl.rl_server.inference_server import SERVER_ADDRESS, BatchingPolicy, start_inference_server
+
+
+def resident_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def benchmark_startup(artifact, port, observation):
+    env = dict(os.environ, **{REGISTRY_DIR_ENV_VAR: tempfile.mkdtemp(prefix="celestebot_ports_")})
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "python_rl.rl_server.inference_server", artifact,
+                                "--port", str(port), "--stats-interval", "0"], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                client = BinaryPolicyClient(SERVER_ADDRESS, port, CelesteEnv(None).vision_size)
+                break
+            except ConnectionRefusedError:
+                if process.poll() is not None:
+                    raise RuntimeError("The inference server exited, run it by hand to see why")
+                time.sleep(0.01)
+        with client:
+            client.get_action(client.start_episode(), observation)
+        return time.perf_counter() - start, resident_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def benchmark_throughput(artifact, num_clients, max_batch_size, steps, observations):
+    policy = BatchingPolicy(ExportedPolicy(artifact, num_threads=1), max_batch_size)
+    server, port = start_inference_server(policy, "binary", 0)
+    latencies = [np.empty(steps) for _ in range(num_clients)]
+    barrier = threading.Barrier(num_clients + 1)
+
+    def run(client_latencies):
+        with BinaryPolicyClient(SERVER_ADDRESS, port, CelesteEnv(None).vision_size) as client:
+            episode_id = client.start_episode()
+            client.get_action(episode_id, observations[0])
+            barrier.wait()
+            for i in range(steps):
+                begin = time.perf_counter()
+                client.step(episode_id, 0.0, observations[i % len(observations)])
+                client_latencies[i] = time.perf_counter() - begin
+            client.end_episode(episode_id, observations[0])
+
+    threads = [threading.Thread(target=run, args=(client_latencies,)) for client_latencies in latencies]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    requests, batches = policy.num_requests, policy.num_batches
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+    per_batch = (policy.num_requests - requests) / max(policy.num_batches - batches, 1)
+    return num_clients * steps / elapsed, per_batch, latency_summary(np.concatenate(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("artifact")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--steps", type=int, default=500, help="Steps per client.")
+    parser.add_argument("--port", type=int, default=9990, help="Port of the startup benchmark's server.")
+    args = parser.parse_args()
+
+    space = CelesteEnv(None).observation_space
+    space.seed(0)
+    observations = [space.sample() for _ in range(64)]
+
+    seconds, memory = benchmark_startup(args.artifact, args.port, observations[0])
+    print(f"startup: first action after {seconds:.2f}s, {memory:.0f} MB resident")
+
+    print(f"{'clients':>8}{'max batch':>11}{'steps/s':>10}{'per batch':>11}{'p50 ms':>9}{'p99 ms':>9}")
+    for num_clients in args.clients:
+        for max_batch_size in (1, 64):
+            steps_per_s, per_batch, summary = benchmark_throughput(args.artifact, num_clients, max_batch_size,
+                                                                   args.steps, observations)
+            print(f"{num_clients:>8}{max_batch_size:>11}{steps_per_s:>10.0f}{per_batch:>11.2f}"
+                  f"{summary['p50_us'] / 1e3:>9.2f}{summary['p99_us'] / 1e3:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
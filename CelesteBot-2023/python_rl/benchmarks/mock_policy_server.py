@@ -0,0 +1,70 @@
+"""
+Mock policy servers that answer every request of the HTTP (`CelestePolicyClient`) and binary (`BinaryPolicyClient`)
+protocols instantly with a fixed action. No Ray and no model, so a client loop measured against them shows only the
+client side and transport cost.
+"""
+import pickle
+import socketserver
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from ray.rllib.env.policy_client import Commands
+
+from python_rl.rl_common.binary_protocol import EPISODE_HANDLE, MessageType, recv_frame, send_frame
+from python_rl.rl_common.policy_commands import STEP_COMMAND
+
+MOCK_ADDRESS = "127.0.0.1"
+MOCK_ACTION = np.array([0, 2, 1, 0])
+
+
+class _MockHTTPHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        args = pickle.loads(self.rfile.read(int(self.headers.get("Content-Length"))))
+        command = args["command"]
+        response = {}
+        if command == Commands.START_EPISODE:
+            response["episode_id"] = args["episode_id"] or uuid.uuid4().hex
+        elif command in (Commands.GET_ACTION, STEP_COMMAND):
+            response["action"] = MOCK_ACTION
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(pickle.dumps(response))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _MockBinaryHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        action = MOCK_ACTION.astype(np.uint8).tobytes()
+        while True:
+            try:
+                message_type, _ = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            if message_type == MessageType.START_EPISODE:
+                send_frame(self.request, MessageType.EPISODE, EPISODE_HANDLE.pack(0))
+            elif message_type in (MessageType.GET_ACTION, MessageType.STEP):
+                send_frame(self.request, MessageType.ACTION, action)
+            else:
+                send_frame(self.request, MessageType.OK)
+
+
+class _MockBinaryServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_mock_server(transport: str = "http", port: int = 0):
+    """Serve the given transport on a daemon thread, returns the server (call `shutdown()` when done) and port."""
+    if transport == "binary":
+        server = _MockBinaryServer((MOCK_ADDRESS, port), _MockBinaryHandler)
+    else:
+        server = ThreadingHTTPServer((MOCK_ADDRESS, port), _MockHTTPHandler)
+        server.daemon_threads = True
+    threading.Thread(name=f"mock-{transport}-server", target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
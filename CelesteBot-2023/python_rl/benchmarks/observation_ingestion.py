@@ -0,0 +1,55 @@
+"""
+Compares the two observation ingestion paths of `CelesteClient`:
+
+- `ext_add_observation`, which receives nested lists the way PythonNET hands them over, and
+- `ext_add_observation_packed`, which receives one buffer in the packed layout.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.observation_ingestion --iterations 20000
+"""
+import argparse
+import queue
+import time
+
+from python_rl.benchmarks.common import make_observation_args
+from python_rl.rl_client.celestebot_client import CelesteClient
+from python_rl.rl_common.observation_codec import pack_observation
+
+
+def time_calls(fn, args, iterations, drain):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(*args)
+        drain()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    client = CelesteClient(queue.Queue())
+    observation_args = make_observation_args()
+    packed = pack_observation(*observation_args)
+
+    def drain():
+        client.env.transitions.get(timeout=0)
+
+    # warm up both paths
+    time_calls(client.ext_add_observation, observation_args, 100, drain)
+    time_calls(client.ext_add_observation_packed, (packed,), 100, drain)
+
+    list_time = time_calls(client.ext_add_observation, observation_args, args.iterations, drain)
+    packed_bytes_time = time_calls(client.ext_add_observation_packed, (packed,), args.iterations, drain)
+    packed_view_time = time_calls(client.ext_add_observation_packed, (memoryview(packed),), args.iterations, drain)
+
+    print(f"{'path':<28}{'us/observation':>16}{'speedup':>10}")
+    for name, seconds in (("nested lists", list_time),
+                          ("packed bytes", packed_bytes_time),
+                          ("packed memoryview", packed_view_time)):
+        print(f"{name:<28}{seconds * 1e6:>16.2f}{list_time / seconds:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
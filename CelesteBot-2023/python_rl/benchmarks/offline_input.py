@@ -0,0 +1,117 @@
+"""
+Training from recordings with RecordedTrajectoryInput. The recording is generated first, with random observations.
+
+    reader   SampleBatch throughput of the input alone, i.e. how fast a learner could be fed, for shuffled and
+             sequential reads and different numbers of reader threads
+    learner  transitions/s trained by behavior cloning with the stand-in server's model (what --offline-input of
+             celestebot_server.py runs): `learn_on_batch` on a batch already in memory, i.e. the learner in
+             isolation, and `BC.train()` iterations reading the recording, i.e. reading and learning together
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.offline_input --rows 100000 --batch-size 512
+"""
+import argparse
+import tempfile
+import time
+
+from ray.rllib.algorithms.bc import BCConfig
+from ray.rllib.offline.io_context import IOContext
+
+from python_rl.benchmarks.stand_in_server import stand_in_model
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.trajectory_recorder import TrajectoryRecorder
+from python_rl.rl_server.recorded_trajectory_input import RecordedTrajectoryInput
+
+
+def make_recording(directory, rows, episode_length):
+    env = CelesteEnv(None)
+    recorder = TrajectoryRecorder(directory, env.observation_space, env.action_space)
+    observations = [env.observation_space.sample() for _ in range(64)]
+    for i in range(rows):
+        if i % episode_length == 0:
+            recorder.start_episode()
+            recorder.record(observations[i % 64], float("nan"), 0, i)
+        else:
+            recorder.record(observations[i % 64], 1.0, 1 if i % episode_length == episode_length - 1 else 0, i,
+                            env.action_space.sample())
+    recorder.close()
+
+
+def benchmark(directory, batch_size, shuffle, num_readers, seconds):
+    reader = RecordedTrajectoryInput(IOContext(config={"train_batch_size": batch_size}), directory, shuffle=shuffle,
+                                     num_readers=num_readers)
+    reader.next()
+    batches, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        reader.next()
+        batches += 1
+    elapsed = time.perf_counter() - start
+    return batches / elapsed, batches * reader.batch_size / elapsed
+
+
+def build_behavior_cloning(directory, batch_size):
+    env = CelesteEnv(None)
+    return (
+        BCConfig()
+        .rl_module(_enable_rl_module_api=False)
+        .training(_enable_learner_api=False, train_batch_size=batch_size, model=stand_in_model(env))
+        .environment(env=None, observation_space=env.observation_space, action_space=env.action_space)
+        .framework("torch")
+        .offline_data(input_=lambda ioctx: RecordedTrajectoryInput(ioctx, directory))
+        .rollouts(num_rollout_workers=0)
+        .evaluation(off_policy_estimation_methods={})
+        .debugging(log_level="WARN")
+    ).build()
+
+
+def benchmark_learner(directory, batch_size, seconds):
+    """Transitions/s trained by `learn_on_batch` on one batch in memory and by `train()` reading the recording."""
+    algo = build_behavior_cloning(directory, batch_size)
+    try:
+        policy = algo.get_policy()
+        batch = RecordedTrajectoryInput(IOContext(config={"train_batch_size": batch_size}), directory).next()
+        policy.learn_on_batch(batch)
+        trained, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            policy.learn_on_batch(batch)
+            trained += batch.count
+        learn_on_batch = trained / (time.perf_counter() - start)
+
+        algo.train()
+        trained, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            trained += algo.train()["num_env_steps_trained_this_iter"]
+        return learn_on_batch, trained / (time.perf_counter() - start)
+    finally:
+        algo.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--episode-length", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--modes", nargs="+", default=["reader", "learner"], choices=["reader", "learner"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_recording(directory, args.rows, args.episode_length)
+        if "reader" in args.modes:
+            print(f"{'order':<12}{'readers':>8}{'batches/s':>12}{'transitions/s':>16}")
+            for shuffle in (True, False):
+                for num_readers in args.readers:
+                    batches_per_s, transitions_per_s = benchmark(directory, args.batch_size, shuffle, num_readers,
+                                                                 args.seconds)
+                    order = "shuffled" if shuffle else "sequential"
+                    print(f"{order:<12}{num_readers:>8}{batches_per_s:>12.1f}{transitions_per_s:>16.0f}")
+        if "learner" in args.modes:
+            learn_on_batch, train = benchmark_learner(directory, args.batch_size, args.seconds)
+            print(f"{'BC learner':<20}{'transitions/s':>16}")
+            print(f"{'learn_on_batch':<20}{learn_on_batch:>16.0f}")
+            print(f"{'train()':<20}{train:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Exports (rl_server/policy_export.py) the stand-in server's policy without and with the attention net that
+`celestebot_server.py` trains, in fp32 and fp16, and checks every artifact against the RLlib model: largest logit,
+value and state error and the share of observations getting the same greedy actions. Fails if an artifact can't be
+exported or agrees on fewer than `--min-agreement` of the actions. ONNX is included when the onnx package is
+installed. "export s" is the time to export and check all of a model's artifacts.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.policy_export
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+from python_rl.benchmarks.stand_in_server import build_stand_in_config, get_free_port
+from python_rl.rl_server.policy_export import PRECISIONS, export_policy
+
+# The attention settings of celestebot_server.py
+SERVER_ATTENTION = {
+    "use_attention": True,
+    "attention_dim": 256,
+    "attention_head_dim": 128,
+    "attention_num_transformer_units": 6,
+    "attention_memory_inference": 50,
+    "attention_memory_training": 50,
+    "attention_num_heads": 6,
+}
+MODELS = {"fully_connected": {}, "attention": SERVER_ATTENTION}
+
+
+def save_checkpoint(model_overrides, directory):
+    config = build_stand_in_config(get_free_port(), "binary")
+    config.training(model=dict(config.model, **model_overrides))
+    algo = config.build()
+    try:
+        algo.save(directory)
+    finally:
+        algo.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--observations", type=int, default=256)
+    parser.add_argument("--min-agreement", type=float, default=0.95)
+    args = parser.parse_args()
+
+    import ray
+    ray.init(num_cpus=2, include_dashboard=False, log_to_driver=False)
+    formats = ["torchscript"] + (["onnx"] if importlib.util.find_spec("onnx") is not None else [])
+    directory = tempfile.mkdtemp(prefix="celestebot_export_")
+
+    failures = []
+    print(f"{'model':<17}{'artifact':<20}{'export s':>9}{'logit err':>11}{'value err':>11}{'state err':>11}"
+          f"{'actions':>9}")
+    for name in args.models:
+        checkpoint = os.path.join(directory, name)
+        save_checkpoint(MODELS[name], checkpoint)
+        start = time.perf_counter()
+        reports = export_policy(checkpoint, os.path.join(checkpoint, "exported"), formats, PRECISIONS,
+                                num_observations=args.observations)
+        seconds = time.perf_counter() - start
+        for report in reports:
+            parity = report["parity"]
+            state_errors = [v for k, v in parity.items() if k.startswith("max_state_out_")]
+            state_error = f"{max(state_errors):>11.2e}" if state_errors else f"{'-':>11}"
+            print(f"{name:<17}{os.path.basename(report['artifact']):<20}{seconds:>9.1f}"
+                  f"{parity['max_logit_error']:>11.2e}{parity['max_value_error']:>11.2e}{state_error}"
+                  f"{parity['action_agreement']:>9.1%}")
+            if parity["action_agreement"] < args.min_agreement:
+                failures.append(f"{name} {os.path.basename(report['artifact'])}")
+    if failures:
+        raise SystemExit(f"Greedy actions agree on less than {args.min_agreement:.0%}: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+A local stand-in for `celestebot_server.py`: one PPO algorithm with a single policy server input, a small model
+and no Tune, so benchmarks can talk to a real policy server on localhost in a few seconds.
+"""
+import socket
+
+import ray
+from ray.rllib.algorithms.ppo import PPOConfig
+
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.flat_observation_model import FlatObservationModel
+from python_rl.rl_server.binary_policy_server_input import BinaryPolicyServerInput
+from python_rl.rl_server.celeste_policy_server_input import CelestePolicyServerInput
+
+STAND_IN_ADDRESS = "127.0.0.1"
+STAND_IN_MODEL = {
+    "dim": CelesteEnv.VISION_SIZE,
+    "conv_filters": [[16, [3, 3], 2], [32, [3, 3], 2], [64, [3, 3], 1]],
+    "fcnet_hiddens": [64, 64],
+}
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((STAND_IN_ADDRESS, 0))
+        return s.getsockname()[1]
+
+
+def stand_in_model(env: CelesteEnv) -> dict:
+    """STAND_IN_MODEL for `env`'s vision size and observation layout, as the server sets it up."""
+    model = dict(STAND_IN_MODEL, dim=env.vision_size)
+    if env.flat_layout is not None:
+        model["custom_model"] = FlatObservationModel
+    return model
+
+
+def build_stand_in_config(port: int, transport: str = "http") -> PPOConfig:
+    env = CelesteEnv(None)
+    server_input_cls = BinaryPolicyServerInput if transport == "binary" else CelestePolicyServerInput
+
+    def input_factory(ioctx):
+        return server_input_cls(ioctx, STAND_IN_ADDRESS, port, idle_timeout=0.25)
+
+    return (
+        PPOConfig()
+        .rl_module(_enable_rl_module_api=False)
+        .training(_enable_learner_api=False, model=stand_in_model(env), train_batch_size=256, sgd_minibatch_size=64,
+                  num_sgd_iter=1)
+        .environment(env=None, observation_space=env.observation_space, action_space=env.action_space)
+        .framework("torch")
+        .offline_data(input_=input_factory, offline_sampling=False, shuffle_buffer_size=0)
+        .rollouts(num_rollout_workers=0, enable_connectors=False)
+        .evaluation(off_policy_estimation_methods={})
+        .debugging(log_level="WARN")
+    )
+
+
+def start_stand_in_server(port: int = None, transport: str = "http"):
+    """
+    Build the stand-in algorithm, which starts listening on `port` with the given transport ("http" or
+    "binary"), and return it with the port.
+    """
+    if not ray.is_initialized():
+        ray.init(num_cpus=2, include_dashboard=False, log_to_driver=False)
+    port = port or get_free_port()
+    algo = build_stand_in_config(port, transport).build()
+    return algo, port
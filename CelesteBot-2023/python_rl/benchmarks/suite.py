@@ -0,0 +1,216 @@
+"""
+Benchmark suite for the python_rl hot paths. Results are written as JSON so runs on different commits can be
+compared with --compare.
+
+Micro benchmarks, single threaded, one timed call per iteration:
+    ext_add_observation         CelesteClient ingestion of nested lists, as PythonNET hands them over
+    ext_add_observation_packed  CelesteClient ingestion of one packed buffer
+    env_step                    CelesteEnv.step with a transition already published
+    env_reset                   CelesteEnv.reset with a transition already published
+    add_action                  CelesteEnv.add_action, i.e. the tolist() conversion and the queue put
+
+Macro benchmarks, the full client loop (CelesteClient.start_training) fed by the synthetic game against a mock
+policy server that answers instantly, per transport:
+    client_loop_http, client_loop_binary
+    client_loop_asyncio         binary transport with the asyncio client loop
+
+Every result has steps/s and latency percentiles. Micro benchmarks also report the peak bytes allocated during a
+call and the number of memory blocks still allocated afterwards (a leak shows up as a non-zero value), both per
+step, measured in a separate pass under tracemalloc.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.suite --output before.json
+    $ python -m python_rl.benchmarks.suite --output after.json --compare before.json
+"""
+import argparse
+import gc
+import itertools
+import json
+import platform
+import queue
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from python_rl.benchmarks.common import latency_summary, make_observation_args
+from python_rl.benchmarks.mock_policy_server import start_mock_server
+from python_rl.rl_client.celestebot_client import CelesteClient
+from python_rl.rl_common.observation_codec import pack_observation
+from python_rl.rl_common.synthetic_celeste import SyntheticGameRunner
+from python_rl.rl_common.transition_buffer import NO_REWARD
+
+MICRO_BENCHMARKS = ("ext_add_observation", "ext_add_observation_packed", "env_step", "env_reset", "add_action")
+MACRO_BENCHMARKS = ("client_loop_http", "client_loop_binary", "client_loop_asyncio")
+
+
+def micro_case(name, client):
+    """Returns (before, timed, after) callables for one iteration of micro benchmark `name`."""
+    env = client.env
+    observation_args = make_observation_args()
+    packed = pack_observation(*observation_args)
+    action = np.array([1, 2, 3, 1])
+    # CelesteEnv checks that sequence numbers are consecutive
+    sequence = itertools.count()
+
+    def drain_transition():
+        env.transitions.get(timeout=0)
+
+    def drain_action():
+        env.action_queue.get_nowait()
+
+    def publish_step():
+        client.ext_add_transition_packed(next(sequence), 1.0, packed)
+
+    def publish_reset():
+        client.ext_add_transition_packed(next(sequence), NO_REWARD, packed)
+
+    def nothing():
+        pass
+
+    if name == "ext_add_observation":
+        return nothing, lambda: client.ext_add_observation(*observation_args), drain_transition
+    elif name == "ext_add_observation_packed":
+        return nothing, lambda: client.ext_add_observation_packed(packed), drain_transition
+    elif name == "env_step":
+        return publish_step, lambda: env.step(action), drain_action
+    elif name == "env_reset":
+        return publish_reset, env.reset, nothing
+    elif name == "add_action":
+        return nothing, lambda: env.add_action(action), drain_action
+    raise ValueError(f"Unknown benchmark {name}")
+
+
+def run_micro(name, iterations):
+    client = CelesteClient(queue.Queue())
+    before, timed, after = micro_case(name, client)
+    for _ in range(min(iterations, 200)):
+        before()
+        timed()
+        after()
+
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        before()
+        start = time.perf_counter()
+        timed()
+        latencies[i] = time.perf_counter() - start
+        after()
+    result = latency_summary(latencies)
+
+    allocation_iterations = max(iterations // 10, 1)
+    gc.collect()
+    tracemalloc.start()
+    peak_total = 0
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(allocation_iterations):
+        before()
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        timed()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - current
+        after()
+    retained_blocks = sys.getallocatedblocks() - blocks_before
+    tracemalloc.stop()
+    result["alloc_peak_bytes_per_step"] = peak_total / allocation_iterations
+    result["retained_blocks_per_step"] = retained_blocks / allocation_iterations
+    return result
+
+
+def run_macro(name, seconds):
+    client_loop = "asyncio" if name == "client_loop_asyncio" else "thread"
+    transport = "binary" if client_loop == "asyncio" else name.rsplit("_", 1)[1]
+    server, port = start_mock_server(transport)
+    try:
+        client = CelesteClient(queue.Queue(), inference_mode="remote", transport=transport, client_loop=client_loop,
+                               port=port)
+        # Keep every step in one histogram window
+        client.latency.flush_interval = float("inf")
+        runner = SyntheticGameRunner(client, packed=True)
+        threading.Thread(name="TrainingLoop", target=client.start_training, daemon=True).start()
+        runner.start()
+        time.sleep(min(seconds / 4, 1.0))
+        decision = client.latency.histograms["decision"]
+        decision.reset()
+        start_steps, start = runner.num_steps, time.perf_counter()
+        time.sleep(seconds)
+        steps = runner.num_steps - start_steps
+        elapsed = time.perf_counter() - start
+        runner.stop()
+        summary = decision.summary()
+        return {
+            "steps_per_s": steps / elapsed,
+            "mean_us": summary["mean_ms"] * 1e3,
+            "p50_us": summary["p50_ms"] * 1e3,
+            "p95_us": summary["p95_ms"] * 1e3,
+            "p99_us": summary["p99_ms"] * 1e3,
+        }
+    finally:
+        server.shutdown()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'benchmark':<30}{'steps/s':>12}{'mean us':>10}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}" \
+             f"{'peak B':>10}{'blocks':>8}"
+    print(header + (f"{'vs base':>10}" if baseline else ""))
+    for name, result in results.items():
+        peak = f"{result['alloc_peak_bytes_per_step']:.0f}" if "alloc_peak_bytes_per_step" in result else "-"
+        blocks = f"{result['retained_blocks_per_step']:.2f}" if "retained_blocks_per_step" in result else "-"
+        line = (f"{name:<30}{result['steps_per_s']:>12.0f}{result['mean_us']:>10.1f}{result['p50_us']:>10.1f}"
+                f"{result['p95_us']:>10.1f}{result['p99_us']:>10.1f}{peak:>10}{blocks:>8}")
+        if baseline and name in baseline:
+            line += f"{result['steps_per_s'] / baseline[name]['steps_per_s']:>9.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000, help="Iterations per micro benchmark.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Measured duration per macro benchmark.")
+    parser.add_argument("--benchmarks", nargs="+", default=list(MICRO_BENCHMARKS + MACRO_BENCHMARKS),
+                        choices=MICRO_BENCHMARKS + MACRO_BENCHMARKS)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare steps/s against.")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.benchmarks:
+        if name in MICRO_BENCHMARKS:
+            results[name] = run_micro(name, args.iterations)
+        else:
+            results[name] = run_macro(name, args.seconds)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "seconds": args.seconds,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
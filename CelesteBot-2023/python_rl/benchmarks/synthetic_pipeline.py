@@ -0,0 +1,123 @@
+"""
+End-to-end throughput with the synthetic stand-in game (rl_common/synthetic_celeste.py) in place of Celeste:
+
+    game            the synthetic game alone, random actions
+    env             game -> CelesteClient callbacks -> CelesteEnv.step with random actions, no server
+    http, binary    game -> CelesteClient.start_training -> local stand-in policy server, per transport
+
+steps/s counts decisions, game steps/s the synthetic game steps they cover, which differ with
+--max-action-repeat (the action repeat dimension, see CelesteEnv). --flat-observations runs everything on the flat
+observation layout (rl_common/flat_observation.py).
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.synthetic_pipeline --seconds 10
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from python_rl.benchmarks.stand_in_server import start_stand_in_server
+from python_rl.rl_client.celestebot_client import CelesteClient
+from python_rl.rl_common.celestebot_env import MAX_ACTION_REPEAT_ENV_VAR
+from python_rl.rl_common.flat_observation import OBSERVATION_LAYOUT_ENV_VAR
+from python_rl.rl_common.synthetic_celeste import SyntheticCeleste, SyntheticGameRunner
+
+
+def random_actions(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.stack([rng.integers(0, n, count) for n in (3, 3, 4, 2)], axis=1).tolist()
+
+
+def benchmark_game(seconds):
+    game = SyntheticCeleste()
+    actions = random_actions(10000)
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for action in actions:
+            _, death, finished_level = game.step(action)
+            game.observation_args()
+            if death or finished_level:
+                game.reset()
+        steps += len(actions)
+    rate = steps / (time.perf_counter() - start)
+    return rate, rate, None
+
+
+def benchmark_env(seconds, packed):
+    client = CelesteClient(queue.Queue(), inference_mode="remote")
+    runner = SyntheticGameRunner(client, packed=packed)
+    runner.start()
+    env = client.env
+    env.action_space.seed(0)
+    actions = [env.action_space.sample() for _ in range(1000)]
+    env.reset()
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for action in actions:
+            _, _, terminated, _, _ = env.step(action)
+            if terminated:
+                env.reset()
+        steps += len(actions)
+    elapsed = time.perf_counter() - start
+    runner.stop()
+    return steps / elapsed, runner.num_game_steps / elapsed, env.transition_stats()
+
+
+def benchmark_client(seconds, transport, packed):
+    algo, port = start_stand_in_server(transport=transport)
+    try:
+        client = CelesteClient(queue.Queue(), inference_mode="remote", transport=transport, port=port)
+        runner = SyntheticGameRunner(client, packed=packed)
+        threading.Thread(name="TrainingLoop", target=client.start_training, daemon=True).start()
+        runner.start()
+        # Let the server build its embedded worker and the first batches go through
+        time.sleep(2.0)
+        start_steps, start_game_steps, start = runner.num_steps, runner.num_game_steps, time.perf_counter()
+        time.sleep(seconds)
+        elapsed = time.perf_counter() - start
+        runner.stop()
+        return ((runner.num_steps - start_steps) / elapsed, (runner.num_game_steps - start_game_steps) / elapsed,
+                client.env.transition_stats())
+    finally:
+        algo.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--packed", action="store_true",
+                        help="Publish observations with ext_add_transition_packed instead of nested lists.")
+    parser.add_argument("--stages", nargs="+", default=["game", "env", "http", "binary"],
+                        choices=["game", "env", "http", "binary"])
+    parser.add_argument("--max-action-repeat", type=int, default=1,
+                        help="Add the action repeat dimension with this many choices (1 = off).")
+    parser.add_argument("--flat-observations", action="store_true")
+    args = parser.parse_args()
+    # Read by every CelesteEnv, so the client's and the stand-in server's spaces agree
+    os.environ[MAX_ACTION_REPEAT_ENV_VAR] = str(args.max_action_repeat)
+    os.environ[OBSERVATION_LAYOUT_ENV_VAR] = "flat" if args.flat_observations else "dict"
+
+    results = {}
+    for stage in args.stages:
+        if stage == "game":
+            results[stage] = benchmark_game(args.seconds)
+        elif stage == "env":
+            results[stage] = benchmark_env(args.seconds, args.packed)
+        else:
+            results[stage] = benchmark_client(args.seconds, stage, args.packed)
+
+    print(f"{'stage':<10}{'steps/s':>10}{'game steps/s':>14}{'mean wait ms':>14}{'sequence gaps':>15}")
+    for stage, (rate, game_rate, stats) in results.items():
+        wait = f"{stats['mean_wait_time_s'] * 1e3:.3f}" if stats else "-"
+        gaps = stats["sequence_gaps"] if stats else "-"
+        print(f"{stage:<10}{rate:>10.0f}{game_rate:>14.0f}{wait:>14}{gaps:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Cost of recording transitions with TrajectoryRecorder: the time `record` adds to a step, the rows/s the writer
+thread keeps up with, and random access into the memory mapped recording afterwards.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.trajectory_recorder --rows 200000
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from python_rl.benchmarks.common import latency_summary, make_observation_args
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.trajectory_recorder import TrajectoryRecorder, open_recording
+
+
+def make_observation(env):
+    vision, speed_x_y, can_dash, stamina, _, _, target, position, _, is_climbing, on_ground = make_observation_args()
+    observation = env.observation_space.sample()
+    observation["map_entities_vision"][:] = np.asarray(vision, dtype=np.uint8).reshape(
+        observation["map_entities_vision"].shape)
+    return observation
+
+
+def benchmark(rows, chunk_size, directory):
+    env = CelesteEnv(None)
+    observation = make_observation(env)
+    action = env.action_space.sample()
+    recorder = TrajectoryRecorder(directory, env.observation_space, env.action_space, chunk_size=chunk_size)
+    recorder.set_level("benchmark")
+    latencies = np.empty(rows)
+    start = time.perf_counter()
+    for i in range(rows):
+        if i % 500 == 0:
+            recorder.start_episode()
+        step_start = time.perf_counter()
+        recorder.record(observation, 1.0, 0, i, action)
+        latencies[i] = time.perf_counter() - step_start
+    record_elapsed = time.perf_counter() - start
+    recorder.close()
+    total_elapsed = time.perf_counter() - start
+
+    columns = open_recording(directory)
+    indices = np.random.default_rng(0).integers(0, columns["reward"].shape[0], size=10000)
+    start = time.perf_counter()
+    for index in indices:
+        columns["map_entities_vision"][index].sum()
+    random_access = (time.perf_counter() - start) / len(indices)
+    return latencies, record_elapsed, total_elapsed, recorder.dropped_rows, columns["reward"].shape[0], random_access
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        latencies, record_elapsed, total_elapsed, dropped, rows, random_access = benchmark(
+            args.rows, args.chunk_size, directory)
+    summary = latency_summary(latencies)
+    print(f"record(): mean {summary['mean_us']:.2f} us, p50 {summary['p50_us']:.2f} us, "
+          f"p99 {summary['p99_us']:.2f} us")
+    print(f"recorded {args.rows / record_elapsed:.0f} rows/s, written to disk {rows / total_elapsed:.0f} rows/s, "
+          f"dropped {dropped}")
+    print(f"random row access through the memory map: {random_access * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Latency and throughput of one client training-loop step over RLlib's HTTP PolicyClient and over the binary
+transport, each against a local stand-in policy server. A step is either get_action + log_returns (two round
+trips) or the combined `step` request (one round trip).
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.transport_latency --steps 1000
+"""
+import argparse
+import time
+
+import numpy as np
+import requests
+
+from python_rl.benchmarks.common import print_latency_table
+from python_rl.benchmarks.stand_in_server import start_stand_in_server, STAND_IN_ADDRESS
+from python_rl.rl_client.binary_policy_client import BinaryPolicyClient
+from python_rl.rl_client.celeste_policy_client import CelestePolicyClient
+from python_rl.rl_common.celestebot_env import CelesteEnv
+
+
+def run_steps(client, steps, observations, combined):
+    latencies = np.empty(steps)
+    episode_id = client.start_episode(training_enabled=True)
+    for observation in observations[:8]:
+        client.get_action(episode_id, observation)
+        client.log_returns(episode_id, 0.0)
+    for i in range(steps):
+        start = time.perf_counter()
+        if combined:
+            client.step(episode_id, 1.0, observations[i % len(observations)])
+        else:
+            client.get_action(episode_id, observations[i % len(observations)])
+            client.log_returns(episode_id, 1.0)
+        latencies[i] = time.perf_counter() - start
+    client.end_episode(episode_id, observations[0])
+    return latencies
+
+
+def benchmark_transport(transport, steps, observations):
+    """Returns the latencies of separate and of combined steps."""
+    algo, port = start_stand_in_server(transport=transport)
+    try:
+        if transport == "binary":
+            with BinaryPolicyClient(STAND_IN_ADDRESS, port) as client:
+                return run_steps(client, steps, observations, False), run_steps(client, steps, observations, True)
+        with requests.Session() as session:
+            client = CelestePolicyClient(f"http://{STAND_IN_ADDRESS}:{port}", inference_mode="remote",
+                                         session=session)
+            return run_steps(client, steps, observations, False), run_steps(client, steps, observations, True)
+    finally:
+        algo.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=1000)
+    args = parser.parse_args()
+
+    env = CelesteEnv(None)
+    observations = [env.observation_space.sample() for _ in range(32)]
+    results = {}
+    for transport in ("http", "binary"):
+        results[transport], results[f"{transport} step"] = benchmark_transport(transport, args.steps, observations)
+
+    print_latency_table(results, "transport")
+
+
+if __name__ == "__main__":
+    main()
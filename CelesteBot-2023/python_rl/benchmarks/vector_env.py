@@ -0,0 +1,66 @@
+"""
+Throughput of CelesteVectorEnv over N synthetic games in "all" and "ready" wait mode, with one game stalling for
+--stall-ms on every step to show what a slow instance costs the batch. Actions come from one batched sample per
+step, standing in for a batched policy forward pass.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.vector_env --envs 8 --seconds 5
+"""
+import argparse
+import queue
+import time
+
+from python_rl.rl_client.celestebot_client import CelesteClient
+from python_rl.rl_common.celeste_vector_env import CelesteVectorEnv
+from python_rl.rl_common.synthetic_celeste import SyntheticCeleste, SyntheticGameRunner
+
+
+class StallingSyntheticCeleste(SyntheticCeleste):
+
+    def __init__(self, stall, **kwargs):
+        self.stall = stall
+        super().__init__(**kwargs)
+
+    def step(self, action):
+        time.sleep(self.stall)
+        return super().step(action)
+
+
+def benchmark(num_envs, wait_mode, seconds, stall):
+    runners = []
+    for i in range(num_envs):
+        client = CelesteClient(queue.Queue())
+        game = StallingSyntheticCeleste(stall) if i == 0 and stall > 0 else SyntheticCeleste()
+        runners.append(SyntheticGameRunner(client, game, packed=True))
+    for runner in runners:
+        runner.start()
+    vector_env = CelesteVectorEnv([runner.client.env for runner in runners], wait_mode=wait_mode, copy=False)
+    vector_env.reset()
+    start_steps = [runner.num_steps for runner in runners]
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        actions = vector_env.action_space.sample()
+        vector_env.step(actions)
+    elapsed = time.perf_counter() - start
+    per_env = [(runner.num_steps - start_steps[i]) / elapsed for i, runner in enumerate(runners)]
+    for runner in runners:
+        runner.stop()
+    return sum(per_env), per_env
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--envs", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--stall-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    print(f"{'wait mode':<10}{'env steps/s':>14}{'stalled env steps/s':>22}{'other envs steps/s':>22}")
+    for wait_mode in ("all", "ready"):
+        total, per_env = benchmark(args.envs, wait_mode, args.seconds, args.stall_ms / 1e3)
+        others = sum(per_env[1:]) / max(len(per_env) - 1, 1)
+        print(f"{wait_mode:<10}{total:>14.0f}{per_env[0]:>22.0f}{others:>22.0f}")
+
+
+if __name__ == "__main__":
+    main()
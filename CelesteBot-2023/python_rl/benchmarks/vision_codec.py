@@ -0,0 +1,73 @@
+"""
+Bytes per step on the wire and encode/decode cost of the vision codec (rl_common/vision_codec.py), on vision frames
+recorded from the synthetic game under random actions. Compared against the pickled observation dict the HTTP
+PolicyClient sends and the fixed size packed observation.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.vision_codec --steps 5000
+"""
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+from python_rl.rl_common.observation_codec import SCALARS_SIZE, VISION_OFFSET, PackedObservationDecoder, \
+    packed_observation_size, pack_observation
+from python_rl.rl_common.synthetic_celeste import SyntheticCeleste
+from python_rl.rl_common.vision_codec import VisionDeltaDecoder, VisionDeltaEncoder
+
+
+def record_episodes(steps, seed=0):
+    """Vision frames of consecutive synthetic episodes, as a list of episodes, plus one sample observation dict."""
+    game = SyntheticCeleste()
+    rng = np.random.default_rng(seed)
+    episodes = [[game.render_vision().copy()]]
+    for _ in range(steps):
+        _, death, finished_level = game.step(rng.integers(0, [3, 3, 4, 2]))
+        if death or finished_level:
+            game.reset()
+            episodes.append([])
+        episodes[-1].append(game.render_vision().copy())
+    vision, speed_x_y, can_dash, stamina, *rest = game.observation_args()
+    packed = pack_observation(vision, speed_x_y, can_dash, stamina, False, False, *rest)
+    observation, _, _ = PackedObservationDecoder().decode(packed)
+    return episodes, observation
+
+
+def benchmark_delta(episodes, keyframe_interval):
+    sizes, encode_times, decode_times = [], [], []
+    for frames in episodes:
+        encoder, decoder = VisionDeltaEncoder(keyframe_interval=keyframe_interval), VisionDeltaDecoder()
+        for frame in frames:
+            start = time.perf_counter()
+            encoded = encoder.encode(frame)
+            encode_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            decoded = decoder.decode(encoded)
+            decode_times.append(time.perf_counter() - start)
+            if not np.array_equal(decoded, frame.reshape(-1)):
+                raise AssertionError("Vision frame did not survive the round trip")
+            # The packed header and float block travel with every encoded frame
+            sizes.append(VISION_OFFSET + SCALARS_SIZE + len(encoded))
+    return np.mean(sizes), np.mean(encode_times), np.mean(decode_times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--keyframe-intervals", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    episodes, observation = record_episodes(args.steps)
+    print(f"{sum(len(frames) for frames in episodes)} frames in {len(episodes)} episodes")
+    print(f"{'encoding':<24}{'bytes/step':>12}{'encode us':>12}{'decode us':>12}")
+    print(f"{'pickled dict (http)':<24}{len(pickle.dumps(observation)):>12}{'-':>12}{'-':>12}")
+    print(f"{'packed':<24}{packed_observation_size():>12}{'-':>12}{'-':>12}")
+    for interval in args.keyframe_intervals:
+        size, encode_time, decode_time = benchmark_delta(episodes, interval)
+        print(f"{f'delta, keyframe {interval}':<24}{size:>12.0f}{encode_time * 1e6:>12.1f}{decode_time * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
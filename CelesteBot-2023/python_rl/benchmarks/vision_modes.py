@@ -0,0 +1,94 @@
+"""
+Cost of every vision mode (rl_common/vision_modes.py), end to end:
+
+    transform us    reducing one game vision grid on the client
+    infer ms        one forward pass of the stand-in server's model for a single observation, as in get_action
+    sgd ms          forward + backward + optimizer step on one SGD minibatch
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.benchmarks.vision_modes --minibatch 64
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from ray.rllib.models import ModelCatalog
+from ray.rllib.models.preprocessors import get_preprocessor
+
+from python_rl.benchmarks.stand_in_server import STAND_IN_MODEL
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.synthetic_celeste import SyntheticCeleste
+from python_rl.rl_common.vision_modes import VisionTransform, parse_vision_mode
+
+MODES = ["full", "crop:20", "pool:20", "pool:10"]
+
+
+def per_call(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def game_visions(count):
+    game = SyntheticCeleste()
+    rng = np.random.default_rng(0)
+    visions = []
+    for _ in range(count):
+        _, death, finished_level = game.step(rng.integers(0, (3, 3, 4, 2)))
+        visions.append(game.render_vision().copy())
+        if death or finished_level:
+            game.reset()
+    return visions
+
+
+def benchmark_mode(transform, visions, iterations, minibatch):
+    env = CelesteEnv(None, vision_transform=transform, flat_observations=False)
+    out = np.zeros((transform.size, transform.size, 1), dtype=np.uint8)
+    index = iter(range(1 << 62))
+    transform_s = per_call(lambda: transform.apply(visions[next(index) % len(visions)], out), iterations)
+
+    space = env.observation_space
+    preprocessor = get_preprocessor(space)(space)
+    observations = torch.from_numpy(np.stack([preprocessor.transform(space.sample()) for _ in range(minibatch)]))
+    model = ModelCatalog.get_model_v2(space, env.action_space, int(np.sum(env.action_space.nvec)),
+                                      dict(STAND_IN_MODEL, dim=env.vision_size), framework="torch")
+    optimizer = torch.optim.Adam(model.parameters())
+
+    def infer():
+        with torch.no_grad():
+            model({"obs": observations[:1]})
+
+    def sgd():
+        logits, _ = model({"obs": observations})
+        loss = logits.pow(2).mean() + model.value_function().pow(2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    return transform_s, per_call(infer, iterations // 10), per_call(sgd, max(iterations // 100, 5))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--minibatch", type=int, default=64)
+    parser.add_argument("--modes", nargs="+", default=MODES)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    visions = game_visions(256)
+    print(f"{'mode':<10}{'vocabulary':<12}{'cells':>7}{'transform us':>14}{'infer ms':>10}{'sgd ms':>10}")
+    for spec in args.modes:
+        mode, size = parse_vision_mode(spec)
+        for compact in (False, True):
+            transform = VisionTransform(mode, size, compact)
+            transform_s, infer_s, sgd_s = benchmark_mode(transform, visions, args.iterations, args.minibatch)
+            print(f"{spec:<10}{'compact' if compact else 'raw':<12}{size * size:>7}{transform_s * 1e6:>14.2f}"
+                  f"{infer_s * 1e3:>10.3f}{sgd_s * 1e3:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
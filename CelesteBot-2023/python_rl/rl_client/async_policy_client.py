@@ -0,0 +1,164 @@
+"""
+asyncio client side of the binary transport (see rl_common/binary_protocol.py).
+
+`AsyncBinaryPolicyConnection` pipelines requests: every method writes its frame right away and returns a future
+for the reply, and a reader task resolves the futures in order as replies arrive, since the server answers every
+message in order. Requests that don't need their reply before the next one (log_returns, end_episode, starting the
+next episode) can be sent back to back without waiting a round trip for each.
+
+Episode handles are only valid on the connection that started the episode, so an episode sticks to one
+connection. `AsyncConnectionPool` keeps up to `size` keep-alive connections to one server for the loops of a
+process to check out.
+"""
+from __future__ import annotations
+
+import asyncio
+import socket
+from collections import deque
+from typing import Deque, Tuple
+
+import numpy as np
+
+from python_rl.rl_client.binary_policy_client import EpisodeObservationEncoder, check_reply
+from python_rl.rl_common.binary_protocol import EPISODE_HANDLE, FRAME_HEADER, LOG_RETURNS, START_EPISODE, STEP, \
+    MessageType, encode_info, pack_frame, parse_frame_header
+from python_rl.rl_common.observation_codec import DEFAULT_VISION_SIZE
+from python_rl.rl_common.vision_codec import DEFAULT_KEYFRAME_INTERVAL, VisionEncoding
+
+
+class AsyncBinaryPolicyConnection:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 encoder: EpisodeObservationEncoder):
+        self._reader = reader
+        self._writer = writer
+        self._encoder = encoder
+        self._pending = deque()  # type: Deque[Tuple[asyncio.Future, MessageType, MessageType]]
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_replies())
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, address: str, port: int, vision_size: int = DEFAULT_VISION_SIZE,
+                      vision_encoding: VisionEncoding = VisionEncoding.DELTA,
+                      keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL) -> AsyncBinaryPolicyConnection:
+        reader, writer = await asyncio.open_connection(address, port)
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer, EpisodeObservationEncoder(vision_size, vision_encoding, keyframe_interval))
+
+    async def close(self):
+        self.closed = True
+        self._reader_task.cancel()
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def start_episode(self, training_enabled: bool = True) -> int:
+        reply = await self._request(MessageType.START_EPISODE, MessageType.EPISODE,
+                                    START_EPISODE.pack(training_enabled, self._encoder.vision_encoding))
+        handle = EPISODE_HANDLE.unpack(reply)[0]
+        self._encoder.start(handle)
+        return handle
+
+    async def get_action(self, handle: int, observation) -> np.ndarray:
+        reply = await self._request(MessageType.GET_ACTION, MessageType.ACTION, EPISODE_HANDLE.pack(handle),
+                                    *self._encoder.encode(handle, observation))
+        return np.frombuffer(reply, dtype=np.uint8).astype(np.int64)
+
+    async def step(self, handle: int, reward: float, observation, info=None) -> np.ndarray:
+        info = info or {}
+        reply = await self._request(MessageType.STEP, MessageType.ACTION, STEP.pack(handle, reward),
+                                    *self._encoder.encode(handle, observation, info.get("Died", False),
+                                                          info.get("Finished Level", False)))
+        return np.frombuffer(reply, dtype=np.uint8).astype(np.int64)
+
+    def log_returns(self, handle: int, reward: float, info=None) -> asyncio.Future:
+        """Sent immediately, await the returned future to wait for the server's acknowledgement."""
+        return self._request(MessageType.LOG_RETURNS, MessageType.OK, LOG_RETURNS.pack(handle, reward),
+                             encode_info(info))
+
+    def end_episode(self, handle: int, observation) -> asyncio.Future:
+        """Sent immediately, await the returned future to wait for the server's acknowledgement."""
+        future = self._request(MessageType.END_EPISODE, MessageType.OK, EPISODE_HANDLE.pack(handle),
+                               *self._encoder.encode(handle, observation))
+        self._encoder.end(handle)
+        return future
+
+    def _request(self, message_type: MessageType, expected_reply: MessageType, *payload) -> asyncio.Future:
+        if self.closed:
+            raise ConnectionError("Connection is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, message_type, expected_reply))
+        self._writer.write(pack_frame(message_type, *payload))
+        return future
+
+    async def _read_replies(self):
+        try:
+            while True:
+                reply_type, size = parse_frame_header(await self._reader.readexactly(FRAME_HEADER.size))
+                reply = memoryview(await self._reader.readexactly(size))
+                future, message_type, expected_reply = self._pending.popleft()
+                if future.done():
+                    # Cancelled, e.g. the caller timed out waiting for it
+                    continue
+                try:
+                    check_reply(message_type, expected_reply, reply_type, reply)
+                    future.set_result(reply)
+                except Exception as e:
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Fail everything in flight, the connection can't be used anymore
+            self.closed = True
+            while self._pending:
+                future, _, _ = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+
+
+class AsyncConnectionPool:
+
+    def __init__(self, address: str, port: int, size: int = 2, **connection_kwargs):
+        """Up to `size` connections to `address`:`port`, opened on demand. `connection_kwargs` are passed to
+        `AsyncBinaryPolicyConnection.connect`."""
+        self.address = address
+        self.port = port
+        self.size = size
+        self.connection_kwargs = connection_kwargs
+        self._idle = deque()  # type: Deque[AsyncBinaryPolicyConnection]
+        self._opened = 0
+        self._available = asyncio.Condition()
+
+    async def acquire(self) -> AsyncBinaryPolicyConnection:
+        async with self._available:
+            while True:
+                while self._idle:
+                    connection = self._idle.popleft()
+                    if not connection.closed:
+                        return connection
+                    self._opened -= 1
+                if self._opened < self.size:
+                    self._opened += 1
+                    break
+                await self._available.wait()
+        try:
+            return await AsyncBinaryPolicyConnection.connect(self.address, self.port, **self.connection_kwargs)
+        except Exception:
+            async with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+
+    async def release(self, connection: AsyncBinaryPolicyConnection):
+        """Give a connection back, closed connections are dropped from the pool."""
+        async with self._available:
+            if connection.closed:
+                self._opened -= 1
+            else:
+                self._idle.append(connection)
+            self._available.notify()
+
+    async def close(self):
+        async with self._available:
+            while self._idle:
+                await self._idle.popleft().close()
+            self._opened = 0
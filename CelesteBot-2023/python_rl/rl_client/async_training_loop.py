@@ -0,0 +1,205 @@
+"""
+asyncio version of `CelesteClient.start_training`, used when CELESTEBOT_CLIENT_LOOP is "asyncio".
+
+The loop runs on the process' event loop (see event_loop.py) and talks to the server over pipelined binary
+connections (see async_policy_client.py). The PythonNET observation thread hands transitions over through the
+env's ring buffer, whose `on_publish` hook wakes the loop with `call_soon_threadsafe`, so waiting for the game
+doesn't tie up a thread.
+
+The connection pool to the server is kept across episodes and reconnections, and only replaced when the client moves
+to another port. Episode handles are only valid on the connection that started the episode, so every episode checks
+out a connection of its own: at the end of an episode the final reward and end_episode go out on the episode's
+connection, which returns to the pool once the server acknowledged them, while the next start_episode goes out on
+another one as the loop waits for the game to restart.
+
+Like the threaded loop, the loop keeps trying to connect while no server is reachable, waiting longer and longer in
+between, and gives up after MAX_RETRIES failures of the training loop in a row, waiting the same way before
+retrying.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from python_rl.rl_client.async_policy_client import AsyncBinaryPolicyConnection, AsyncConnectionPool
+from python_rl.rl_client.event_loop import get_event_loop
+from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.client_telemetry import TELEMETRY_INFO_KEY
+from python_rl.rl_common.config import CONNECT_RETRY_DELAY, MAX_CONNECT_RETRY_DELAY, REQUEST_TIMEOUT, SERVER_ADDRESS
+
+# Failed attempts in a row before the loop gives up, completing an episode resets the count
+MAX_RETRIES = 3
+
+
+class AsyncTrainingLoop:
+
+    def __init__(self, client, pool_size: int = 2):
+        """
+        Args:
+            client: The `CelesteClient` whose env, port, logger and latency recorder are used.
+            pool_size: Connections kept to the server. With one, the next episode only starts once the server
+                acknowledged the end of the previous one.
+        """
+        self.client = client
+        self.telemetry = client.telemetry
+        self.env = client.env  # type: CelesteEnv
+        self.logger = client.logger
+        self.latency = client.latency
+        self.pool_size = pool_size
+        self.loop = get_event_loop()
+        self.completed_episodes = 0
+        self._pools = {}  # type: Dict[int, AsyncConnectionPool]
+        self._transition_published = None  # type: asyncio.Event
+
+    def run(self):
+        """Run the training loop on the event loop, blocking the calling thread until it ends."""
+        asyncio.run_coroutine_threadsafe(self.train(), self.loop).result()
+
+    async def train(self):
+        self._transition_published = asyncio.Event()
+        self.env.transitions.on_publish = lambda: self.loop.call_soon_threadsafe(self._transition_published.set)
+        retries = MAX_RETRIES
+        retry_delay = CONNECT_RETRY_DELAY
+        try:
+            while True:
+                pool, connection = await self._connect()
+                completed_episodes = self.completed_episodes
+                try:
+                    await self._run_episodes(pool, connection)
+                    continue
+                except Exception as e:
+                    self.logger.log(logging.ERROR, "Training loop failed", exc_info=True)
+                    if self.completed_episodes > completed_episodes:
+                        retries, retry_delay = MAX_RETRIES, CONNECT_RETRY_DELAY
+                    if retries == 0:
+                        raise e
+                    retries -= 1
+                self.logger.log(logging.INFO, f"Retrying in {retry_delay:.1f}s")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_CONNECT_RETRY_DELAY)
+        finally:
+            for pool in self._pools.values():
+                await pool.close()
+            self._pools.clear()
+
+    async def _connect(self) -> Tuple[AsyncConnectionPool, AsyncBinaryPolicyConnection]:
+        """A connection to the chosen server and its pool, trying again until a server is reachable."""
+        retry_delay = CONNECT_RETRY_DELAY
+        while True:
+            port = self.client._choose_port()
+            self.logger.log(logging.INFO, f"Connecting to port {port} (asyncio loop)")
+            pool = await self._pool(port)
+            try:
+                return pool, await pool.acquire()
+            except OSError as e:
+                self.logger.log(logging.ERROR, f"Error connecting to server: {e}")
+            self.logger.log(logging.INFO, f"No server reachable, retrying in {retry_delay:.1f}s")
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, MAX_CONNECT_RETRY_DELAY)
+
+    async def _pool(self, port: int) -> AsyncConnectionPool:
+        """The connection pool to `port`, created on first use. Closes the pools of ports the client left."""
+        for other_port in [p for p in self._pools if p != port]:
+            await self._pools.pop(other_port).close()
+        if port not in self._pools:
+            self._pools[port] = AsyncConnectionPool(SERVER_ADDRESS, port, self.pool_size,
+                                                    vision_size=self.env.vision_size)
+        return self._pools[port]
+
+    async def _wait_for_transition(self) -> float:
+        start = time.perf_counter()
+        while not self.env.transition_ready():
+            self._transition_published.clear()
+            # A transition published between the check and the clear would be missed otherwise
+            if self.env.transition_ready():
+                break
+            await self._transition_published.wait()
+        return time.perf_counter() - start
+
+    async def _query_action(self, request):
+        """Await an action request for up to REQUEST_TIMEOUT seconds, recording it in the episode's telemetry."""
+        start = time.perf_counter()
+        try:
+            action = await asyncio.wait_for(request, REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.telemetry.record_timeout()
+            raise
+        self.telemetry.record_action(time.perf_counter() - start)
+        return action
+
+    async def _end_episode(self, pool: AsyncConnectionPool, connection: AsyncBinaryPolicyConnection,
+                           acknowledgements):
+        """Wait for the server to acknowledge the end of an episode, then give its connection back to `pool`."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*acknowledgements), REQUEST_TIMEOUT)
+        finally:
+            await pool.release(connection)
+        self.completed_episodes += 1
+
+    async def _run_episodes(self, pool: AsyncConnectionPool, connection: Optional[AsyncBinaryPolicyConnection]):
+        """
+        Run episodes, the first on `connection`, the next ones on other connections of `pool`, until the client should
+        move to another server.
+        """
+        ending = None  # type: Optional[asyncio.Future]
+        try:
+            await self._wait_for_transition()
+            obs, _ = self.env.reset()
+            handle = await connection.start_episode()
+            self.telemetry.start()
+            action = await self._query_action(connection.get_action(handle, obs))
+            episode_reward = 0.0
+            action_count = 1
+            start_time = time.time()
+            while True:
+                step_start = time.perf_counter()
+                self.env.add_action(action)
+                self.latency.record("action_enqueue", self.env.last_enqueue_time)
+                self.latency.record("queue_wait", await self._wait_for_transition())
+                obs, reward, terminated, truncated, info = self.env.collect_step()
+                episode_reward += reward
+
+                if not (terminated or truncated):
+                    query_start = time.perf_counter()
+                    action = await self._query_action(connection.step(handle, reward, obs, info))
+                    self.latency.record("step", time.perf_counter() - query_start)
+                    self.latency.record("decision", time.perf_counter() - step_start)
+                    self.latency.maybe_flush()
+                    action_count += 1
+                    continue
+
+                end_time = time.time()
+                self.logger.log(logging.INFO,
+                                f"Total reward for episode: {episode_reward}. Episode ended due to: {info}")
+                self.logger.log(logging.INFO, f"Episode took {end_time - start_time} seconds and "
+                                              f"{action_count / (end_time - start_time)} actions per second")
+                self.logger.log(logging.INFO, f"Transition stats: {self.env.transition_stats()}")
+                info = dict(info, **{TELEMETRY_INFO_KEY: self.telemetry.end(self.client.port, action_count)})
+                # Written right away on the episode's connection, the server answers while the game restarts
+                acknowledgements = [connection.log_returns(handle, reward, info), connection.end_episode(handle, obs)]
+                ending = asyncio.ensure_future(self._end_episode(pool, connection, acknowledgements))
+                connection = None
+                if self.client._should_rebalance():
+                    await ending
+                    return
+                connection = await pool.acquire()
+                next_handle = asyncio.ensure_future(connection.start_episode())
+                await self._wait_for_transition()
+                obs, _ = self.env.reset()
+                await ending
+                handle = await next_handle
+                self.telemetry.start()
+                query_start = time.perf_counter()
+                action = await self._query_action(connection.get_action(handle, obs))
+                self.latency.record("get_action", time.perf_counter() - query_start)
+                episode_reward = 0.0
+                action_count = 1
+                start_time = time.time()
+        finally:
+            if ending is not None and not ending.done():
+                # Its connection goes back to the pool when it's done
+                await asyncio.gather(ending, return_exceptions=True)
+            if connection is not None:
+                await pool.release(connection)
@@ -0,0 +1,128 @@
+"""
+Client side of the binary transport (see rl_common/binary_protocol.py). Drop-in replacement for a remote
+inference mode `PolicyClient`: same method names and arguments, but one persistent TCP connection and fixed
+binary frames instead of a pickled HTTP POST per call.
+"""
+from __future__ import annotations
+
+import socket
+import threading
+
+import numpy as np
+
+from python_rl.rl_common.binary_protocol import EPISODE_HANDLE, LOG_RETURNS, START_EPISODE, STEP, MessageType, \
+    ProtocolError, encode_info, recv_frame, send_frame
+from python_rl.rl_common.config import REQUEST_TIMEOUT
+from python_rl.rl_common.flat_observation import flat_observation_layout, flat_observation_views
+from python_rl.rl_common.observation_codec import DEFAULT_VISION_SIZE, VISION_OFFSET, PackedObservationDecoder, \
+    PackedObservationEncoder
+from python_rl.rl_common.vision_codec import DEFAULT_KEYFRAME_INTERVAL, VisionDeltaEncoder, VisionEncoding
+
+
+class EpisodeObservationEncoder:
+    """Encodes observations for the wire in the vision encoding of their episode, shared by the binary clients."""
+
+    def __init__(self, vision_size: int = DEFAULT_VISION_SIZE, vision_encoding: VisionEncoding = VisionEncoding.DELTA,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        self.vision_size = vision_size
+        self.vision_encoding = vision_encoding
+        self.keyframe_interval = keyframe_interval
+        self._encoder = PackedObservationEncoder(vision_size)
+        # Flat observations (see rl_common/flat_observation.py) are packed through per key views
+        self._flat_layout = flat_observation_layout(PackedObservationDecoder(vision_size).new_observation())
+        self._vision_end = VISION_OFFSET + vision_size * vision_size
+        self._vision_encoders = {}  # episode handle -> VisionDeltaEncoder, for DELTA episodes
+
+    def start(self, handle: int):
+        if self.vision_encoding == VisionEncoding.DELTA:
+            self._vision_encoders[handle] = VisionDeltaEncoder(self.vision_size, self.keyframe_interval)
+
+    def end(self, handle: int):
+        self._vision_encoders.pop(handle, None)
+
+    def encode(self, handle: int, observation, death_flag: bool = False, finished_level: bool = False):
+        """The observation as payload parts. Parts may be views that the next call overwrites."""
+        if isinstance(observation, np.ndarray):
+            observation = flat_observation_views(observation, self._flat_layout)
+        packed = self._encoder.encode(observation, death_flag, finished_level)
+        vision_encoder = self._vision_encoders.get(handle)
+        if vision_encoder is None:
+            return packed,
+        return (packed[:VISION_OFFSET], packed[self._vision_end:],
+                vision_encoder.encode(packed[VISION_OFFSET:self._vision_end]))
+
+
+def check_reply(message_type: MessageType, expected_reply: MessageType, reply_type: MessageType, reply):
+    if reply_type == MessageType.ERROR:
+        raise ProtocolError(f"Server error on {message_type.name}: {bytes(reply).decode('utf-8')}")
+    if reply_type != expected_reply:
+        raise ProtocolError(f"Expected {expected_reply.name} reply to {message_type.name}, got {reply_type.name}")
+
+
+class BinaryPolicyClient:
+
+    def __init__(self, address: str, port: int, vision_size: int = DEFAULT_VISION_SIZE, timeout: float = REQUEST_TIMEOUT,
+                 vision_encoding: VisionEncoding = VisionEncoding.DELTA,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        """
+        Args:
+            vision_encoding: How episodes started by this client send their vision grids, DELTA sends keyframes and
+                deltas against the previous frame of the episode (see rl_common/vision_codec.py).
+            keyframe_interval: With DELTA, send a keyframe at least every this many observations.
+        """
+        self.address = address
+        self.port = port
+        self._encoder = EpisodeObservationEncoder(vision_size, vision_encoding, keyframe_interval)
+        # One request in flight at a time, replies are matched to requests by order
+        self._lock = threading.Lock()
+        self._sock = socket.create_connection((address, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start_episode(self, episode_id=None, training_enabled: bool = True) -> int:
+        """Start an episode. Episode ids are assigned by the server, `episode_id` is only accepted for
+        compatibility with `PolicyClient` and must be None."""
+        if episode_id is not None:
+            raise ValueError("BinaryPolicyClient episodes are numbered by the server")
+        payload = self._request(MessageType.START_EPISODE, MessageType.EPISODE,
+                                START_EPISODE.pack(training_enabled, self._encoder.vision_encoding))
+        handle = EPISODE_HANDLE.unpack(payload)[0]
+        self._encoder.start(handle)
+        return handle
+
+    def get_action(self, episode_id: int, observation) -> np.ndarray:
+        payload = self._request(MessageType.GET_ACTION, MessageType.ACTION, EPISODE_HANDLE.pack(episode_id),
+                                *self._encoder.encode(episode_id, observation))
+        return np.frombuffer(payload, dtype=np.uint8).astype(np.int64)
+
+    def log_returns(self, episode_id: int, reward: float, info=None):
+        self._request(MessageType.LOG_RETURNS, MessageType.OK, LOG_RETURNS.pack(episode_id, reward), encode_info(info))
+
+    def step(self, episode_id: int, reward: float, observation, info=None) -> np.ndarray:
+        """Log `reward` for the previous action and get the action for `observation` in one round trip. Only the
+        "Died" and "Finished Level" entries of `info` are sent, as observation flags."""
+        info = info or {}
+        payload = self._request(MessageType.STEP, MessageType.ACTION, STEP.pack(episode_id, reward),
+                                *self._encoder.encode(episode_id, observation, info.get("Died", False),
+                                                      info.get("Finished Level", False)))
+        return np.frombuffer(payload, dtype=np.uint8).astype(np.int64)
+
+    def end_episode(self, episode_id: int, observation):
+        self._request(MessageType.END_EPISODE, MessageType.OK, EPISODE_HANDLE.pack(episode_id),
+                      *self._encoder.encode(episode_id, observation))
+        self._encoder.end(episode_id)
+
+    def _request(self, message_type: MessageType, expected_reply: MessageType, *payload) -> memoryview:
+        with self._lock:
+            send_frame(self._sock, message_type, *payload)
+            reply_type, reply = recv_frame(self._sock)
+        check_reply(message_type, expected_reply, reply_type, reply)
+        return reply
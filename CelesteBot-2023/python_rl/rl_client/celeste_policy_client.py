@@ -0,0 +1,48 @@
+from typing import Optional
+
+import ray.cloudpickle as pickle
+import requests
+from ray.rllib.env.policy_client import PolicyClient, logger
+
+from python_rl.rl_common.config import REQUEST_TIMEOUT
+from python_rl.rl_common.policy_commands import STEP_COMMAND
+
+
+class CelestePolicyClient(PolicyClient):
+    """
+    PolicyClient with a combined `step` call, needs a server using `CelestePolicyServerInput`. Requests time out
+    after `timeout` seconds (requests.exceptions.Timeout), PolicyClient's wait forever.
+    """
+
+    def __init__(self, address: str, inference_mode: str = "local", update_interval: float = 10.0,
+                 session: Optional[requests.Session] = None, timeout: float = REQUEST_TIMEOUT):
+        # Set first, local inference already sends requests while PolicyClient is initialized
+        self.timeout = timeout
+        super().__init__(address, inference_mode, update_interval, session)
+
+    def step(self, episode_id: str, reward: float, observation, info: Optional[dict] = None):
+        """
+        Log `reward` (and `info`) for the previous action and get the action for `observation`, in a single
+        request when using remote inference.
+        """
+        if self.local:
+            self.log_returns(episode_id, reward, info=info)
+            return self.get_action(episode_id, observation)
+        return self._send(
+            {
+                "command": STEP_COMMAND,
+                "episode_id": episode_id,
+                "reward": reward,
+                "info": info,
+                "observation": observation,
+            }
+        )["action"]
+
+    def _send(self, data):
+        # PolicyClient._send with a timeout
+        post = requests.post if self.session is None else self.session.post
+        response = post(self.address, data=pickle.dumps(data), timeout=self.timeout)
+        if response.status_code != 200:
+            logger.error("Request failed {}: {}".format(response.text, data))
+        response.raise_for_status()
+        return pickle.loads(response.content)
@@ -38,27 +38,38 @@ In either case, the user of PolicyClient must:
 """
 
 import argparse
+import atexit
 import logging
 import math
 import os
 import pickle
 import queue
+import random
 import re
+import socket
 import threading
 import time
-import traceback
 from collections import OrderedDict
+from itertools import chain
 from threading import Thread
 from typing import List, SupportsFloat, Optional
-import socket, errno
 from urllib.error import HTTPError
 
 import numpy as np
 import requests
-from ray.rllib.env.policy_client import PolicyClient
 
+from python_rl.rl_client.async_training_loop import AsyncTrainingLoop
+from python_rl.rl_client.binary_policy_client import BinaryPolicyClient
+from python_rl.rl_client.client_logging import MessageLimit, start_client_logging
 from python_rl.rl_common.celestebot_env import CelesteEnv, TerminationEvent
-from python_rl.rl_server import celestebot_server
+from python_rl.rl_common.client_telemetry import TELEMETRY_INFO_KEY, EpisodeTelemetry
+from python_rl.rl_common.config import CONNECT_RETRY_DELAY, MAX_CONNECT_RETRY_DELAY, NUM_WORKERS, SERVER_ADDRESS, \
+    SERVER_BASE_PORT
+from python_rl.rl_common.latency import LatencyRecorder
+from python_rl.rl_common.observation_codec import PackedObservationDecoder
+from python_rl.rl_common.port_registry import PortRegistry
+from python_rl.rl_common.trajectory_recorder import TrajectoryRecorder
+from python_rl.rl_common.transition_buffer import NO_REWARD
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -67,6 +78,12 @@ parser.add_argument(
 parser.add_argument(
     "--inference-mode", type=str, default="local", choices=["local", "remote"]
 )
+parser.add_argument(
+    "--weight-sync-interval",
+    type=float,
+    default=10.0,
+    help="In local inference mode, pull new policy weights from the server after this many seconds.",
+)
 parser.add_argument(
     "--off-policy",
     action="store_true",
@@ -80,29 +97,47 @@ parser.add_argument(
     help="Stop once the specified reward is reached.",
 )
 parser.add_argument(
-    "--port", type=int, default=9900, help="The port to use (on localhost)."
+    "--port", type=int, default=SERVER_BASE_PORT, help="The port to use (on localhost)."
 )
 
-
-def _get_available_port(base_port: int = 9900) -> int:
-    current_port = base_port
-    while current_port < base_port + 100:
-
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            try:
-                s.bind(("127.0.0.1", 5555))
-            except socket.error as e:
-                if e.errno == errno.EADDRINUSE:
-                    current_port += 1
-                    continue
-                else:
-                    return current_port
-            current_port += 1
+# The game constructs CelesteClient without CLI args, so these settings come from the environment
+INFERENCE_MODE_ENV_VAR = "CELESTEBOT_INFERENCE_MODE"
+WEIGHT_SYNC_INTERVAL_ENV_VAR = "CELESTEBOT_WEIGHT_SYNC_INTERVAL"
+TRANSPORT_ENV_VAR = "CELESTEBOT_TRANSPORT"
+LATENCY_FLUSH_INTERVAL_ENV_VAR = "CELESTEBOT_LATENCY_FLUSH_INTERVAL"
+CLIENT_LOOP_ENV_VAR = "CELESTEBOT_CLIENT_LOOP"
+# If set, every transition is recorded to a new folder in this folder, see rl_common/trajectory_recorder.py
+RECORD_DIR_ENV_VAR = "CELESTEBOT_RECORD_DIR"
+DEFAULT_INFERENCE_MODE = "remote"
+DEFAULT_WEIGHT_SYNC_INTERVAL = 10.0
+DEFAULT_TRANSPORT = "http"
+DEFAULT_LATENCY_FLUSH_INTERVAL = 10.0
+DEFAULT_CLIENT_LOOP = "thread"
+
+# Seconds between checks whether a less loaded server is available, at episode boundaries. Jittered so clients that
+# started together don't all move at once.
+REBALANCE_CHECK_INTERVAL = 30.0
+
+# Logged at DEBUG on every step, rate limited to this many per second
+STEP_LOG_MESSAGE = "Reward for Action %s: %s"
+STEP_LOG_RATE = 10.0
+
+# Per-step stages timed by the client, see rl_common/latency.py:
+#   observation_arrival   action queued -> the game publishes its outcome (game side, incl. PythonNET)
+#   ingest                storing a published transition in the env's ring buffer
+#   queue_wait            CelesteEnv.step waiting for the next transition after queueing an action
+#   get_action / step     server round trip (or local inference) for the first / any later action of an episode
+#   log_returns           reward logging for the last action of an episode
+#   action_enqueue        putting the action on the queue the game reads from
+#   decision              CelesteEnv.step plus the action query, i.e. one full step of the training loop
+LATENCY_STAGES = ("observation_arrival", "ingest", "queue_wait", "get_action", "step", "log_returns",
+                  "action_enqueue", "decision")
 
 
 class CelesteClient:
 
-    def __init__(self, action_queue=None):
+    def __init__(self, action_queue=None, inference_mode=None, weight_sync_interval=None, transport=None,
+                 client_loop=None, port=None):
         # The following line is the only instance, where an actual env will
         # be created in this entire example (including the server side!).
         # This is to demonstrate that RLlib does not require you to create
@@ -116,11 +151,11 @@ class CelesteClient:
         # Note that no config is needed in this script as it will be defined
         # on and sent from the server.
         self.python_logs_txt = "python_logs.txt"
-        logging.basicConfig(filename=self.python_logs_txt,
-                            filemode='w+',
-                            datefmt='%H:%M:%S',
-                            level=logging.INFO,
-                            )
+        self.latency_metrics_file = "python_latency.jsonl"
+        # Formatted and written by a writer thread, see client_logging.py
+        self.log_handler = start_client_logging(self.python_logs_txt, logging.INFO, limits={
+            STEP_LOG_MESSAGE: MessageLimit(per_second=STEP_LOG_RATE),
+        })
         self.logger = logging.getLogger('PythonClientLogger')
         self.logger.log(logging.INFO, "Python client started")
         # TODO: Get worker number based on path of executable. Each worker will run in a different copy of Celeste,
@@ -136,7 +171,7 @@ class CelesteClient:
             self.is_worker = False
             worker_number = 0
         num_client_workers = int(os.environ.get("NUM_CLIENT_WORKERS", 9))
-        self.num_server_workers = celestebot_server.NUM_WORKERS
+        self.num_server_workers = NUM_WORKERS
         num_clients_per_server = max(num_client_workers // self.num_server_workers, 1)
         # num_clients_per_server = 1
         server_number = worker_number // num_clients_per_server
@@ -147,11 +182,47 @@ class CelesteClient:
         self.logger.log(logging.INFO, f"Assigned Server number: {server_number}")
         if server_number >= self.num_server_workers:
             server_number -= 1
-        self.port = 9900 + server_number
+        # Only used if no server is in the port registry (see _choose_port)
+        self.port = SERVER_BASE_PORT + server_number
         # port = 9900
+        # An explicit port turns server discovery off
+        self.discovery = port is None
+        if port is not None:
+            self.port = port
+        self.registry = PortRegistry()
+        self._attached_port = None  # type: Optional[int]
+        self.client_id = f"{os.getpid()}_{id(self):x}"
+        # Sent to the server with the end of every episode, see rl_common/client_telemetry.py
+        self.telemetry = EpisodeTelemetry(self.client_id)
+        self._next_rebalance_check = time.time() + random.uniform(0.5, 1.5) * REBALANCE_CHECK_INTERVAL
 
         self.current_episode_id = ""
         self._first_reward = True
+        # "remote": every action is an HTTP request to the server. "local": the PolicyClient builds its own copy of
+        # the policy from the server's config, computes actions in-process, sends experience to the server in
+        # batches and pulls new weights every weight_sync_interval seconds.
+        self.inference_mode = inference_mode or os.environ.get(INFERENCE_MODE_ENV_VAR, DEFAULT_INFERENCE_MODE)
+        if self.inference_mode not in ("local", "remote"):
+            raise ValueError(f"Unknown inference mode: {self.inference_mode}")
+        if weight_sync_interval is None:
+            weight_sync_interval = float(os.environ.get(WEIGHT_SYNC_INTERVAL_ENV_VAR, DEFAULT_WEIGHT_SYNC_INTERVAL))
+        self.weight_sync_interval = weight_sync_interval
+        # "http": RLlib's PolicyClient. "binary": persistent TCP connection with fixed binary frames, needs the
+        # server started with --transport binary and only supports remote inference.
+        self.transport = transport or os.environ.get(TRANSPORT_ENV_VAR, DEFAULT_TRANSPORT)
+        if self.transport not in ("http", "binary"):
+            raise ValueError(f"Unknown transport: {self.transport}")
+        if self.transport == "binary" and self.inference_mode != "remote":
+            raise ValueError("The binary transport only supports remote inference")
+        # "thread": start_training blocks its thread on every server round trip. "asyncio": start_training runs on
+        # the client's event loop (see rl_client/async_training_loop.py) and pipelines requests over the binary
+        # transport.
+        self.client_loop = client_loop or os.environ.get(CLIENT_LOOP_ENV_VAR, DEFAULT_CLIENT_LOOP)
+        if self.client_loop not in ("thread", "asyncio"):
+            raise ValueError(f"Unknown client loop: {self.client_loop}")
+        if self.client_loop == "asyncio" and self.transport != "binary":
+            raise ValueError("The asyncio client loop needs the binary transport")
+        self.client = None
         if self.is_worker:
             log_level = logging.INFO
         else:
@@ -164,8 +235,35 @@ class CelesteClient:
         # self.observation_processor = Thread(target=self.process_observation_queue)
         # self.observation_processor.start()
 
-        self.info_queue = queue.Queue()
+        self._client_sequence = -1
         self.env = CelesteEnv(action_queue, logger=self.logger)
+        # The local policy keeps observations around until its sample batch is sent, so it can't be handed views
+        # into the env's ring buffer.
+        self.env.copy_observations = self.inference_mode == "local"
+        self._packed_decoder = PackedObservationDecoder(CelesteEnv.VISION_SIZE)
+        self._vision_cells = CelesteEnv.VISION_SIZE * CelesteEnv.VISION_SIZE
+        # Unless the env takes the game's vision as is, the game's grid lands here and the env's vision transform
+        # writes the reduced grid into the ring buffer. The packed path decodes into per slot dicts whose vision is
+        # this grid and whose other keys are the slot's.
+        self._vision_transform = None if self.env.vision_transform.identity else self.env.vision_transform
+        self._game_vision = np.zeros((CelesteEnv.VISION_SIZE, CelesteEnv.VISION_SIZE, 1), dtype=np.uint8)
+        self._packed_targets = [
+            OrderedDict(self.env.transitions.slot(index), map_entities_vision=self._game_vision)
+            for index in range(self.env.transitions.capacity)
+        ] if self._vision_transform is not None else None
+        self.latency = LatencyRecorder(
+            self.latency_metrics_file, LATENCY_STAGES,
+            float(os.environ.get(LATENCY_FLUSH_INTERVAL_ENV_VAR, DEFAULT_LATENCY_FLUSH_INTERVAL)))
+        record_dir = os.environ.get(RECORD_DIR_ENV_VAR)
+        if record_dir:
+            recording = os.path.join(record_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{self.client_id}")
+            self.logger.log(logging.INFO, f"Recording transitions to {recording}")
+            self.env.recorder = TrajectoryRecorder(recording, self.env.dict_observation_space, self.env.action_space,
+                                                   logger=self.logger)
+            atexit.register(self.env.recorder.close)
+        # Bound once, these are called on every step
+        self._record_arrival = self.latency.histograms["observation_arrival"].record
+        self._record_ingest = self.latency.histograms["ingest"].record
 
     # def ext_test(self):
     #     print("Hello from python")
@@ -173,74 +271,203 @@ class CelesteClient:
     #         self.env.add_action(np.array([0, 1, 1, 0]))
     #         time.sleep(30)
 
+    def ext_add_transition(self, sequence, reward, vision, speed_x_y, can_dash, stamina, death_flag, finished_level,
+                           target, position, screen_position, is_climbing, on_ground):
+        # Publish one transition from .NET: the observation, the reward of the action that led to it (NaN for the
+        # first observation of an episode) and the game's sequence number, all in one call.
+        # The observation is written in place into the env's ring buffer. The vision grid (rows of [entity] lists)
+        # is flattened with fromiter, which is much cheaper than letting numpy discover the nested list shape.
+        start = time.perf_counter()
+        index = self.env.transitions.acquire_write_slot()
+        observation = self.env.transitions.slot(index)
+        observation["can_dash"][0] = can_dash
+        observation["is_climbing"][0] = is_climbing
+
+        game_vision = observation["map_entities_vision"] if self._vision_transform is None else self._game_vision
+        game_vision.reshape(-1)[:] = np.fromiter(
+            chain.from_iterable(chain.from_iterable(vision)), dtype=np.uint8, count=self._vision_cells)
+        if self._vision_transform is not None:
+            self._vision_transform.apply(game_vision, observation["map_entities_vision"])
+        observation["on_ground"][0] = on_ground
+        observation["position"][:] = position
+        # observation["screen_position"] = np.array(screen_position)
+
+        observation["speed_x_y"][:] = speed_x_y
+        observation["stamina"][0] = stamina
+        observation["target"][:] = target  # array of x,y coord
+
+        self.env.transitions.publish(index, sequence, reward, self._termination_event(death_flag, finished_level).value)
+        self._record_transition_latency(start, reward)
+
+    def ext_add_transition_packed(self, sequence, reward, buffer):
+        # Same as ext_add_transition, but the observation is a single bytes/memoryview buffer in the layout described
+        # in rl_common/observation_codec.py. The buffer is only read during this call.
+        start = time.perf_counter()
+        index = self.env.transitions.acquire_write_slot()
+        if self._vision_transform is None:
+            _, death_flag, finished_level = self._packed_decoder.decode(buffer, out=self.env.transitions.slot(index))
+        else:
+            _, death_flag, finished_level = self._packed_decoder.decode(buffer, out=self._packed_targets[index])
+            self._vision_transform.apply(self._game_vision, self.env.transitions.slot(index)["map_entities_vision"])
+        self.env.transitions.publish(index, sequence, reward, self._termination_event(death_flag, finished_level).value)
+        self._record_transition_latency(start, reward)
+
+    def ext_set_level(self, name, sequence=None):
+        # Level of the transitions from `sequence` (the next one the game publishes) on, only used to tag recorded
+        # transitions
+        if self.env.recorder is not None:
+            self.env.recorder.set_level(str(name), None if sequence is None else int(sequence))
+
+    def _record_transition_latency(self, start, reward):
+        self._record_ingest(time.perf_counter() - start)
+        # The first observation of an episode doesn't answer an action
+        if not math.isnan(reward):
+            self._record_arrival(start - self.env.last_action_time)
+
     def ext_add_observation(self, vision, speed_x_y, can_dash, stamina, death_flag, finished_level, target, position,
                             screen_position, is_climbing, on_ground):
-        # send observation from .NET to server and get the action and send it to the queue
-        observation = OrderedDict()
-        observation["can_dash"] = np.array([can_dash])
-        observation["is_climbing"] = np.array([is_climbing])
-
-        observation["map_entities_vision"] = np.array(vision)
-        observation["on_ground"] = np.array([on_ground])
-        observation["position"] = np.array(position)
-        # observation["screen_position"] = np.array(screen_position)
+        # Observation without a reward, numbered by the client. Steps fed this way are counted as missing rewards.
+        self.ext_add_transition(self._next_client_sequence(), NO_REWARD, vision, speed_x_y, can_dash, stamina,
+                                death_flag, finished_level, target, position, screen_position, is_climbing, on_ground)
 
-        observation["speed_x_y"] = np.array(speed_x_y)
-        observation["stamina"] = np.array([stamina])
-        observation["target"] = np.array(target)  # array of x,y coord
+    def ext_add_observation_packed(self, buffer):
+        self.ext_add_transition_packed(self._next_client_sequence(), NO_REWARD, buffer)
 
-        self.env.observation_queue.put(observation)
+    def _next_client_sequence(self):
+        self._client_sequence += 1
+        return self._client_sequence
 
+    @staticmethod
+    def _termination_event(death_flag, finished_level):
         if death_flag:
-            self.env.termination_event_queue.put(TerminationEvent.DEATH)
+            return TerminationEvent.DEATH
         elif finished_level:
-            self.env.termination_event_queue.put(TerminationEvent.FINISHED_LEVEL)
+            return TerminationEvent.FINISHED_LEVEL
         else:
-            self.env.termination_event_queue.put(TerminationEvent.NORMAL)
-
-    def ext_add_reward(self, reward):
-        self.env.reward_queue.put(reward)
+            return TerminationEvent.NORMAL
 
     def ext_get_action(self):
         # send action to .NET
         # time how long this takes:
-        nest_obs = self.env.observation_queue.get()
+        nest_obs, _, _ = self.env.next_transition()
         action = self.client.get_action(self.current_episode_id, nest_obs)
         return [int(x) for x in action.tolist()]
 
-    def log_rewards(self):
-        while True:
-            try:
-                reward = self.env.reward_queue.get(timeout=0.5)
-            except queue.Empty:
-                self.logger.log(logging.INFO, "Timed out waiting for reward")
-                self.logger.log(logging.INFO, "queue size: " + str(self.env.reward_queue.qsize()))
-                reward = 0.0
-            info = self.info_queue.get()
-            self.client.log_returns(self.current_episode_id, reward, info=info)
-            self.episode_rewards += reward
-            self.info_queue.task_done()
+    def _choose_port(self, exclude_ports=()) -> int:
+        """
+        Attach to the server with the fewest clients in the port registry, skipping `exclude_ports`. Keeps the
+        current port if discovery is off or no server is registered.
+        """
+        if self.discovery:
+            found = self.registry.least_loaded(self.transport, self.client_id, exclude_ports)
+            if found is not None:
+                entry, num_clients = found
+                self.port = entry["port"]
+                self.logger.log(logging.INFO, f"Least loaded server: port {self.port} with {num_clients} clients")
+            if self.port != self._attached_port:
+                self.registry.attach(self.client_id, self.port)
+                self._attached_port = self.port
+        return self.port
+
+    def _should_rebalance(self) -> bool:
+        """
+        Whether to move to another server before the next episode: the current one is gone from the registry (e.g.
+        the worker restarted on another port) or another one has fewer clients than the current one has others.
+        """
+        if not self.discovery or time.time() < self._next_rebalance_check:
+            return False
+        self._next_rebalance_check = time.time() + random.uniform(0.5, 1.5) * REBALANCE_CHECK_INTERVAL
+        entries = self.registry.entries(self.transport)
+        if not entries:
+            return False
+        if self.port not in {entry["port"] for entry in entries}:
+            self.logger.log(logging.INFO, f"Server on port {self.port} is gone, rebalancing")
+            return True
+        found = self.registry.least_loaded(self.transport, self.client_id)
+        if found is None:
+            # Every server went stale since the entries were read, choose again
+            self.logger.log(logging.INFO, "No server left in the registry, rebalancing")
+            return True
+        _, fewest = found
+        others = self.registry.client_counts()[self.port] - 1
+        if fewest < others:
+            self.logger.log(logging.INFO, f"Port {self.port} has {others} other clients, another server has "
+                                          f"{fewest}, rebalancing")
+            return True
+        return False
 
     def _initiate_server_connection(self, session):
         # Start a new episode.
-        while self.port < self.port + 100:
+        failed_ports = set()
+        retry_delay = CONNECT_RETRY_DELAY
+        while True:
+            port = self._choose_port(failed_ports)
             try:
-                self.logger.log(logging.INFO, f"Connecting to port {self.port}")
-                self.client = PolicyClient(
-                    f"http://127.0.0.1:{self.port}", inference_mode="remote", session=session
-                )
+                self.logger.log(logging.INFO, f"Connecting to port {port}")
+                self.logger.log(logging.INFO, f"Inference mode: {self.inference_mode}, transport: {self.transport}")
+                if isinstance(self.client, BinaryPolicyClient):
+                    self.client.close()
+                if self.transport == "binary":
+                    self.client = BinaryPolicyClient(SERVER_ADDRESS, port, self.env.vision_size)
+                else:
+                    # Imports RLlib, which only the HTTP transport needs
+                    from python_rl.rl_client.celeste_policy_client import CelestePolicyClient
+                    self.client = CelestePolicyClient(
+                        f"http://{SERVER_ADDRESS}:{port}", inference_mode=self.inference_mode,
+                        update_interval=self.weight_sync_interval, session=session
+                    )
                 # test connection
                 self.current_episode_id = self.client.start_episode(training_enabled=True)
                 break
             except Exception as e:
                 self.logger.log(logging.ERROR, f"Error connecting to server: {e}")
-                # workers restarted, move ports up
-                self.port += self.num_server_workers
+                if self.discovery:
+                    registered = len(self.registry.entries(self.transport))
+                    if registered and len(failed_ports) < registered:
+                        # Try the next registered server right away
+                        failed_ports.add(port)
+                        continue
+                    if not registered:
+                        # workers restarted, move ports up
+                        self.port += self.num_server_workers
+                    # Every registered server failed, they may be restarting
+                    failed_ports.clear()
+                self.logger.log(logging.INFO, f"No server reachable, retrying in {retry_delay:.1f}s")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_CONNECT_RETRY_DELAY)
+
+    def _query_action(self, obs, reward=None, info=None):
+        """
+        Get the action for `obs`. With a `reward` (any step but the first of an episode), the reward of the
+        previous action is logged in the same request.
+        """
+        start = time.perf_counter()
+        try:
+            if reward is None:
+                action = self.client.get_action(self.current_episode_id, obs)
+                self.latency.record("get_action", time.perf_counter() - start)
+            else:
+                action = self.client.step(self.current_episode_id, np.float64(reward), obs, info)
+                self.latency.record("step", time.perf_counter() - start)
+            self.telemetry.record_action(time.perf_counter() - start)
+            return action
+        except (socket.timeout, requests.exceptions.Timeout):
+            self.telemetry.record_timeout()
+            raise
+        except HTTPError as e:
+            self.logger.log(logging.ERROR, "HTTP Error when processing observation: %s", obs)
+            self.logger.log(logging.ERROR, "HTTP Error: %s", e.reason)
+            self.logger.log(logging.ERROR, "HTTP Error: %s", e.headers)
+            raise e
+
     def start_training(self):
         # In the following, we will use our external environment (the CartPole
         # env we created above) in connection with the PolicyClient to query
         # actions (from the server if "remote"; if "local" we'll compute them
         # on this client side), and send back observations and rewards.
+        if self.client_loop == "asyncio":
+            AsyncTrainingLoop(self).run()
+            return
         retries = 3
         while True:
             with requests.Session() as session:
@@ -249,66 +476,59 @@ class CelesteClient:
 
 
                     self._initiate_server_connection(session)
-                    self.logger.log(logging.INFO, "Started episode, observation: " + str(obs))
+                    self.logger.log(logging.INFO, "Started episode, observation: %s", obs)
                     start_time = time.time()
-                    action_count = 0
-                    reward_logger = threading.Thread(target=self.log_rewards)
-                    reward_logger.start()
+                    action_count = 1
+                    self.telemetry.start()
+                    action = self._query_action(obs)
                     while True:
-                        # Compute an action randomly (off-policy) and log it.
-
-                        # Compute an action locally or remotely (on server).
-                        # No need to log it here as the action
-                        # self.logger.log(logging.DEBUG, "Querying action: " + str(episode_id))
-                        action_count += 1
-                        try:
-                            action = self.client.get_action(self.current_episode_id, obs)
-                        except HTTPError as e:
-                            self.logger.log(logging.ERROR, f"HTTP Error when processing observation: {obs}")
-                            self.logger.log(logging.ERROR, f"HTTP Error: {e.reason}")
-                            self.logger.log(logging.ERROR, f"HTTP Error: {e.headers}")
-                            raise e
-                        # self.logger.log(logging.DEBUG, "Got action: " + str(action))
                         # Perform a step in the external simulator (env).
-
+                        step_start = time.perf_counter()
                         obs, reward, terminated, truncated, info = self.env.step(action)
+                        self.latency.record("action_enqueue", self.env.last_enqueue_time)
+                        self.latency.record("queue_wait", self.env.last_wait_time)
                         self.awaiting_rewards += 1
-                        if action_count % 1 == 0:
-                            self.logger.log(logging.DEBUG, f"Reward for Action {action}: {reward}")
-                            # self.logger.log(logging.DEBUG, f"Observation: {obs}")
-
-                        self.client.log_returns(self.current_episode_id, np.float64(reward))
+                        self.logger.log(logging.DEBUG, STEP_LOG_MESSAGE, action, reward)
                         self.episode_rewards += reward
 
-                        # Log next-obs, rewards, and infos.
-                        # self.info_queue.put(info)
-                        # self.log_reward()
-                        # self.info_queue.join()
-                        # self.client.log_returns(episode_id, reward, info=info)
+                        if not (terminated or truncated):
+                            # Log the reward and query the next action (locally or on the server) in one request
+                            action_count += 1
+                            action = self._query_action(obs, reward, info)
+                            self.latency.record("decision", time.perf_counter() - step_start)
+                            self.latency.maybe_flush()
+                            continue
+
                         # Reset the episode if done.
-                        if terminated or truncated:
-                            # wait for all rewards to have been sent
-                            self.logger.log(logging.INFO,
-                                            f"Total reward for episode: {self.episode_rewards}. Episode ended due to: {info}")
-                            end_time = time.time()
-                            self.logger.log(logging.INFO,
-                                            f"Episode took {end_time - start_time} seconds and  {action_count / (end_time - start_time)} actions per second")
-                            # self.info_queue.join()
-
-                            start_time = time.time()
-                            action_count = 0
-                            self.episode_rewards = 0.0
-
-                            # End the old episode.
-                            self.client.end_episode(self.current_episode_id, obs)
-                            # Tell Madeline to do nothing to get the next observation
-                            # Start a new episode.
-                            obs, info = self.env.reset()
+                        log_start = time.perf_counter()
+                        info = dict(info, **{TELEMETRY_INFO_KEY: self.telemetry.end(self.port, action_count)})
+                        self.client.log_returns(self.current_episode_id, np.float64(reward), info=info)
+                        self.latency.record("log_returns", time.perf_counter() - log_start)
+                        self.logger.log(logging.INFO,
+                                        f"Total reward for episode: {self.episode_rewards}. Episode ended due to: {info}")
+                        end_time = time.time()
+                        self.logger.log(logging.INFO,
+                                        f"Episode took {end_time - start_time} seconds and  {action_count / (end_time - start_time)} actions per second")
+                        self.logger.log(logging.INFO, f"Transition stats: {self.env.transition_stats()}")
+                        if self.log_handler is not None:
+                            self.logger.log(logging.INFO, f"Logging stats: {self.log_handler.stats()}")
+
+                        start_time = time.time()
+                        action_count = 1
+                        self.telemetry.start()
+                        self.episode_rewards = 0.0
+
+                        # End the old episode.
+                        self.client.end_episode(self.current_episode_id, obs)
+                        # Start a new episode, on a less loaded server if there is one.
+                        obs, info = self.env.reset()
+                        if self._should_rebalance():
+                            self._initiate_server_connection(session)
+                        else:
                             self.current_episode_id = self.client.start_episode(training_enabled=True)
+                        action = self._query_action(obs)
                 except Exception as e:
-                    with open(self.python_logs_txt, 'a') as f:
-                        f.write(str(e))
-                        f.write(traceback.format_exc())
+                    self.logger.log(logging.ERROR, "Training loop failed", exc_info=True)
                     if retries == 0:
                         raise e
                     retries -= 1
@@ -382,7 +602,8 @@ class DummyCelesteClient(CelesteClient):
         self.env.action_queue.put_nowait(action)
         return action
 
-    def ext_add_reward(self, reward):
+    def ext_add_transition(self, sequence, reward, vision, speed_x_y, can_dash, stamina, death_flag, finished_level,
+                           target, position, screen_position, is_climbing, on_ground):
         self.logger.log(logging.INFO, f"Reward: {reward}")
 
     def ext_add_observation(self, vision, speed_x_y, can_dash, stamina, death_flag, finished_level, target, position,
@@ -0,0 +1,108 @@
+"""
+Client logging that stays off the step thread. `start_client_logging` replaces `logging.basicConfig` with a
+`SampledQueueHandler` on the root logger and a writer thread (a `LogWriter`) that owns the log file:
+
+    - The calling thread only creates the record and puts it on a bounded queue. Messages are formatted from their
+      template and args on the writer thread, so log with args (`logger.debug("Reward %s", reward)`) rather than
+      f-strings. Args are formatted later, don't pass objects that are about to be modified in place.
+    - Message types (their template, `record.msg`) can be sampled, only every n-th record is kept, and/or rate
+      limited to a number of records per second.
+    - When the queue is full, records are dropped and counted instead of blocking the caller. `stats()` has the
+      dropped and sampled out counts.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueListener
+from typing import Dict, Optional
+
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class MessageLimit:
+    """Keep every `sample_every`-th record of a message type, and at most `per_second` of them per second."""
+
+    def __init__(self, sample_every: int = 1, per_second: Optional[float] = None):
+        self.sample_every = sample_every
+        self.per_second = per_second
+        self._count = 0
+        self._tokens = per_second or 0.0
+        self._last = time.monotonic()
+
+    def allow(self) -> bool:
+        self._count += 1
+        if self._count % self.sample_every != 0:
+            return False
+        if self.per_second is None:
+            return True
+        now = time.monotonic()
+        # Token bucket holding up to one second of records
+        self._tokens = min(self.per_second, self._tokens + (now - self._last) * self.per_second)
+        self._last = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+
+class LogWriter(QueueListener):
+    """QueueListener that waits for room in a full queue to stop, instead of failing to."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class SampledQueueHandler(logging.Handler):
+    """Puts unformatted records on a bounded queue for a `QueueListener`, see module docstring."""
+
+    def __init__(self, record_queue: queue.Queue, limits: Optional[Dict[str, MessageLimit]] = None):
+        """
+        Args:
+            record_queue: Queue the writer thread reads from, bounded.
+            limits: Message template -> its limit. Other messages are all kept.
+        """
+        super().__init__()
+        self.queue = record_queue
+        self.limits = dict(limits or {})
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def emit(self, record: logging.LogRecord):
+        # Handler.handle holds the handler's lock around emit, so the limits and counters need no lock of their own
+        limit = self.limits.get(record.msg) if isinstance(record.msg, str) else None
+        if limit is not None and not limit.allow():
+            self.sampled_out += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped, "sampled_out": self.sampled_out}
+
+
+def start_client_logging(filename: str, level: int = logging.INFO, limits: Optional[Dict[str, MessageLimit]] = None,
+                         queue_size: int = DEFAULT_QUEUE_SIZE, mode: str = "w+") -> Optional[SampledQueueHandler]:
+    """
+    Log everything from `level` on to `filename` through a writer thread, like `logging.basicConfig(filename=...)`
+    would directly. Returns the handler, for its `stats()`. The writer drains the queue on exit.
+
+    Like basicConfig, does nothing if the root logger already has handlers: returns the handler installed by an
+    earlier call, or None if logging was configured some other way.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return next((h for h in root.handlers if isinstance(h, SampledQueueHandler)), None)
+    file_handler = logging.FileHandler(filename, mode=mode)
+    file_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    handler = SampledQueueHandler(queue.Queue(queue_size), limits)
+    listener = LogWriter(handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
@@ -0,0 +1,19 @@
+"""
+The client process' one asyncio event loop. It runs on a daemon thread started on first use, so code running on
+PythonNET threads hands work to it with `asyncio.run_coroutine_threadsafe` / `loop.call_soon_threadsafe` instead of
+starting threads of its own.
+"""
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(name="ClientEventLoop", target=_loop.run_forever, daemon=True).start()
+        return _loop
@@ -0,0 +1,117 @@
+"""
+Binary client/server protocol, an alternative to RLlib's pickled HTTP `PolicyClient` requests.
+
+One persistent TCP connection per client. Every message is a frame:
+
+    <I  length of everything after this field
+    <B  message type, see `MessageType`
+    ... payload
+
+Payloads are fixed per message type:
+
+    START_EPISODE   client -> server    <B training enabled, <B vision encoding (see vision_codec.VisionEncoding)
+    EPISODE         server -> client    <I episode handle
+    GET_ACTION      client -> server    <I episode handle, observation (see below)
+    ACTION          server -> client    one uint8 per action dimension
+    LOG_RETURNS     client -> server    <I episode handle, <d reward, optionally the step info as UTF-8 JSON
+    END_EPISODE     client -> server    <I episode handle, observation
+    STEP            client -> server    <I episode handle, <d reward of the previous action, observation
+    OK              server -> client    empty
+    ERROR           server -> client    utf-8 error message
+
+Observations of PACKED episodes are packed observations (see observation_codec.py). In DELTA episodes they are the
+packed observation without its vision block (header, then the float block) followed by one encoded vision frame
+(see vision_codec.py), and the server reconstructs the full packed observation before decoding it.
+
+The info of LOG_RETURNS is only sent when there is one, in practice with the last reward of an episode, which
+carries the client's episode telemetry (see client_telemetry.py).
+
+STEP is LOG_RETURNS followed by GET_ACTION in one round trip and is answered with ACTION. The death and finished
+level flags of its observation are logged as the step's info.
+
+Every client message gets exactly one reply. Episode handles are assigned by the server and only valid on the
+connection that started the episode.
+"""
+from __future__ import annotations
+
+import json
+import socket
+import struct
+from enum import IntEnum
+from typing import Optional, Tuple
+
+FRAME_HEADER = struct.Struct("<IB")
+EPISODE_HANDLE = struct.Struct("<I")
+START_EPISODE = struct.Struct("<BB")
+LOG_RETURNS = struct.Struct("<Id")
+STEP = LOG_RETURNS
+
+# Guards against reading garbage as a huge length
+MAX_FRAME_SIZE = 1 << 20
+
+
+class MessageType(IntEnum):
+    START_EPISODE = 1
+    GET_ACTION = 2
+    LOG_RETURNS = 3
+    END_EPISODE = 4
+    STEP = 5
+    EPISODE = 64
+    ACTION = 65
+    OK = 66
+    ERROR = 67
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_info(info: Optional[dict]) -> bytes:
+    """A step info dict as the optional tail of LOG_RETURNS, numpy scalars included."""
+    if not info:
+        return b""
+    return json.dumps(info, default=lambda value: value.item() if hasattr(value, "item") else str(value)).encode()
+
+
+def decode_info(payload) -> Optional[dict]:
+    return json.loads(bytes(payload)) if len(payload) > 0 else None
+
+
+def pack_frame(message_type: MessageType, *payload) -> bytes:
+    """One frame as bytes. `payload` parts (bytes-like) are concatenated."""
+    length = 1 + sum(len(part) for part in payload)
+    return b"".join((FRAME_HEADER.pack(length, message_type), *payload))
+
+
+def send_frame(sock: socket.socket, message_type: MessageType, *payload):
+    """Send one frame. `payload` parts (bytes-like) are concatenated."""
+    sock.sendall(pack_frame(message_type, *payload))
+
+
+def parse_frame_header(header) -> Tuple[MessageType, int]:
+    """Message type and payload size of a frame from its FRAME_HEADER.size bytes header."""
+    length, message_type = FRAME_HEADER.unpack(header)
+    if length < 1 or length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Bad frame length {length}")
+    try:
+        return MessageType(message_type), length - 1
+    except ValueError:
+        raise ProtocolError(f"Unknown message type {message_type}")
+
+
+def recv_frame(sock: socket.socket) -> Tuple[MessageType, memoryview]:
+    """Receive one frame, returns its type and payload. Raises ConnectionError if the peer closed the socket."""
+    message_type, size = parse_frame_header(_recv_exactly(sock, FRAME_HEADER.size))
+    return message_type, memoryview(_recv_exactly(sock, size))
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Connection closed by peer")
+        received += count
+    return buffer
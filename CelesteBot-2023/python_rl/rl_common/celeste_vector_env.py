@@ -0,0 +1,142 @@
+"""
+Gymnasium `VectorEnv` over several `CelesteEnv`s, one per game instance, so a single batched policy forward pass
+can serve all of them.
+
+Observations are stacked into one dict of arrays with a leading env dimension (`observation_space` is the batched
+space), or into one (num_envs, size) array with flat observations (see rl_common/flat_observation.py).
+Episodes reset automatically like gymnasium's SyncVectorEnv: when an env terminates, the observation returned for
+it is the first one of its next episode and the last one is in `infos["final_observation"]`.
+
+Two ways to wait in `step_wait`:
+
+    "all"       block until every env has answered its action, like SyncVectorEnv.
+    "ready"     return as soon as `min_ready` envs have a new observation (or after `timeout`), so one stalled or
+                slowly restarting game doesn't hold up the batch. `infos["ready"]` (also `self.ready`) marks the envs
+                whose observation is new. Only those envs take their action on the next `step_async`, the actions
+                of the others are ignored. A terminated env whose next episode hasn't started yet reports its
+                reward and termination but isn't ready until the game publishes the new first observation.
+"""
+from __future__ import annotations
+
+import time
+from copy import deepcopy
+from typing import Any, List, Optional, Sequence, Union
+
+import numpy as np
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import create_empty_array
+
+from python_rl.rl_common.celestebot_env import CelesteEnv
+
+# Per env state between steps
+_READY = 0  # has an observation waiting for an action
+_PENDING = 1  # action sent, waiting for the game's answer
+_RESETTING = 2  # episode ended, waiting for the first observation of the next one
+
+
+class CelesteVectorEnv(VectorEnv):
+
+    def __init__(self, envs: Sequence[CelesteEnv], wait_mode: str = "all", min_ready: int = 1,
+                 timeout: Optional[float] = None, poll_interval: float = 0.0005, copy: bool = True):
+        """
+        Args:
+            envs: The envs to step together, each fed by its own game.
+            wait_mode: "all" or "ready", see module docstring.
+            min_ready: In "ready" mode, the number of new observations `step_wait` waits for (capped at the number
+                of envs that were given an action).
+            timeout: In "ready" mode, return after this many seconds even if fewer envs are ready.
+            poll_interval: In "ready" mode, seconds between checks of the envs' transition buffers.
+            copy: Return a copy of the stacked observations instead of the buffer that the next call overwrites.
+        """
+        if wait_mode not in ("all", "ready"):
+            raise ValueError(f"Unknown wait mode: {wait_mode}")
+        self.envs = list(envs)
+        super().__init__(len(self.envs), self.envs[0].observation_space, self.envs[0].action_space)
+        self.wait_mode = wait_mode
+        self.min_ready = min_ready
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.copy = copy
+        self.observations = create_empty_array(self.single_observation_space, n=self.num_envs, fn=np.zeros)
+        self.rewards = np.zeros(self.num_envs, dtype=np.float64)
+        self.terminateds = np.zeros(self.num_envs, dtype=np.bool_)
+        self.truncateds = np.zeros(self.num_envs, dtype=np.bool_)
+        self.ready = np.zeros(self.num_envs, dtype=np.bool_)
+        self._states = [_RESETTING] * self.num_envs  # type: List[int]
+
+    def reset_wait(self, seed: Optional[Union[int, List[int]]] = None, options: Optional[dict] = None):
+        # The games publish the first observation of an episode on their own, there is nothing to start in
+        # reset_async
+        if seed is None or isinstance(seed, int):
+            seed = [None if seed is None else seed + i for i in range(self.num_envs)]
+        infos = {}
+        for i, env in enumerate(self.envs):
+            observation, info = env.reset(seed=seed[i], options=options)
+            self._write_observation(i, observation)
+            infos = self._add_info(infos, info, i)
+        self._states = [_READY] * self.num_envs
+        self.ready[:] = True
+        return self._observations(), infos
+
+    def step_async(self, actions):
+        for i in np.flatnonzero(self.ready):
+            self.envs[i].add_action(actions[i])
+            self._states[i] = _PENDING
+        self.ready[:] = False
+
+    def step_wait(self):
+        self.rewards[:] = 0.0
+        self.terminateds[:] = False
+        self.truncateds[:] = False
+        infos = {}
+        waiting = sum(state != _READY for state in self._states)
+        min_ready = min(self.min_ready, waiting)
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        while True:
+            for i, env in enumerate(self.envs):
+                if self._states[i] == _PENDING and self._can_collect(env):
+                    infos = self._collect_step(i, env, infos)
+                if self._states[i] == _RESETTING and self._can_collect(env):
+                    observation, _ = env.reset()
+                    self._write_observation(i, observation)
+                    self._states[i] = _READY
+                    self.ready[i] = True
+            if self.wait_mode == "all" or self.ready.sum() >= min_ready:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+        infos["ready"] = self.ready.copy()
+        return self._observations(), self.rewards.copy(), self.terminateds.copy(), self.truncateds.copy(), infos
+
+    def _can_collect(self, env: CelesteEnv) -> bool:
+        return self.wait_mode == "all" or env.transition_ready()
+
+    def _collect_step(self, i: int, env: CelesteEnv, infos: dict) -> dict:
+        observation, reward, terminated, truncated, info = env.collect_step()
+        self.rewards[i] = reward
+        self.terminateds[i] = terminated
+        self.truncateds[i] = truncated
+        if terminated or truncated:
+            if isinstance(observation, np.ndarray):
+                final_observation = observation.copy()
+            else:
+                final_observation = {key: value.copy() for key, value in observation.items()}
+            infos = self._add_info(infos, {"final_observation": final_observation, "final_info": info}, i)
+            self._states[i] = _RESETTING
+        else:
+            self._write_observation(i, observation)
+            infos = self._add_info(infos, info, i)
+            self._states[i] = _READY
+            self.ready[i] = True
+        return infos
+
+    def _write_observation(self, i: int, observation):
+        if isinstance(observation, np.ndarray):
+            self.observations[i] = observation
+            return
+        for key, value in observation.items():
+            self.observations[key][i] = value
+
+    def _observations(self) -> Any:
+        return deepcopy(self.observations) if self.copy else self.observations
@@ -1,16 +1,23 @@
 from __future__ import annotations
 
 import logging
+import math
+import os
 import queue
 import time
 from enum import Enum
-from typing import SupportsFloat, Any, List, OrderedDict
+from collections import OrderedDict
+from typing import SupportsFloat, Any, List, Optional
 
 import gymnasium as gym
 import numpy as np
 from gymnasium.core import ActType, ObsType, RenderFrame, spaces
-from ray.rllib import ExternalEnv
-from ray.rllib.models.preprocessors import get_preprocessor
+
+from python_rl.rl_common.flat_observation import (flat_observation_layout, flat_observation_space,
+                                                   flat_observation_views, flat_observations_enabled)
+from python_rl.rl_common.trajectory_recorder import TrajectoryRecorder
+from python_rl.rl_common.transition_buffer import TransitionRingBuffer
+from python_rl.rl_common.vision_modes import VisionTransform
 
 
 class TerminationEvent(Enum):
@@ -19,6 +26,15 @@ class TerminationEvent(Enum):
     FINISHED_LEVEL = 2
 
 
+# Largest number of calculation periods the agent can hold an action for, 1 turns the action repeat dimension off.
+# The game and the server have to agree on the action space, so this is read from the environment.
+MAX_ACTION_REPEAT_ENV_VAR = "CELESTEBOT_MAX_ACTION_REPEAT"
+# The game's CalculationsPerSecond setting, only used to report frames per second
+CALCULATIONS_PER_SECOND_ENV_VAR = "CELESTEBOT_CALCULATIONS_PER_SECOND"
+DEFAULT_CALCULATIONS_PER_SECOND = 4
+GAME_FPS = 60
+
+
 class CelesteEnv(gym.Env):
     VISION_SIZE = 40
     ENTITY_MAX_COUNT = 255
@@ -27,8 +43,17 @@ class CelesteEnv(gym.Env):
     MIN_POSITION = -50000
     MAX_POSITION = 50000
     NOOP_ACTION = np.array([0, 0, 0, 0, 3])
+    TRANSITION_BUFFER_CAPACITY = 64
+
+    # step() hands these out instead of building a new info dict every step, don't mutate them
+    STEP_INFOS = {
+        event: {"Died": event == TerminationEvent.DEATH, "Finished Level": event == TerminationEvent.FINISHED_LEVEL}
+        for event in TerminationEvent
+    }
 
-    def __init__(self, action_queue=None, off_policy=False, logger=None):
+    def __init__(self, action_queue=None, off_policy=False, logger=None,
+                 transition_buffer_capacity=TRANSITION_BUFFER_CAPACITY, max_action_repeat=None,
+                 flat_observations=None, vision_transform=None):
         """
         Action Space
         Up/Down: 3
@@ -47,8 +72,9 @@ class CelesteEnv(gym.Env):
         Climb: 2
             NOOP
             Climb
-        Number of frames between next action:
-            [4, 10] => 6 discrete plus 4
+        Action repeat: max_action_repeat, only if max_action_repeat > 1
+            n => the game holds the action for n + 1 calculation periods (60 / CalculationsPerSecond frames each)
+                 before sending the next observation
 
 
         Observation Space
@@ -59,60 +85,169 @@ class CelesteEnv(gym.Env):
 
         CanDash: [0 or 1]
         Stamina: (-1, 120)
+
+        The vision is the game's VISION_SIZE grid reduced by vision_transform (by default from
+        CELESTEBOT_VISION_MODE and CELESTEBOT_VISION_VOCABULARY, see rl_common/vision_modes.py) to `vision_size`.
+
+        With flat_observations (by default CELESTEBOT_OBSERVATION_LAYOUT=flat) the observation space is a single
+        float32 Box holding all of the above, see rl_common/flat_observation.py. `dict_observation_space` is the
+        Dict either way.
         """
-        self.logger = logger
+        self.logger = logger or logging.getLogger(__name__)
         self.off_policy = off_policy
-        self.action_space = spaces.MultiDiscrete([3, 3, 4, 2])
-        shape = (self.VISION_SIZE, self.VISION_SIZE, 1)
+        if max_action_repeat is None:
+            max_action_repeat = int(os.environ.get(MAX_ACTION_REPEAT_ENV_VAR, 1))
+        self.max_action_repeat = max_action_repeat
+        if max_action_repeat > 1:
+            self.action_space = spaces.MultiDiscrete([3, 3, 4, 2, max_action_repeat])
+        else:
+            self.action_space = spaces.MultiDiscrete([3, 3, 4, 2])
+        self.frames_per_calculation = GAME_FPS // int(
+            os.environ.get(CALCULATIONS_PER_SECOND_ENV_VAR, DEFAULT_CALCULATIONS_PER_SECOND))
+        self.vision_transform = vision_transform or VisionTransform.from_env()  # type: VisionTransform
+        self.vision_size = self.vision_transform.size
+        self.dict_observation_space = self.build_observation_space(self.vision_size,
+                                                                   self.vision_transform.num_entities - 1)
+        if flat_observations is None:
+            flat_observations = flat_observations_enabled()
+        if flat_observations:
+            self.flat_layout = flat_observation_layout(self.dict_observation_space)
+            self.observation_space = flat_observation_space(self.dict_observation_space)
+        else:
+            self.flat_layout = None
+            self.observation_space = self.dict_observation_space
+        # Transitions (observation, reward, termination event, sequence number), written in place by the client
+        self.transitions = TransitionRingBuffer(self.dict_observation_space, transition_buffer_capacity,
+                                                flat_layout=self.flat_layout)
+        self.action_queue = action_queue  # type: queue.Queue[List[int]]
+        # Return copies instead of views into the transition buffer, for consumers that keep observations around
+        self.copy_observations = False
+
+        # Transition bookkeeping, see transition_stats()
+        self.last_sequence = None
+        self.sequence_gaps = 0
+        self.missing_rewards = 0
+        self.unexpected_rewards = 0
+        self.num_transitions = 0
+        self.last_wait_time = 0.0
+        self.total_wait_time = 0.0
+        # perf_counter() after the last action was queued, and how long queueing it took
+        self.last_action_time = 0.0
+        self.last_enqueue_time = 0.0
+        self.last_action = None
+        # Decisions taken vs calculation periods they cover, see transition_stats()
+        self.num_decisions = 0
+        self.num_calculations = 0
+        self.first_action_time = None
+        # Every consumed transition is also streamed to this recorder, if set
+        self.recorder = None  # type: Optional[TrajectoryRecorder]
 
-        self.observation_space = spaces.Dict({
+    @classmethod
+    def build_observation_space(cls, vision_size: int = VISION_SIZE,
+                                entity_max_count: int = ENTITY_MAX_COUNT) -> spaces.Dict:
+        shape = (vision_size, vision_size, 1)
+        return spaces.Dict({
             "can_dash": spaces.MultiBinary(1),
             "is_climbing": spaces.MultiBinary(1),
-            "map_entities_vision": spaces.Box(0, self.ENTITY_MAX_COUNT, shape=shape,
+            "map_entities_vision": spaces.Box(0, entity_max_count, shape=shape,
                                               dtype=np.uint8),
             "on_ground": spaces.MultiBinary(1),
-            "position": spaces.Box(self.MIN_POSITION, self.MAX_POSITION, shape=(2,), dtype=np.float32),
-            "speed_x_y": spaces.Box(self.MIN_SPEED, self.MAX_SPEED, shape=(2,), dtype=np.float16),
+            "position": spaces.Box(cls.MIN_POSITION, cls.MAX_POSITION, shape=(2,), dtype=np.float32),
+            "speed_x_y": spaces.Box(cls.MIN_SPEED, cls.MAX_SPEED, shape=(2,), dtype=np.float16),
             "stamina": spaces.Box(-10, 10, shape=(1,), ),
-            "target": spaces.Box(self.MIN_POSITION, self.MAX_POSITION, shape=(2,), dtype=np.float32),
+            "target": spaces.Box(cls.MIN_POSITION, cls.MAX_POSITION, shape=(2,), dtype=np.float32),
         })
-        self.observation_queue = queue.Queue()  # type: queue.Queue[OrderedDict]
-        self.reward_queue = queue.Queue()  # type: queue.Queue[float]
-        self.action_queue = action_queue  # type: queue.Queue[List[int]]
-        self.termination_event_queue = queue.Queue()  # type: queue.Queue[TerminationEvent]
+
+    def observation_fields(self, observation) -> OrderedDict:
+        """`observation` by key, as views for flat observations."""
+        if self.flat_layout is None:
+            return observation
+        return flat_observation_views(observation, self.flat_layout)
 
     def add_action(self, action):
-        self.action_queue.put([int(x) for x in action.tolist()])
-
-    def get_reward(self):
-        try:
-            reward = self.reward_queue.get(timeout=0.5)
-        except queue.Empty:
-            self.logger.log(logging.INFO, "Timed out waiting for reward")
-            self.logger.log(logging.INFO, "queue size: " + str(self.reward_queue.qsize()))
-            reward = 0.0
-        # self.logger.log(logging.INFO, "Reward: " + str(reward))
-        # info = self.info_queue.get()
-        # self.episode_rewards += reward
-        # self.info_queue.task_done()
-        return reward
+        start = time.perf_counter()
+        action_list = [int(x) for x in action.tolist()]
+        self.action_queue.put(action_list)
+        self.last_action = action
+        self.num_decisions += 1
+        self.num_calculations += action_list[4] + 1 if len(action_list) > 4 else 1
+        if self.first_action_time is None:
+            self.first_action_time = start
+        self.last_action_time = time.perf_counter()
+        self.last_enqueue_time = self.last_action_time - start
+
+    def next_transition(self):
+        """Wait for the next transition from the game and check its sequence number."""
+        start = time.perf_counter()
+        observation, reward, termination, sequence = self.transitions.get()
+        self.last_wait_time = time.perf_counter() - start
+        self.total_wait_time += self.last_wait_time
+        self.num_transitions += 1
+        if self.last_sequence is not None and sequence != self.last_sequence + 1:
+            self.sequence_gaps += 1
+            self.logger.log(logging.WARNING, f"Transition sequence jumped from {self.last_sequence} to {sequence}")
+        self.last_sequence = sequence
+        if self.copy_observations:
+            if self.flat_layout is not None:
+                observation = observation.copy()
+            else:
+                observation = OrderedDict((key, value.copy()) for key, value in observation.items())
+        return observation, reward, termination
+
+    def transition_stats(self):
+        elapsed = time.perf_counter() - self.first_action_time if self.first_action_time is not None else 0.0
+        decisions_per_s = self.num_decisions / elapsed if elapsed > 0 else 0.0
+        calculations_per_s = self.num_calculations / elapsed if elapsed > 0 else 0.0
+        return {
+            "transitions": self.num_transitions,
+            "sequence_gaps": self.sequence_gaps,
+            "missing_rewards": self.missing_rewards,
+            "unexpected_rewards": self.unexpected_rewards,
+            "last_wait_time_s": self.last_wait_time,
+            "mean_wait_time_s": self.total_wait_time / max(self.num_transitions, 1),
+            "decisions": self.num_decisions,
+            "mean_action_repeat": self.num_calculations / max(self.num_decisions, 1),
+            "decisions_per_s": decisions_per_s,
+            "frames_per_s": calculations_per_s * self.frames_per_calculation,
+        }
 
     def step(self, action: ActType) -> tuple[ObsType, SupportsFloat, bool, bool, dict[str, Any]]:
-        # Doesnt return reward yet
         self.add_action(action)
-        observation = self.observation_queue.get()
+        return self.collect_step()
+
+    def transition_ready(self) -> bool:
+        """Whether the game has published a transition that the next step/reset will return without waiting."""
+        return len(self.transitions) > 0
 
-        # reward = self.reward_queue.get()
-        reward = self.get_reward()
-        termination_event = self.termination_event_queue.get()
-        termination = termination_event == TerminationEvent.DEATH or termination_event == TerminationEvent.FINISHED_LEVEL
-        return observation, reward, termination, False, {"Died": termination_event == TerminationEvent.DEATH,
-                                                    "Finished Level": termination_event == TerminationEvent.FINISHED_LEVEL}
+    def collect_step(self) -> tuple[ObsType, SupportsFloat, bool, bool, dict[str, Any]]:
+        """The second half of `step`: wait for the transition answering the last queued action and return it."""
+        observation, reward, termination = self.next_transition()
+        if math.isnan(reward):
+            # The game didn't attach a reward to this transition, count it instead of silently training on it
+            self.missing_rewards += 1
+            self.logger.log(logging.INFO, f"Transition {self.last_sequence} has no reward "
+                                          f"({self.missing_rewards} so far)")
+            reward = 0.0
+        if self.recorder is not None:
+            # The reward the policy is trained on, NaN only marks the first row of an episode
+            self.recorder.record(self.observation_fields(observation), reward, termination, self.last_sequence,
+                                 self.last_action)
+        termination_event = TerminationEvent(termination)
+        terminated = termination_event == TerminationEvent.DEATH or termination_event == TerminationEvent.FINISHED_LEVEL
+        return observation, reward, terminated, False, self.STEP_INFOS[termination_event]
 
     def reset(self, *, seed: int | None = None, options: dict[str, Any] | None = None) -> tuple[
         ObsType, dict[str, Any]]:
         super().reset(seed=seed)
-        return self.observation_queue.get(), {}
+        observation, reward, termination = self.next_transition()
+        if self.recorder is not None:
+            self.recorder.start_episode()
+            self.recorder.record(self.observation_fields(observation), reward, termination, self.last_sequence)
+        if not math.isnan(reward):
+            # The first observation of an episode shouldn't carry a reward, we are out of step with the game
+            self.unexpected_rewards += 1
+            self.logger.log(logging.INFO, f"Transition {self.last_sequence} starts an episode but has a reward")
+        return observation, {}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+"""
+Per-episode client telemetry. Clients put `EpisodeTelemetry.end()` under TELEMETRY_INFO_KEY in the info of the last
+`log_returns` of every episode, which reaches the server's episode like any step info (pickled over HTTP, as JSON
+over the binary transport). On the server, `ClientTelemetryCallbacks` (rl_server/telemetry_callbacks.py) turns it
+into custom metrics.
+
+Fields, for the episode that just ended:
+    client_id           CelesteClient.client_id
+    port                server port the client is attached to
+    steps               actions taken
+    duration_s          seconds from the first action to the end
+    steps_per_s         steps / duration_s
+    action_mean_ms, action_p50_ms, action_p95_ms, action_p99_ms, action_max_ms
+                        latency of get_action / step requests (or local inference), see rl_common/latency.py
+    timeouts            action requests that got no reply within config.REQUEST_TIMEOUT since the previous episode's
+                        report (every transport sets that timeout on its requests). A timeout usually ends
+                        the episode it happened in without a report, so it is counted in the next one's
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, Union
+
+from python_rl.rl_common.latency import LatencyHistogram
+
+TELEMETRY_INFO_KEY = "client_telemetry"
+
+
+class EpisodeTelemetry:
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.action_latency = LatencyHistogram()
+        self.timeouts = 0
+        self._start = time.perf_counter()
+
+    def start(self):
+        """Start measuring a new episode."""
+        self.action_latency.reset()
+        self._start = time.perf_counter()
+
+    def record_action(self, seconds: float):
+        self.action_latency.record(seconds)
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+    def end(self, port: int, steps: int) -> Dict[str, Union[str, float]]:
+        """The episode's telemetry, see module docstring. Latencies are measured on until the next `start`."""
+        duration = time.perf_counter() - self._start
+        telemetry = {
+            "client_id": self.client_id,
+            "port": port,
+            "steps": steps,
+            "duration_s": duration,
+            "steps_per_s": steps / duration if duration > 0 else 0.0,
+            "timeouts": self.timeouts,
+        }
+        self.timeouts = 0
+        for key, value in self.action_latency.summary().items():
+            if key != "count":
+                telemetry[f"action_{key}"] = value
+        return telemetry
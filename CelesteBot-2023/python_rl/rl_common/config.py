@@ -0,0 +1,15 @@
+"""
+Settings the training server, the inference server and the client share. Kept free of imports so the client (which
+the game loads while starting up) can read them without pulling in the server's Ray, Tune and RLlib modules.
+"""
+SERVER_ADDRESS = "127.0.0.1"
+# Policy server workers listen from this port on, see rl_common/port_registry.py
+SERVER_BASE_PORT = 9900
+# Listening workers of the training server, clients without a port registry spread over this many ports
+NUM_WORKERS = 2
+# Seconds a client waits for any one reply of the server before giving up on the request
+REQUEST_TIMEOUT = 30.0
+# Seconds a client waits before connecting again when no server could be reached, doubled up to the maximum while
+# that lasts
+CONNECT_RETRY_DELAY = 0.5
+MAX_CONNECT_RETRY_DELAY = 10.0
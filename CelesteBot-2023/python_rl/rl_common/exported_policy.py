@@ -0,0 +1,140 @@
+"""
+Runs policies exported by rl_server/policy_export.py without Ray or RLlib: only torch for TorchScript artifacts, only
+onnxruntime for ONNX ones.
+
+An export is an artifact (`policy_<precision>.pt` or `policy_<precision>.onnx`) plus `<artifact>.json`, the
+manifest describing its inputs and outputs:
+
+    observation_layout  "dict" or "flat" (rl_common/flat_observation.py)
+    observation_keys    for "dict": [key, shape] in the order RLlib's Dict preprocessor flattens them
+    observation_size    length of the flattened observation the artifact takes
+    action_nvec         the MultiDiscrete action space
+    state               per recurrent state input, its shape and, for attention memory, the window of past
+                        outputs it takes (null for LSTM style state that is replaced every step)
+    batch_size          null, or the only batch size the artifact takes (recurrent RLlib models trace to a graph
+                        for one batch size, `ExportedPolicy.compute` splits larger batches)
+
+The artifact takes (obs[B, observation_size], *state) in float32 and returns (actions[B, len(action_nvec)],
+logits[B, sum(action_nvec)], value[B], *state_out). Actions are the most likely action of every branch, i.e. the
+deterministic policy. fp16 artifacts store half precision weights and compute in half precision, except for
+normalization and attention layers (see policy_export.FLOAT32_MODULES), their inputs and outputs stay float32.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+EXPORT_MANIFEST_VERSION = 1
+
+
+def manifest_path(artifact: str) -> str:
+    return f"{artifact}.json"
+
+
+def read_export_manifest(artifact: str) -> dict:
+    with open(manifest_path(artifact)) as f:
+        manifest = json.load(f)
+    if manifest["version"] != EXPORT_MANIFEST_VERSION:
+        raise ValueError(f"Unsupported export manifest version {manifest['version']} in {artifact}")
+    return manifest
+
+
+class ExportedPolicy:
+
+    def __init__(self, artifact: str, num_threads: int = None):
+        """
+        Args:
+            artifact: Path of the exported .pt or .onnx file, its manifest is next to it.
+            num_threads: Intra-op threads of the runtime, its default if None.
+        """
+        self.artifact = artifact
+        self.manifest = read_export_manifest(artifact)
+        self.format = self.manifest["format"]
+        self.observation_size = self.manifest["observation_size"]
+        self.action_nvec = self.manifest["action_nvec"]
+        self.state_specs = self.manifest["state"]
+        self.batch_size = self.manifest.get("batch_size")
+        self._observation_keys = [(key, int(np.prod(shape))) for key, shape in self.manifest["observation_keys"]]
+        if self.format == "torchscript":
+            import torch
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            self._torch = torch
+            self._module = torch.jit.load(artifact, map_location="cpu")
+            self._module.eval()
+        elif self.format == "onnx":
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            self._session = onnxruntime.InferenceSession(artifact, options, providers=["CPUExecutionProvider"])
+            self._input_names = [i.name for i in self._session.get_inputs()]
+        else:
+            raise ValueError(f"Unknown export format {self.format} in {artifact}")
+
+    @property
+    def recurrent(self) -> bool:
+        return len(self.state_specs) > 0
+
+    def preprocess(self, observations: Sequence, out: np.ndarray = None) -> np.ndarray:
+        """Flatten observation dicts (or flat observations) into the float32 batch the artifact takes."""
+        if out is None:
+            out = np.empty((len(observations), self.observation_size), dtype=np.float32)
+        for row, observation in zip(out, observations):
+            if isinstance(observation, np.ndarray):
+                row[:] = observation.reshape(-1)
+                continue
+            offset = 0
+            for key, size in self._observation_keys:
+                row[offset:offset + size] = np.asarray(observation[key]).reshape(-1)
+                offset += size
+        return out
+
+    def initial_state(self, batch_size: int) -> List[np.ndarray]:
+        states = []
+        for spec in self.state_specs:
+            shape = (batch_size,) + ((spec["window"],) if spec["window"] else ()) + tuple(spec["shape"])
+            states.append(np.zeros(shape, dtype=np.float32))
+        return states
+
+    def next_state(self, state: Sequence[np.ndarray], state_out: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """The state inputs of the next step: state_out, or for attention memory the window shifted by it."""
+        states = []
+        for spec, previous, new in zip(self.state_specs, state, state_out):
+            if spec["window"]:
+                states.append(np.concatenate([previous[:, 1:], new[:, None]], axis=1))
+            else:
+                states.append(np.asarray(new))
+        return states
+
+    def compute(self, observations: np.ndarray, state: Sequence[np.ndarray] = ()) -> Tuple[
+            np.ndarray, np.ndarray, np.ndarray, List[np.ndarray]]:
+        """Actions, logits, values and state outputs for a (B, observation_size) float32 batch."""
+        if self.batch_size is not None and len(observations) != self.batch_size:
+            parts = [
+                self.compute(observations[i:i + self.batch_size], [s[i:i + self.batch_size] for s in state])
+                for i in range(0, len(observations), self.batch_size)
+            ]
+            actions, logits, value, state_out = zip(*parts)
+            return (np.concatenate(actions), np.concatenate(logits), np.concatenate(value),
+                    [np.concatenate(s) for s in zip(*state_out)])
+        if self.format == "torchscript":
+            torch = self._torch
+            with torch.no_grad():
+                outputs = self._module(torch.from_numpy(observations), *[torch.from_numpy(s) for s in state])
+            outputs = [output.numpy() for output in outputs]
+        else:
+            feeds = dict(zip(self._input_names, [observations] + list(state)))
+            outputs = self._session.run(None, feeds)
+        actions, logits, value = outputs[:3]
+        return actions, logits, value, list(outputs[3:])
+
+
+def find_exports(directory: str) -> List[str]:
+    """Artifacts with a manifest in `directory`."""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.endswith((".pt", ".onnx")) and os.path.exists(manifest_path(os.path.join(directory, name))))
@@ -0,0 +1,100 @@
+"""
+Opt-in flat observation layout: CELESTEBOT_OBSERVATION_LAYOUT=flat turns `CelesteEnv.observation_space` from the
+Dict of eight keys into one float32 Box, so RLlib's preprocessor passes observations through instead of flattening
+and casting the Dict on every action and again for every training batch. The client, the server and the game side
+code have to agree, so the setting is read from the environment like the other CELESTEBOT_ settings.
+
+The vision comes first so it and the scalars are each one contiguous slice. Offsets with V = vision size (40):
+
+    offset          size    key
+    0               V * V   map_entities_vision, row-major (V, V, 1)
+    V * V           1       can_dash
+    V * V + 1       1       is_climbing
+    V * V + 2       1       on_ground
+    V * V + 3       2       position x/y
+    V * V + 5       2       speed_x_y
+    V * V + 7       1       stamina
+    V * V + 8       2       target x/y
+    V * V + 10              total
+
+i.e. the vision followed by the other keys of the Dict space in their order. This is not the order RLlib's Dict
+preprocessor flattens to, so checkpoints trained on one layout don't work with the other.
+
+Producers keep filling observations by key through `flat_observation_views`, which are views into the flat buffer.
+Models use `split_flat_observation` to get the vision and scalar parts back as views, the server's does
+(rl_common/flat_observation_model.py).
+"""
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from typing import Mapping, Tuple, Union
+
+import numpy as np
+from gymnasium import spaces
+
+OBSERVATION_LAYOUT_ENV_VAR = "CELESTEBOT_OBSERVATION_LAYOUT"
+DEFAULT_OBSERVATION_LAYOUT = "dict"
+VISION_KEY = "map_entities_vision"
+
+
+def flat_observations_enabled() -> bool:
+    layout = os.environ.get(OBSERVATION_LAYOUT_ENV_VAR, DEFAULT_OBSERVATION_LAYOUT)
+    if layout not in ("dict", "flat"):
+        raise ValueError(f"Unknown observation layout: {layout}")
+    return layout == "flat"
+
+
+def flat_observation_layout(observation_space: Union[spaces.Dict, Mapping[str, np.ndarray]]) -> OrderedDict:
+    """
+    Key -> (offset, shape) of every key of `observation_space` in the flat layout, vision first. Also takes an
+    observation dict, e.g. `PackedObservationDecoder.new_observation()`.
+    """
+    if isinstance(observation_space, spaces.Dict):
+        observation_space = observation_space.spaces
+    keys = [VISION_KEY] + [key for key in observation_space if key != VISION_KEY]
+    layout = OrderedDict()
+    offset = 0
+    for key in keys:
+        shape = tuple(observation_space[key].shape)
+        layout[key] = (offset, shape)
+        offset += int(np.prod(shape))
+    return layout
+
+
+def flat_observation_size(layout: OrderedDict) -> int:
+    offset, shape = next(reversed(layout.values()))
+    return offset + int(np.prod(shape))
+
+
+def flat_observation_space(observation_space: spaces.Dict) -> spaces.Box:
+    """The Box for flat observations of `observation_space`, with the bounds of every key."""
+    layout = flat_observation_layout(observation_space)
+    low, high = [], []
+    for key, (_, shape) in layout.items():
+        space = observation_space[key]
+        if isinstance(space, spaces.MultiBinary):
+            low.append(np.zeros(shape, dtype=np.float32).reshape(-1))
+            high.append(np.ones(shape, dtype=np.float32).reshape(-1))
+        else:
+            low.append(np.broadcast_to(space.low, shape).astype(np.float32).reshape(-1))
+            high.append(np.broadcast_to(space.high, shape).astype(np.float32).reshape(-1))
+    return spaces.Box(np.concatenate(low), np.concatenate(high), dtype=np.float32)
+
+
+def flat_observation_views(flat: np.ndarray, layout: OrderedDict) -> OrderedDict:
+    """Per key views into `flat` (any leading dimensions), to read or fill a flat observation by key."""
+    leading = flat.shape[:-1]
+    return OrderedDict(
+        (key, flat[..., offset:offset + int(np.prod(shape))].reshape(leading + shape))
+        for key, (offset, shape) in layout.items())
+
+
+def split_flat_observation(flat, vision_size: int) -> Tuple:
+    """
+    The vision, shaped (..., V, V, 1), and the scalars, shaped (..., 10), of flat observations. Works on numpy
+    arrays and torch tensors, both parts are views of `flat`.
+    """
+    vision_cells = vision_size * vision_size
+    leading = tuple(flat.shape[:-1])
+    return flat[..., :vision_cells].reshape(leading + (vision_size, vision_size, 1)), flat[..., vision_cells:]
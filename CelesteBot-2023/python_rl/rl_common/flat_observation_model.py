@@ -0,0 +1,84 @@
+"""
+Torch model for flat observations (rl_common/flat_observation.py). Without it RLlib sees one Box of V * V + 10 floats
+and builds a fully connected network over all of them, ignoring `conv_filters`.
+
+`FlatObservationModel` splits the observations with `split_flat_observation` and builds what RLlib's
+ComplexInputNetwork builds for the Dict layout: a conv stack (`conv_filters`, `conv_activation`) on the vision, a
+fully connected stack (`fcnet_hiddens`, `fcnet_activation`) on the scalars, the two concatenated into the
+`post_fcnet_hiddens` stack and the logits and value heads on top. The scalars share one stack here instead of one per
+key. `dim` is the vision size. It can be wrapped with `use_lstm` or `use_attention` like the built-in models.
+
+Set as `"custom_model": FlatObservationModel` in the model config, the class itself (not a registered name) so
+processes restoring a checkpoint find it by import.
+"""
+from __future__ import annotations
+
+import numpy as np
+import torch
+from gymnasium.spaces import Box
+from ray.rllib.models.catalog import ModelCatalog
+from ray.rllib.models.modelv2 import ModelV2
+from ray.rllib.models.torch.misc import SlimFC, normc_initializer as torch_normc_initializer
+from ray.rllib.models.torch.torch_modelv2 import TorchModelV2
+from ray.rllib.policy.sample_batch import SampleBatch
+from ray.rllib.utils.annotations import override
+from torch import nn
+
+from python_rl.rl_common.flat_observation import split_flat_observation
+
+
+class FlatObservationModel(TorchModelV2, nn.Module):
+
+    def __init__(self, obs_space, action_space, num_outputs, model_config, name):
+        TorchModelV2.__init__(self, obs_space, action_space, num_outputs, model_config, name)
+        nn.Module.__init__(self)
+        self.vision_size = model_config["dim"]
+        vision_cells = self.vision_size * self.vision_size
+        low, high = obs_space.low, obs_space.high
+        vision_space = Box(low[:vision_cells].reshape(self.vision_size, self.vision_size, 1),
+                           high[:vision_cells].reshape(self.vision_size, self.vision_size, 1), dtype=np.float32)
+        scalar_space = Box(low[vision_cells:], high[vision_cells:], dtype=np.float32)
+
+        self.cnn = ModelCatalog.get_model_v2(vision_space, action_space, num_outputs=None, model_config={
+            "conv_filters": model_config.get("conv_filters"),
+            "conv_activation": model_config.get("conv_activation"),
+            "post_fcnet_hiddens": [],
+        }, framework="torch", name="cnn")
+        self.scalars = ModelCatalog.get_model_v2(scalar_space, action_space, num_outputs=None, model_config={
+            "fcnet_hiddens": model_config["fcnet_hiddens"],
+            "fcnet_activation": model_config.get("fcnet_activation"),
+            "post_fcnet_hiddens": [],
+        }, framework="torch", name="scalars")
+        concat_size = self.cnn.num_outputs + self.scalars.num_outputs
+        self.post_fc_stack = ModelCatalog.get_model_v2(
+            Box(float("-inf"), float("inf"), shape=(concat_size,), dtype=np.float32), action_space, None, {
+                "fcnet_hiddens": model_config.get("post_fcnet_hiddens", []),
+                "fcnet_activation": model_config.get("post_fcnet_activation", "relu"),
+            }, framework="torch", name="post_fc_stack")
+
+        self.logits_layer = None
+        self.value_layer = None
+        self._value_out = None
+        if num_outputs:
+            self.logits_layer = SlimFC(in_size=self.post_fc_stack.num_outputs, out_size=num_outputs,
+                                       activation_fn=None, initializer=torch_normc_initializer(0.01))
+            self.value_layer = SlimFC(in_size=self.post_fc_stack.num_outputs, out_size=1, activation_fn=None,
+                                      initializer=torch_normc_initializer(0.01))
+        else:
+            # Wrapped (LSTM, attention): the wrapper adds the heads
+            self.num_outputs = self.post_fc_stack.num_outputs
+
+    @override(ModelV2)
+    def forward(self, input_dict, state, seq_lens):
+        vision, scalars = split_flat_observation(input_dict[SampleBatch.OBS].float(), self.vision_size)
+        cnn_out, _ = self.cnn(SampleBatch({SampleBatch.OBS: vision}))
+        scalars_out, _ = self.scalars(SampleBatch({SampleBatch.OBS: scalars}))
+        out, _ = self.post_fc_stack(SampleBatch({SampleBatch.OBS: torch.cat([cnn_out, scalars_out], dim=1)}))
+        if self.logits_layer is None:
+            return out, []
+        self._value_out = torch.reshape(self.value_layer(out), [-1])
+        return self.logits_layer(out), []
+
+    @override(ModelV2)
+    def value_function(self):
+        return self._value_out
@@ -0,0 +1,102 @@
+"""
+Low overhead latency histograms for the per-step stages of the client loop.
+
+Each stage gets a `LatencyHistogram` with fixed, logarithmically spaced buckets (10 per decade from 1 us to 100 s),
+so recording a sample is one `bisect` and one list increment, well under a microsecond. Percentiles are read off the
+bucket counts and reported as the bucket's upper bound (capped at the max), i.e. with up to ~26% resolution, which
+is plenty to tell a slow learner from slow HTTP.
+
+`LatencyRecorder` owns one histogram per stage. `maybe_flush()` is meant to be called once per step: every
+`flush_interval` seconds it appends one JSON line with count, mean, p50/p95/p99 and max per stage to the metrics
+file and starts a new window, so the percentiles are rolling over that interval.
+
+Stages may be recorded from several threads (e.g. the PythonNET observation thread and the training loop). Counts
+aren't locked, a sample racing a flush may land in either window.
+"""
+from __future__ import annotations
+
+import json
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable
+
+BUCKET_BOUNDS = [10 ** (exponent / 10) for exponent in range(-60, 21)]  # seconds, 1 us .. 100 s
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        # One more bucket than bounds, for samples above the last bound
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (0 < q <= 100) sample, in seconds."""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / max(self.count, 1) * 1e3,
+            "p50_ms": self.percentile(50) * 1e3,
+            "p95_ms": self.percentile(95) * 1e3,
+            "p99_ms": self.percentile(99) * 1e3,
+            "max_ms": self.max * 1e3,
+        }
+
+    def reset(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+
+class LatencyRecorder:
+
+    def __init__(self, path: str, stages: Iterable[str], flush_interval: float = 10.0):
+        """
+        Args:
+            path: Metrics file, one JSON object per flush is appended to it.
+            stages: Names of the stages that will be recorded.
+            flush_interval: Seconds between flushes, also the window the percentiles are computed over.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+        self._window_start = time.perf_counter()
+
+    def record(self, stage: str, seconds: float):
+        self.histograms[stage].record(seconds)
+
+    def maybe_flush(self):
+        now = time.perf_counter()
+        if now - self._window_start >= self.flush_interval:
+            self.flush(now)
+
+    def flush(self, now: float = None):
+        now = now or time.perf_counter()
+        record = {"time": time.time(), "window_s": now - self._window_start}
+        for stage, histogram in self.histograms.items():
+            record[stage] = histogram.summary()
+            histogram.reset()
+        self._window_start = now
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
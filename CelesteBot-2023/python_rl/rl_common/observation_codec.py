@@ -0,0 +1,176 @@
+"""
+Packed binary observation layout of the Python client and the binary transport.
+
+Instead of handing the client a nested PyList for the vision grid plus a handful
+of small PyLists, a producer can pack one observation into a single contiguous
+buffer and call `CelesteClient.ext_add_observation_packed`. The client decodes it
+with `np.frombuffer` views, so no Python object is touched per vision cell. The
+game doesn't pack: it calls `ext_add_transition` with separate arguments. The
+producers are Python (benchmarks, the synthetic game) and the binary transport,
+which packs every observation it sends to the server.
+
+Layout (little endian, version 1), with V = vision size (40):
+
+    offset      size        field
+    0           2           magic, b"CB"
+    2           1           layout version
+    3           1           flags, see `ObservationFlags`
+    4           V * V       map_entities_vision, uint8, row-major
+    4 + V * V   9 * 4       float32: speed x/y, stamina, target x/y, position x/y, screen position x/y
+
+With an even V the vision block is a multiple of 4 bytes and the float block is
+4-byte aligned. With an odd V (e.g. a "crop:21" vision mode, rl_common/vision_modes.py)
+it isn't; `np.frombuffer` then returns unaligned float32 views, which numpy reads
+correctly, only a little slower.
+"""
+from __future__ import annotations
+
+import struct
+from collections import OrderedDict
+from enum import IntFlag
+from typing import Tuple, Union
+
+import numpy as np
+
+OBSERVATION_MAGIC = b"CB"
+OBSERVATION_LAYOUT_VERSION = 1
+DEFAULT_VISION_SIZE = 40
+
+_HEADER = struct.Struct("<2sBB")
+_SCALARS = struct.Struct("<9f")
+NUM_SCALARS = 9
+VISION_OFFSET = _HEADER.size
+SCALARS_SIZE = _SCALARS.size
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class ObservationFlags(IntFlag):
+    DEATH = 1
+    FINISHED_LEVEL = 2
+    CAN_DASH = 4
+    IS_CLIMBING = 8
+    ON_GROUND = 16
+
+
+def packed_observation_size(vision_size: int = DEFAULT_VISION_SIZE) -> int:
+    return _HEADER.size + vision_size * vision_size + _SCALARS.size
+
+
+def pack_observation(vision, speed_x_y, can_dash, stamina, death_flag, finished_level, target, position,
+                     screen_position, is_climbing, on_ground) -> bytes:
+    """
+    Pack an observation given in the `ext_add_observation` argument order. Meant for producers written in
+    Python (benchmarks, stand-in games). The game doesn't pack, it calls `ext_add_transition`.
+    """
+    vision = np.asarray(vision, dtype=np.uint8)
+    flags = ObservationFlags(0)
+    if death_flag:
+        flags |= ObservationFlags.DEATH
+    if finished_level:
+        flags |= ObservationFlags.FINISHED_LEVEL
+    if can_dash:
+        flags |= ObservationFlags.CAN_DASH
+    if is_climbing:
+        flags |= ObservationFlags.IS_CLIMBING
+    if on_ground:
+        flags |= ObservationFlags.ON_GROUND
+    header = _HEADER.pack(OBSERVATION_MAGIC, OBSERVATION_LAYOUT_VERSION, int(flags))
+    scalars = _SCALARS.pack(speed_x_y[0], speed_x_y[1], stamina, target[0], target[1], position[0], position[1],
+                            screen_position[0], screen_position[1])
+    return header + vision.tobytes() + scalars
+
+
+class PackedObservationEncoder:
+    """
+    Packs observation dicts (as returned by `CelesteEnv`) into a reusable buffer. Used by the binary transport,
+    which ships observations to the server in the same layout. Observation dicts carry no screen position, it is
+    sent as zeros.
+    """
+
+    def __init__(self, vision_size: int = DEFAULT_VISION_SIZE):
+        self.vision_size = vision_size
+        self.size = packed_observation_size(vision_size)
+        self._buffer = bytearray(self.size)
+        self._vision = np.frombuffer(self._buffer, dtype=np.uint8, count=vision_size * vision_size,
+                                     offset=_HEADER.size)
+        self._scalars = np.frombuffer(self._buffer, dtype=np.float32, count=NUM_SCALARS,
+                                      offset=_HEADER.size + vision_size * vision_size)
+
+    def encode(self, observation, death_flag: bool = False, finished_level: bool = False) -> memoryview:
+        """Pack `observation`. The returned view is overwritten by the next call."""
+        flags = 0
+        if death_flag:
+            flags |= ObservationFlags.DEATH
+        if finished_level:
+            flags |= ObservationFlags.FINISHED_LEVEL
+        if observation["can_dash"][0]:
+            flags |= ObservationFlags.CAN_DASH
+        if observation["is_climbing"][0]:
+            flags |= ObservationFlags.IS_CLIMBING
+        if observation["on_ground"][0]:
+            flags |= ObservationFlags.ON_GROUND
+        _HEADER.pack_into(self._buffer, 0, OBSERVATION_MAGIC, OBSERVATION_LAYOUT_VERSION, int(flags))
+        self._vision[:] = np.asarray(observation["map_entities_vision"]).reshape(-1)
+        self._scalars[0:2] = observation["speed_x_y"]
+        self._scalars[2] = observation["stamina"][0]
+        self._scalars[3:5] = observation["target"]
+        self._scalars[5:7] = observation["position"]
+        return memoryview(self._buffer)
+
+
+class PackedObservationDecoder:
+    """
+    Decodes packed observations (see module docstring) into observation dicts matching
+    `CelesteEnv.observation_space`.
+    """
+
+    def __init__(self, vision_size: int = DEFAULT_VISION_SIZE):
+        self.vision_size = vision_size
+        self.vision_shape = (vision_size, vision_size, 1)
+        self.vision_offset = _HEADER.size
+        self.scalars_offset = self.vision_offset + vision_size * vision_size
+        self.size = packed_observation_size(vision_size)
+
+    def new_observation(self) -> OrderedDict:
+        """Allocate an observation that `decode` can fill in place."""
+        observation = OrderedDict()
+        observation["can_dash"] = np.zeros(1, dtype=np.int8)
+        observation["is_climbing"] = np.zeros(1, dtype=np.int8)
+        observation["map_entities_vision"] = np.zeros(self.vision_shape, dtype=np.uint8)
+        observation["on_ground"] = np.zeros(1, dtype=np.int8)
+        observation["position"] = np.zeros(2, dtype=np.float32)
+        observation["speed_x_y"] = np.zeros(2, dtype=np.float16)
+        observation["stamina"] = np.zeros(1, dtype=np.float32)
+        observation["target"] = np.zeros(2, dtype=np.float32)
+        return observation
+
+    def decode(self, buffer: Buffer, out: OrderedDict = None) -> Tuple[OrderedDict, bool, bool]:
+        """
+        Decode `buffer` into `out` (allocated if not given).
+
+        Returns the observation, the death flag and the finished level flag.
+        """
+        if len(buffer) != self.size:
+            raise ValueError(f"Packed observation has {len(buffer)} bytes, expected {self.size}")
+        magic, version, flags = _HEADER.unpack_from(buffer, 0)
+        if magic != OBSERVATION_MAGIC:
+            raise ValueError(f"Bad packed observation magic: {magic!r}")
+        if version != OBSERVATION_LAYOUT_VERSION:
+            raise ValueError(f"Unsupported packed observation layout version {version}, "
+                             f"expected {OBSERVATION_LAYOUT_VERSION}")
+        if out is None:
+            out = self.new_observation()
+
+        vision = np.frombuffer(buffer, dtype=np.uint8, count=self.vision_size * self.vision_size,
+                               offset=self.vision_offset)
+        np.copyto(out["map_entities_vision"], vision.reshape(self.vision_shape))
+        scalars = np.frombuffer(buffer, dtype=np.float32, count=NUM_SCALARS, offset=self.scalars_offset)
+        out["speed_x_y"][:] = scalars[0:2]
+        out["stamina"][0] = scalars[2]
+        out["target"][:] = scalars[3:5]
+        out["position"][:] = scalars[5:7]
+        out["can_dash"][0] = bool(flags & ObservationFlags.CAN_DASH)
+        out["is_climbing"][0] = bool(flags & ObservationFlags.IS_CLIMBING)
+        out["on_ground"][0] = bool(flags & ObservationFlags.ON_GROUND)
+        return out, bool(flags & ObservationFlags.DEATH), bool(flags & ObservationFlags.FINISHED_LEVEL)
@@ -0,0 +1,8 @@
+"""
+Commands CelesteBot adds on top of RLlib's PolicyClient/PolicyServerInput HTTP protocol.
+
+STEP_COMMAND combines LOG_RETURNS for the previous action with GET_ACTION for the new observation, so each
+decision costs one round trip instead of two. Request fields: "episode_id", "reward", "info", "observation".
+Response fields: "action".
+"""
+STEP_COMMAND = "STEP"
@@ -0,0 +1,244 @@
+"""
+Port allocation for policy server workers and a registry of the ports they listen on.
+
+Every listening worker has one entry file, `port_<port>.json`, in the registry directory. Creating it with O_EXCL is
+the claim on the port between workers, then the worker binds; a port some other program already holds fails the bind
+and the next one is tried. The entry records the worker's PID, so an entry left behind by a crashed worker is
+reclaimed as soon as that PID is gone, and workers release their entries when they exit. Claiming a port takes a few
+file system calls.
+
+Entries of dead processes are only removed while holding the registry's lock file (an OS file lock, which goes away
+with the process holding it) and after reading them again. Otherwise a worker that saw a dead PID could remove the
+live entry another worker created in its place in the meantime.
+
+Clients and tools read the live entries with `PortRegistry.entries()` to find the servers. Clients also register
+which port they are attached to (`client_<id>.json`, with their PID, dropped the same way when it dies), which gives
+every server's current client count for `least_loaded`.
+"""
+import atexit
+import ctypes
+import errno
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+REGISTRY_DIR_ENV_VAR = "CELESTEBOT_PORT_REGISTRY"
+DEFAULT_REGISTRY_DIR = os.path.join(tempfile.gettempdir(), "celestebot_ports")
+DEFAULT_MAX_PORTS = 100
+LOCK_FILE = "registry.lock"
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+T = TypeVar("T")
+
+
+def pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows
+        process_query_limited_information = 0x1000
+        still_active = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and \
+                exit_code.value == still_active
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to someone else
+        return True
+    return True
+
+
+class PortRegistry:
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.environ.get(REGISTRY_DIR_ENV_VAR, DEFAULT_REGISTRY_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self._owned = set()
+        atexit.register(self.release_all)
+
+    def entry_path(self, port: int) -> str:
+        return os.path.join(self.directory, f"port_{port}.json")
+
+    def claim(self, base_port: int, bind: Callable[[int], T], max_ports: int = DEFAULT_MAX_PORTS,
+              **info) -> Tuple[int, T]:
+        """
+        Claim the first free port from `base_port` on and bind it.
+
+        Args:
+            base_port: First port to try.
+            bind: Called with a claimed port, binds it and returns the listening object. An OSError (e.g. the port
+                is used by another program) releases the claim and moves on to the next port.
+            max_ports: Ports to try before giving up.
+            info: Extra fields for the registry entry (transport, worker index, ...).
+
+        Returns:
+            The port and whatever `bind` returned for it.
+        """
+        for port in range(base_port, base_port + max_ports):
+            if not self._try_create_entry(port, info):
+                continue
+            try:
+                result = bind(port)
+            except OSError:
+                self.release(port)
+                continue
+            return port, result
+        raise OSError(errno.EADDRINUSE, f"No free port in [{base_port}, {base_port + max_ports})")
+
+    def _try_create_entry(self, port: int, info: dict) -> bool:
+        path = self.entry_path(port)
+        entry = dict(info, port=port, pid=os.getpid(), started=time.time())
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # Stale entry of a dead worker: remove it and try once more, O_EXCL lets only one worker have it
+                if not self._remove_if_stale(path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            self._owned.add(port)
+            return True
+        return False
+
+    def _entry_alive(self, path: str) -> bool:
+        entry = self._read(path)
+        if entry is None:
+            # Being written right now, or garbage. Only garbage stays unreadable.
+            try:
+                return time.time() - os.path.getmtime(path) < 1.0
+            except OSError:
+                return False
+        return pid_alive(entry["pid"])
+
+    @contextmanager
+    def _lock(self):
+        """Hold the registry's lock file, see module docstring."""
+        with open(os.path.join(self.directory, LOCK_FILE), "a+b") as f:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == "nt":
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _remove_if_stale(self, path: str) -> bool:
+        """Remove the entry at `path` if it still belongs to a dead process. Returns whether it is gone."""
+        with self._lock():
+            if not os.path.exists(path):
+                return True
+            if self._entry_alive(path):
+                return False
+            self._remove(path)
+            return True
+
+    def release(self, port: int):
+        if port in self._owned:
+            self._owned.discard(port)
+            self._remove(self.entry_path(port))
+
+    def release_all(self):
+        for port in list(self._owned):
+            self.release(port)
+
+    def entries(self, transport: Optional[str] = None) -> List[dict]:
+        """Live server entries (of one `transport`, if given), sorted by port. Stale ones are removed on the way."""
+        entries = self._live_entries("port_")
+        if transport is not None:
+            entries = [entry for entry in entries if entry.get("transport") == transport]
+        return sorted(entries, key=lambda entry: entry["port"])
+
+    def prune(self) -> int:
+        """Remove the entries of dead workers and clients, returns how many server entries are left."""
+        self._live_entries("client_")
+        return len(self.entries())
+
+    def attach(self, client_id: str, port: int):
+        """Record that client `client_id` of this process now uses the server on `port`."""
+        path = os.path.join(self.directory, f"client_{client_id}.json")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"client_id": client_id, "port": port, "pid": os.getpid(), "attached": time.time()}, f)
+        os.replace(temp_path, path)
+
+    def detach(self, client_id: str):
+        self._remove(os.path.join(self.directory, f"client_{client_id}.json"))
+
+    def client_counts(self) -> Dict[int, int]:
+        """Live clients attached to each port."""
+        return Counter(entry["port"] for entry in self._live_entries("client_"))
+
+    def least_loaded(self, transport: Optional[str] = None, exclude_client: Optional[str] = None,
+                     exclude_ports: Iterable[int] = ()) -> Optional[Tuple[dict, int]]:
+        """
+        The live server entry with the fewest attached clients and its client count, or None if there is no server.
+        `exclude_client` isn't counted (the client asking), servers on `exclude_ports` are skipped.
+        """
+        exclude_ports = set(exclude_ports)
+        entries = [entry for entry in self.entries(transport) if entry["port"] not in exclude_ports]
+        if not entries:
+            return None
+        counts = Counter(entry["port"] for entry in self._live_entries("client_")
+                         if entry["client_id"] != exclude_client)
+        fewest = min(counts[entry["port"]] for entry in entries)
+        candidates = [entry for entry in entries if counts[entry["port"]] == fewest]
+        # Clients starting at the same time see the same counts, spread them over the tied servers
+        return candidates[os.getpid() % len(candidates)], fewest
+
+    def _live_entries(self, prefix: str) -> List[dict]:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(prefix) and name.endswith(".json")):
+                continue
+            path = os.path.join(self.directory, name)
+            entry = self._read(path)
+            if entry is None:
+                continue
+            if not pid_alive(entry["pid"]):
+                if self._remove_if_stale(path):
+                    continue
+                # Taken over by a live process since it was read
+                entry = self._read(path)
+                if entry is None:
+                    continue
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    def _read(path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,305 @@
+"""
+Headless stand-in for the Celeste game, so the Python side can run end to end on any machine.
+
+`SyntheticCeleste` is a small tile-grid platformer written with NumPy: a procedurally generated level with a
+floor, pits, spikes and floating platforms, a player that can run, jump, dash and climb, and a target tile at the
+far end. Its observations match `CelesteEnv.observation_space` and its rewards follow the game's
+distance-to-target reward, with a bonus for reaching the target and a penalty for dying.
+
+`SyntheticGameRunner` plays the part of `PythonNETManager.cs`: it publishes every observation through
+`CelesteClient.ext_add_transition` (or `ext_add_transition_packed`), together with the reward of the action that led
+to it and a sequence number, and takes the next action from the client's action queue. Like the game, it starts a
+new episode right after a death or a finished level and publishes its first observation without a reward.
+
+The physics are coarse (one decision is one step, positions are in tiles) and cheap, so a game step costs a few
+tens of microseconds and throughput measurements are dominated by the RL plumbing.
+"""
+from __future__ import annotations
+
+import math
+import queue
+import threading
+from enum import IntEnum
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from python_rl.rl_common.observation_codec import DEFAULT_VISION_SIZE, pack_observation
+from python_rl.rl_common.transition_buffer import NO_REWARD
+
+
+class Entity(IntEnum):
+    """Vision cell values, the subset of `Entity` in TileFinder.cs the stand-in uses."""
+    UNSET = 0
+    AIR = 1
+    TILE = 2
+    MADELINE = 3
+    TARGET = 4
+    SPIKES = 8
+
+
+# Pixels per tile, as in the game. Positions and speeds are reported in pixels.
+TILE_SIZE = 8.0
+
+# Speeds in tiles per step
+RUN_SPEED = 1.0
+FRICTION = 0.5
+GRAVITY = 0.5
+MAX_FALL_SPEED = 2.0
+JUMP_SPEED = 1.5
+LONG_JUMP_SPEED = 2.2
+DASH_SPEED = 2.5
+CLIMB_SPEED = 0.5
+# Stamina is normalized to [0, 1] like the game's observations
+CLIMB_STAMINA_COST = 0.1
+
+FINISH_REWARD = 200.0
+DEATH_REWARD = -10.0
+
+# Action values, see ExternalActionManager.cs
+NOOP = 0
+JUMP = 1
+LONG_JUMP = 2
+DASH = 3
+# Up/Down and Left/Right action values to a direction, y points down
+DIRECTIONS = (0, -1, 1)
+
+
+class SyntheticLevel:
+
+    def __init__(self, width: int = 120, height: int = 40, seed: int = 0, pit_chance: float = 0.05,
+                 spike_chance: float = 0.05, num_platforms: int = 16):
+        """
+        Generate a level of `width` by `height` tiles: solid side walls, a two tile thick floor broken by pits
+        (falling through one is a death) and spikes, floating platforms, the start on the left and the target on
+        the right.
+        """
+        rng = np.random.default_rng(seed)
+        tiles = np.full((height, width), Entity.AIR, dtype=np.uint8)
+        tiles[-2:, :] = Entity.TILE
+        tiles[:, 0] = Entity.TILE
+        tiles[:, -1] = Entity.TILE
+        for _ in range(num_platforms):
+            row = rng.integers(height // 3, height - 5)
+            col = rng.integers(4, width - 10)
+            tiles[row, col:col + rng.integers(3, 8)] = Entity.TILE
+        # Keep pits and spikes away from the start and the target
+        col = 8
+        while col < width - 8:
+            roll = rng.random()
+            if roll < pit_chance:
+                tiles[-2:, col:col + 3] = Entity.AIR
+                col += 3
+            elif roll < pit_chance + spike_chance:
+                tiles[-3, col:col + 2] = Entity.SPIKES
+                col += 2
+            col += 1
+        self.start = (2.5, height - 2.5)  # x, y in tiles
+        self.target = (width - 3.5, height - 2.5)
+        tiles[int(self.start[1]), 1:4] = Entity.AIR
+        tiles[int(self.target[1]), int(self.target[0])] = Entity.TARGET
+        self.tiles = tiles
+        self.width = width
+        self.height = height
+
+    def padded(self, padding: int) -> np.ndarray:
+        """The tiles surrounded by `padding` UNSET cells, so a vision window around any position is one slice."""
+        return np.pad(self.tiles, padding, constant_values=Entity.UNSET)
+
+
+class SyntheticCeleste:
+
+    def __init__(self, level: SyntheticLevel = None, vision_size: int = DEFAULT_VISION_SIZE, max_steps: int = 500):
+        """
+        Args:
+            level: Level to play, a default `SyntheticLevel` if None.
+            vision_size: Side of the square vision grid centered on the player.
+            max_steps: Episodes that haven't reached the target after this many steps end with a death.
+        """
+        self.level = level or SyntheticLevel()
+        self.vision_size = vision_size
+        self.max_steps = max_steps
+        self._half_vision = vision_size // 2
+        self._padded = self.level.padded(self._half_vision)
+        self.vision = np.zeros((vision_size, vision_size, 1), dtype=np.uint8)
+        self.target_pixels = (self.level.target[0] * TILE_SIZE, self.level.target[1] * TILE_SIZE)
+        self.reset()
+
+    def reset(self):
+        self.x, self.y = self.level.start
+        self.vx = self.vy = 0.0
+        self.on_ground = True
+        self.can_dash = True
+        self.is_climbing = False
+        self.stamina = 1.0
+        self.steps = 0
+        self.last_distance = self.distance_to_target()
+
+    def distance_to_target(self) -> float:
+        return math.hypot(self.level.target[0] - self.x, self.level.target[1] - self.y) * TILE_SIZE
+
+    def step(self, action) -> Tuple[float, bool, bool]:
+        """Apply one action (up/down, left/right, jump/dash, climb), returns reward, death and finished level."""
+        up_down, left_right, special, climb = action
+        direction_x, direction_y = DIRECTIONS[left_right], DIRECTIONS[up_down]
+        self.steps += 1
+
+        self.is_climbing = bool(climb) and self.stamina > 0 and self._touching_wall()
+        if self.is_climbing:
+            self.vx = 0.0
+            self.vy = direction_y * CLIMB_SPEED
+            self.stamina = max(self.stamina - CLIMB_STAMINA_COST, 0.0)
+        else:
+            self.vx = direction_x * RUN_SPEED if direction_x else self.vx * FRICTION
+            self.vy = min(self.vy + GRAVITY, MAX_FALL_SPEED)
+        if special in (JUMP, LONG_JUMP) and (self.on_ground or self.is_climbing):
+            self.vy = -JUMP_SPEED if special == JUMP else -LONG_JUMP_SPEED
+        elif special == DASH and self.can_dash and (direction_x or direction_y):
+            norm = math.hypot(direction_x, direction_y)
+            self.vx = DASH_SPEED * direction_x / norm
+            self.vy = DASH_SPEED * direction_y / norm
+            self.can_dash = False
+        self._move()
+
+        self.on_ground = self._is_solid(self.x, self.y + 1)
+        if self.on_ground:
+            self.can_dash = True
+            self.stamina = 1.0
+
+        cell = self._cell(self.x, self.y)
+        death = cell == Entity.SPIKES or self.y >= self.level.height or self.steps >= self.max_steps
+        finished_level = cell == Entity.TARGET
+        distance = self.distance_to_target()
+        reward = self.last_distance - distance
+        self.last_distance = distance
+        if finished_level:
+            reward += FINISH_REWARD
+        elif death:
+            reward += DEATH_REWARD
+        return reward, death, finished_level
+
+    def render_vision(self) -> np.ndarray:
+        """Fill and return the vision grid, rows of [entity] like the game's CameraVision."""
+        row = min(max(int(self.y), 0), self.level.height - 1)
+        col = min(max(int(self.x), 0), self.level.width - 1)
+        np.copyto(self.vision[:, :, 0], self._padded[row:row + self.vision_size, col:col + self.vision_size])
+        self.vision[self._half_vision, self._half_vision, 0] = Entity.MADELINE
+        return self.vision
+
+    def observation_args(self) -> Tuple:
+        """The current observation in `ext_add_observation` argument order, minus death and finished level."""
+        position = (self.x * TILE_SIZE, self.y * TILE_SIZE)
+        screen_position = (position[0] - self._half_vision * TILE_SIZE, position[1] - self._half_vision * TILE_SIZE)
+        return (self.render_vision(), (self.vx * TILE_SIZE, self.vy * TILE_SIZE), self.can_dash, self.stamina,
+                self.target_pixels, position, screen_position, self.is_climbing, self.on_ground)
+
+    def _move(self):
+        # Move in sub-steps of at most half a tile so fast movement can't pass through a one tile wall
+        substeps = max(int(math.ceil(max(abs(self.vx), abs(self.vy)) * 2)), 1)
+        step_x, step_y = self.vx / substeps, self.vy / substeps
+        for _ in range(substeps):
+            if step_x and not self._is_solid(self.x + step_x, self.y):
+                self.x += step_x
+            else:
+                self.vx = step_x = 0.0
+            if step_y and not self._is_solid(self.x, self.y + step_y):
+                self.y += step_y
+            else:
+                self.vy = step_y = 0.0
+
+    def _touching_wall(self) -> bool:
+        return self._is_solid(self.x - 1, self.y) or self._is_solid(self.x + 1, self.y)
+
+    def _cell(self, x: float, y: float) -> int:
+        row, col = int(math.floor(y)), int(math.floor(x))
+        if row < 0 or row >= self.level.height or col < 0 or col >= self.level.width:
+            return Entity.AIR
+        return int(self.level.tiles[row, col])
+
+    def _is_solid(self, x: float, y: float) -> bool:
+        return self._cell(x, y) == Entity.TILE
+
+
+class SyntheticGameRunner:
+    """
+    Drives a `CelesteClient` (or anything with the same `ext_add_transition*` callbacks and an `env.action_queue`)
+    with a `SyntheticCeleste`, on its own thread, the way PythonNETManager.cs drives it with the game.
+    """
+
+    def __init__(self, client, game: SyntheticCeleste = None, packed: bool = False, action_timeout: float = 0.5):
+        """
+        Args:
+            client: The client to feed, its `env.action_queue` must be set.
+            game: The game to play, a default `SyntheticCeleste` if None.
+            packed: Publish observations with `ext_add_transition_packed` instead of `ext_add_transition`.
+            action_timeout: How often the game thread checks for `stop()` while waiting for an action.
+        """
+        self.client = client
+        self.game = game or SyntheticCeleste()
+        self.packed = packed
+        self.action_timeout = action_timeout
+        self.action_queue = client.env.action_queue  # type: queue.Queue[List[int]]
+        self.num_steps = 0
+        self.num_game_steps = 0
+        self.num_episodes = 0
+        self.num_deaths = 0
+        self.num_finished = 0
+        self._sequence = 0
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def start(self, max_steps: int = None):
+        """Start playing on a daemon thread, until `stop()` or after `max_steps` actions."""
+        self._thread = threading.Thread(name="SyntheticGame", target=self.run, args=(max_steps,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout: float = None):
+        self._thread.join(timeout)
+
+    def run(self, max_steps: int = None):
+        self.game.reset()
+        self._publish(NO_REWARD, False, False)
+        while not self._stop.is_set() and (max_steps is None or self.num_steps < max_steps):
+            try:
+                action = self.action_queue.get(timeout=self.action_timeout)
+            except queue.Empty:
+                continue
+            reward, death, finished_level = self._step_repeated(action)
+            self.num_steps += 1
+            self._publish(reward, death, finished_level)
+            if death or finished_level:
+                self.num_episodes += 1
+                self.num_deaths += death
+                self.num_finished += finished_level
+                self.game.reset()
+                self._publish(NO_REWARD, False, False)
+
+    def _step_repeated(self, action) -> Tuple[float, bool, bool]:
+        # An action with an action repeat element is held for that many more game steps, like the game holds it for
+        # more calculation periods, and the rewards add up
+        repeat = action[4] + 1 if len(action) > 4 else 1
+        total_reward = 0.0
+        for _ in range(repeat):
+            reward, death, finished_level = self.game.step(action[:4])
+            self.num_game_steps += 1
+            total_reward += reward
+            if death or finished_level:
+                break
+        return total_reward, death, finished_level
+
+    def _publish(self, reward: float, death: bool, finished_level: bool):
+        vision, speed_x_y, can_dash, stamina, target, position, screen_position, is_climbing, on_ground = \
+            self.game.observation_args()
+        if self.packed:
+            self.client.ext_add_transition_packed(
+                self._sequence, reward, pack_observation(vision, speed_x_y, can_dash, stamina, death, finished_level,
+                                                         target, position, screen_position, is_climbing, on_ground))
+        else:
+            # PythonNET hands the vision over as nested sequences, rows of [entity]
+            self.client.ext_add_transition(self._sequence, reward, vision.tolist(), list(speed_x_y), can_dash,
+                                           stamina, death, finished_level, list(target), list(position),
+                                           list(screen_position), is_climbing, on_ground)
+        self._sequence += 1
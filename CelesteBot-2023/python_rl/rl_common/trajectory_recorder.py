@@ -0,0 +1,263 @@
+"""
+Streams every transition the env consumes to disk, so the samples can be used again after the PPO update that
+consumed them.
+
+A recording is a directory holding one append-only file per column plus `manifest.json`:
+
+    <column>.bin    rows of the column's dtype and shape, little endian, back to back
+    manifest.json   format version, every column's dtype and row shape, the number of complete rows, the rows of
+                    every chunk and the level names the `level` column indexes into
+
+One row is one transition, in the order the env consumed them:
+
+    <observation keys>  the observation, same dtypes and shapes as `CelesteEnv.observation_space`
+    prev_action         the action that led to this observation, zeros on the first row of an episode
+    reward              reward of that action as the env returned it (0.0 if the game sent none), NaN on the first
+                        row of an episode, which no action led to
+    termination         `TerminationEvent` value
+    sequence            the game's sequence number
+    episode             episode number within the recording
+    step                index of the row within its episode
+    level               index into the manifest's levels, -1 if unknown
+
+Rows are collected into preallocated chunks of `chunk_size` rows. Full chunks go to a writer thread, which appends
+them to the column files and then rewrites the manifest, so a reader never sees a partially written row. Only
+`max_pending_chunks` chunks can wait for the disk. When they are all taken, rows are dropped and counted in
+`dropped_rows`; recording never makes the step loop wait on the disk. A dropped run of rows shows up as a jump in
+`step`.
+
+`open_recording` maps a recording's columns with `np.memmap` for random access. rl_server/recorded_trajectory_input.py
+serves recordings to RLlib as SampleBatches.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from gymnasium import spaces
+
+RECORDING_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_MAX_PENDING_CHUNKS = 8
+UNKNOWN_LEVEL = -1
+
+
+def recording_columns(observation_space: spaces.Dict, action_space: spaces.MultiDiscrete) -> OrderedDict:
+    """Column name -> (dtype, row shape) of a recording of `observation_space` observations."""
+    columns = OrderedDict(
+        (key, (np.dtype(space.dtype), tuple(space.shape))) for key, space in observation_space.spaces.items())
+    columns["prev_action"] = (np.dtype(np.uint8), tuple(action_space.shape))
+    columns["reward"] = (np.dtype(np.float64), ())
+    columns["termination"] = (np.dtype(np.uint8), ())
+    columns["sequence"] = (np.dtype(np.int64), ())
+    columns["episode"] = (np.dtype(np.int64), ())
+    columns["step"] = (np.dtype(np.int32), ())
+    columns["level"] = (np.dtype(np.int16), ())
+    return columns
+
+
+class _Chunk:
+
+    def __init__(self, columns: OrderedDict, chunk_size: int):
+        self.arrays = OrderedDict(
+            (name, np.zeros((chunk_size,) + shape, dtype=dtype.newbyteorder("<")))
+            for name, (dtype, shape) in columns.items())
+        self.rows = 0
+
+
+class TrajectoryRecorder:
+
+    def __init__(self, directory: str, observation_space: spaces.Dict, action_space: spaces.MultiDiscrete,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS,
+                 logger=None):
+        """
+        Args:
+            directory: Directory of the new recording, must not hold a recording yet.
+            observation_space: The env's observation space, one column per key.
+            action_space: The env's action space.
+            chunk_size: Rows handed to the writer thread at once.
+            max_pending_chunks: Full chunks that may wait for the writer before rows are dropped.
+        """
+        if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            raise FileExistsError(f"{directory} already holds a recording")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.logger = logger or logging.getLogger(__name__)
+        self.chunk_size = chunk_size
+        self.columns = recording_columns(observation_space, action_space)
+        self.levels = []  # type: List[str]
+        self._level_ids = {}  # type: Dict[str, int]
+        self.level = UNKNOWN_LEVEL
+        # (first sequence, level id) of level changes announced ahead of their rows, in order
+        self._level_changes = deque()  # type: deque
+        self.episode = -1
+        self.episode_step = 0
+        self.rows_written = 0
+        self.dropped_rows = 0
+        self.chunk_rows = []  # type: List[int]
+        self._files = OrderedDict(
+            (name, open(os.path.join(directory, f"{name}.bin"), "ab")) for name in self.columns)
+        # Every chunk is either being filled, waiting for the writer or free
+        self._free = queue.Queue()  # type: queue.Queue[_Chunk]
+        for _ in range(max_pending_chunks + 1):
+            self._free.put(_Chunk(self.columns, chunk_size))
+        self._pending = queue.Queue()  # type: queue.Queue[Optional[_Chunk]]
+        self._chunk = self._free.get_nowait()  # type: Optional[_Chunk]
+        self._manifest_lock = threading.Lock()
+        self._write_manifest()
+        self._writer = threading.Thread(name="TrajectoryWriter", target=self._write_chunks, daemon=True)
+        self._writer.start()
+        self.closed = False
+
+    def set_level(self, name: str, from_sequence: Optional[int] = None):
+        """
+        Level of the rows recorded from now on, or from the row with sequence number `from_sequence` on. The game
+        announces a level with the first transition it publishes in it, which is recorded once the env consumes it.
+        """
+        with self._manifest_lock:
+            if name not in self._level_ids:
+                self._level_ids[name] = len(self.levels)
+                self.levels.append(name)
+        if from_sequence is None:
+            self.level = self._level_ids[name]
+        else:
+            self._level_changes.append((from_sequence, self._level_ids[name]))
+
+    def start_episode(self):
+        self.episode += 1
+        self.episode_step = 0
+
+    def record(self, observation, reward: float, termination: int, sequence: int, prev_action=None):
+        """Append one row, `prev_action` is None for the first observation of an episode."""
+        if self.closed:
+            raise ValueError(f"Recording {self.directory} is closed")
+        while self._level_changes and self._level_changes[0][0] <= sequence:
+            _, self.level = self._level_changes.popleft()
+        chunk = self._chunk
+        if chunk is None:
+            try:
+                chunk = self._chunk = self._free.get_nowait()
+            except queue.Empty:
+                self.dropped_rows += 1
+                self.episode_step += 1
+                return
+        row = chunk.rows
+        arrays = chunk.arrays
+        for key, value in observation.items():
+            arrays[key][row] = value
+        if prev_action is None:
+            arrays["prev_action"][row] = 0
+        else:
+            arrays["prev_action"][row] = prev_action
+        arrays["reward"][row] = reward
+        arrays["termination"][row] = termination
+        arrays["sequence"][row] = sequence
+        arrays["episode"][row] = self.episode
+        arrays["step"][row] = self.episode_step
+        arrays["level"][row] = self.level
+        self.episode_step += 1
+        chunk.rows = row + 1
+        if chunk.rows == self.chunk_size:
+            self._submit()
+
+    def _submit(self):
+        self._pending.put(self._chunk)
+        try:
+            self._chunk = self._free.get_nowait()
+        except queue.Empty:
+            self._chunk = None
+            self.logger.log(logging.WARNING, "Trajectory writer is behind, dropping rows until a chunk is free")
+
+    def flush(self):
+        """Hand the rows collected so far to the writer thread."""
+        if self._chunk is not None and self._chunk.rows > 0:
+            self._submit()
+
+    def close(self):
+        """Write out everything recorded and close the column files."""
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self._pending.put(None)
+        self._writer.join()
+        for f in self._files.values():
+            f.close()
+        if self.dropped_rows:
+            self.logger.log(logging.WARNING, f"Dropped {self.dropped_rows} rows of {self.directory}")
+
+    def _write_chunks(self):
+        while True:
+            chunk = self._pending.get()
+            if chunk is None:
+                return
+            for name, f in self._files.items():
+                f.write(chunk.arrays[name][:chunk.rows].data)
+                f.flush()
+            self.rows_written += chunk.rows
+            self.chunk_rows.append(chunk.rows)
+            chunk.rows = 0
+            self._free.put(chunk)
+            self._write_manifest()
+
+    def _write_manifest(self):
+        with self._manifest_lock:
+            manifest = {
+                "version": RECORDING_FORMAT_VERSION,
+                "rows": self.rows_written,
+                "chunk_rows": self.chunk_rows,
+                "levels": list(self.levels),
+                "columns": OrderedDict(
+                    (name, {"dtype": dtype.newbyteorder("<").str, "shape": list(shape)})
+                    for name, (dtype, shape) in self.columns.items()),
+            }
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest["version"] != RECORDING_FORMAT_VERSION:
+        raise ValueError(f"Unsupported recording format version {manifest['version']} in {directory}")
+    return manifest
+
+
+def open_recording(directory: str) -> Dict[str, np.ndarray]:
+    """Read-only memory maps of a recording's columns, covering the rows complete when the manifest was read."""
+    manifest = read_manifest(directory)
+    rows = manifest["rows"]
+    columns = OrderedDict()
+    for name, column in manifest["columns"].items():
+        shape = (rows,) + tuple(column["shape"])
+        if rows == 0:
+            # np.memmap can't map an empty file
+            columns[name] = np.zeros(shape, dtype=column["dtype"])
+        else:
+            columns[name] = np.memmap(os.path.join(directory, f"{name}.bin"), dtype=column["dtype"], mode="r",
+                                      shape=shape)
+    return columns
+
+
+def find_recordings(paths: Union[str, Sequence[str]]) -> List[str]:
+    """Recording folders in `paths`: recordings themselves or folders holding recordings (one level down)."""
+    if isinstance(paths, str):
+        paths = [paths]
+    recordings = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            recordings.append(path)
+            continue
+        recordings.extend(sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if os.path.exists(os.path.join(path, name, MANIFEST_FILE))))
+    return recordings
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import queue
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+from gymnasium import spaces
+
+from python_rl.rl_common.flat_observation import flat_observation_size, flat_observation_views
+
+# Reward of a transition that has none, i.e. the first observation of an episode
+NO_REWARD = float("nan")
+
+
+class TransitionRingBuffer:
+    """
+    Fixed capacity, struct-of-arrays store for transitions handed from the game to `CelesteEnv`.
+
+    A transition is one observation together with the reward of the action that led to it, its termination
+    event and the sequence number the game stamped on it. The game publishes all of it in a single call and
+    `CelesteEnv.step` consumes it in a single wait, so the parts can't drift apart.
+
+    Every key of the observation space gets one preallocated column of shape (capacity, *space.shape) with the
+    space's dtype, and every slot has a prebuilt OrderedDict of views into those columns. The producer (the
+    PythonNET observation thread) writes an observation in place and publishes it; the consumer (`CelesteEnv`)
+    gets the prebuilt dict back. Neither side allocates per step.
+
+    With a `flat_layout` (see flat_observation.py) the observations live in one float32 array of shape
+    (capacity, size) instead: the columns are views into it, so the producer still writes by key, and `get`
+    returns the slot's flat row.
+
+    Single producer, single consumer. A slot returned by `get` stays valid until the next call to `get`, so an
+    observation can be sent to the server and passed to `end_episode` without copying it. Copy it if it needs
+    to live longer than that. When the buffer is full the producer blocks instead of growing it.
+    """
+
+    def __init__(self, observation_space: spaces.Dict, capacity: int = 64, flat_layout: Optional[OrderedDict] = None):
+        if capacity < 2:
+            raise ValueError("TransitionRingBuffer needs at least 2 slots")
+        self.capacity = capacity
+        if flat_layout is None:
+            self.flat = None
+            self.columns = OrderedDict(
+                (key, np.zeros((capacity,) + space.shape, dtype=space.dtype))
+                for key, space in observation_space.spaces.items()
+            )
+        else:
+            self.flat = np.zeros((capacity, flat_observation_size(flat_layout)), dtype=np.float32)
+            self.columns = flat_observation_views(self.flat, flat_layout)
+        self.reward = np.full(capacity, NO_REWARD, dtype=np.float64)
+        self.termination = np.zeros(capacity, dtype=np.uint8)
+        self.sequence = np.zeros(capacity, dtype=np.int64)
+        self._slots = [
+            OrderedDict((key, column[index]) for key, column in self.columns.items())
+            for index in range(capacity)
+        ]  # type: List[OrderedDict]
+        # What `get` hands out per slot
+        self._observations = self._slots if self.flat is None else list(self.flat)  # type: list
+        self._condition = threading.Condition()
+        self._read_index = 0
+        self._write_index = 0
+        self._published = 0
+        self._holding_slot = False
+        # Called on the producer thread after every publish, e.g. to wake up a consumer on an event loop
+        self.on_publish = None  # type: Optional[Callable[[], None]]
+
+    def __len__(self):
+        return self._published
+
+    def slot(self, index: int) -> OrderedDict:
+        return self._slots[index]
+
+    def acquire_write_slot(self, timeout: float = None) -> int:
+        """Block until a free slot is available and return its index. Fill it through `slot(index)`."""
+        with self._condition:
+            if not self._condition.wait_for(self._has_free_slot, timeout):
+                raise queue.Full
+            return self._write_index
+
+    def publish(self, index: int, sequence: int, reward: float, termination: int):
+        """Make the slot returned by `acquire_write_slot` visible to the consumer."""
+        with self._condition:
+            self.sequence[index] = sequence
+            self.reward[index] = reward
+            self.termination[index] = termination
+            self._write_index = (index + 1) % self.capacity
+            self._published += 1
+            self._condition.notify_all()
+        if self.on_publish is not None:
+            self.on_publish()
+
+    def get(self, timeout: float = None) -> Tuple[Union[OrderedDict, np.ndarray], float, int, int]:
+        """
+        Block until a transition is published and return its observation, reward, termination code and
+        sequence number. Releases the slot returned by the previous call.
+        """
+        with self._condition:
+            if self._holding_slot:
+                self._read_index = (self._read_index + 1) % self.capacity
+                self._holding_slot = False
+                self._condition.notify_all()
+            if not self._condition.wait_for(self._has_published, timeout):
+                raise queue.Empty
+            self._published -= 1
+            self._holding_slot = True
+            index = self._read_index
+            return (self._observations[index], float(self.reward[index]), int(self.termination[index]),
+                    int(self.sequence[index]))
+
+    def _has_free_slot(self):
+        return self._published + self._holding_slot < self.capacity
+
+    def _has_published(self):
+        return self._published > 0
@@ -0,0 +1,112 @@
+"""
+Wire codec for the vision grid, used by the binary transport for episodes started with `VisionEncoding.DELTA`.
+
+Consecutive vision grids of an episode share most of their cells, so instead of shipping all V * V bytes every
+step, each frame is sent as the smallest of:
+
+    kind            payload
+    KEY_RAW         V * V bytes, the grid row-major
+    KEY_RLE         runs of (<H length, <B value) covering the grid row-major
+    DELTA           <H count, count * <H cell index, count * <B new value, the cells that differ from the previous
+                    frame (i.e. the non-zero cells of their XOR)
+
+prefixed with one <B kind byte. DELTA frames are only possible against the previous frame of the same episode and
+a keyframe (KEY_RAW or KEY_RLE) is forced every `keyframe_interval` frames, so a decoder never depends on a long
+chain of deltas. Encoder and decoder each keep the previous frame, one pair per episode, and frames must be
+decoded in the order they were encoded.
+"""
+from __future__ import annotations
+
+import struct
+from enum import IntEnum
+
+import numpy as np
+
+from python_rl.rl_common.observation_codec import DEFAULT_VISION_SIZE
+
+RUN_DTYPE = np.dtype([("length", "<u2"), ("value", "u1")])
+_COUNT = struct.Struct("<H")
+DEFAULT_KEYFRAME_INTERVAL = 64
+
+
+class VisionEncoding(IntEnum):
+    """How an episode's observations carry their vision grid on the wire."""
+    PACKED = 0
+    DELTA = 1
+
+
+class FrameKind(IntEnum):
+    KEY_RAW = 0
+    KEY_RLE = 1
+    DELTA = 2
+
+
+def rle_encode(flat: np.ndarray) -> bytes:
+    starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    runs = np.empty(len(starts), dtype=RUN_DTYPE)
+    runs["length"] = np.diff(np.append(starts, flat.size))
+    runs["value"] = flat[starts]
+    return runs.tobytes()
+
+
+def rle_decode(buffer, out: np.ndarray):
+    runs = np.frombuffer(buffer, dtype=RUN_DTYPE)
+    if int(runs["length"].sum()) != out.size:
+        raise ValueError(f"RLE frame covers {int(runs['length'].sum())} cells, expected {out.size}")
+    out[:] = np.repeat(runs["value"], runs["length"])
+
+
+class VisionDeltaEncoder:
+
+    def __init__(self, vision_size: int = DEFAULT_VISION_SIZE, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        self.cells = vision_size * vision_size
+        self.keyframe_interval = keyframe_interval
+        self._previous = np.zeros(self.cells, dtype=np.uint8)
+        self._frames_since_keyframe = None  # None until the first keyframe
+
+    def encode(self, vision) -> bytes:
+        """Encode one frame, `vision` is any uint8 array-like with V * V cells."""
+        flat = np.asarray(vision, dtype=np.uint8).reshape(-1)
+        rle = rle_encode(flat)
+        if len(rle) < self.cells:
+            kind, payload = FrameKind.KEY_RLE, rle
+        else:
+            kind, payload = FrameKind.KEY_RAW, flat.tobytes()
+        if self._frames_since_keyframe is not None and self._frames_since_keyframe < self.keyframe_interval:
+            changed = np.flatnonzero(flat != self._previous)
+            # count, index and value bytes
+            if 2 + 3 * len(changed) < len(payload):
+                kind = FrameKind.DELTA
+                payload = _COUNT.pack(len(changed)) + changed.astype("<u2").tobytes() + flat[changed].tobytes()
+        self._frames_since_keyframe = self._frames_since_keyframe + 1 if kind == FrameKind.DELTA else 1
+        np.copyto(self._previous, flat)
+        return bytes((kind,)) + payload
+
+
+class VisionDeltaDecoder:
+
+    def __init__(self, vision_size: int = DEFAULT_VISION_SIZE):
+        self.cells = vision_size * vision_size
+        self.frame = np.zeros(self.cells, dtype=np.uint8)
+        self._has_keyframe = False
+
+    def decode(self, buffer) -> np.ndarray:
+        """Decode one frame, returns the full grid flattened. The array is overwritten by the next call."""
+        kind = FrameKind(buffer[0])
+        payload = memoryview(buffer)[1:]
+        if kind == FrameKind.KEY_RAW:
+            if len(payload) != self.cells:
+                raise ValueError(f"Raw frame has {len(payload)} cells, expected {self.cells}")
+            self.frame[:] = np.frombuffer(payload, dtype=np.uint8)
+        elif kind == FrameKind.KEY_RLE:
+            rle_decode(payload, self.frame)
+        else:
+            if not self._has_keyframe:
+                raise ValueError("Delta frame before the first keyframe")
+            count, = _COUNT.unpack_from(payload)
+            indices = np.frombuffer(payload, dtype="<u2", count=count, offset=_COUNT.size)
+            self.frame[indices] = np.frombuffer(payload, dtype=np.uint8, count=count,
+                                                offset=_COUNT.size + 2 * count)
+        self._has_keyframe = True
+        return self.frame
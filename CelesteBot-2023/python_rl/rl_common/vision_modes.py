@@ -0,0 +1,157 @@
+"""
+Client side reduction of the game's 40x40 vision grid before it reaches the env's observations, set with two
+environment variables (the game, client and server read the same ones, like the other CELESTEBOT_ settings):
+
+    CELESTEBOT_VISION_MODE          full        the game's grid as is (default)
+                                    crop:<N>    the N x N cells at the center of the grid
+                                    pool:<N>    max over (40 / N) x (40 / N) blocks, N has to divide 40
+                                    crop and pool default to N = 20, the size of VISION_2D in CelesteBotMain.cs
+    CELESTEBOT_VISION_VOCABULARY    raw         entity ids as the game sends them, 0..255 (default)
+                                    compact     ids remapped to 0..len(ENTITY_VOCABULARY) - 1
+
+The game's entity ids (`Entity` in TileFinder.cs) are spread over a 0..255 space that the policy has to treat as
+one wide range. The compact vocabulary maps them to dense ids ordered by how much a cell matters to the agent, so
+pooling keeps the most important entity of every block (the player and the target survive any downsampling, spikes
+win over tiles, tiles over air). Ids the vocabulary doesn't know map to OTHER. Pooling raw ids works but keeps the
+entity with the largest raw id, which is arbitrary.
+
+Remapping is one lookup table `np.take` over the grid and pooling a few strided `np.maximum`s, all into
+preallocated buffers.
+"""
+from __future__ import annotations
+
+import os
+import re
+from typing import Tuple
+
+import numpy as np
+
+VISION_MODE_ENV_VAR = "CELESTEBOT_VISION_MODE"
+VISION_VOCABULARY_ENV_VAR = "CELESTEBOT_VISION_VOCABULARY"
+DEFAULT_VISION_MODE = "full"
+DEFAULT_VISION_VOCABULARY = "raw"
+# Side of the vision grid the game sends
+GAME_VISION_SIZE = 40
+DEFAULT_REDUCED_VISION_SIZE = 20
+VISION_MODES = ("full", "crop", "pool")
+
+# Game entity ids (TileFinder.cs) in compact id order, least to most important
+ENTITY_VOCABULARY = (
+    ("Unset", 0),
+    ("Air", 1),
+    ("Other", 5),
+    ("ChangeRespawnTrigger", 14),
+    ("Strawberry", 7),
+    ("NPC", 20),
+    ("IntroCar", 16),
+    ("IntroPavement", 17),
+    ("BridgeTile", 19),
+    ("JumpthruPlatform", 21),
+    ("Tile", 2),
+    ("FakeWall", 12),
+    ("CrumblePlatform", 10),
+    ("FallingBlock", 15),
+    ("DashBlock", 11),
+    ("ZipMover", 9),
+    ("IntroCrusher", 18),
+    ("Refill", 13),
+    ("Spring", 6),
+    ("Spikes", 8),
+    ("Target", 4),
+    ("Madeline", 3),
+)
+OTHER_ENTITY = 5
+
+
+def compact_entity_lookup() -> np.ndarray:
+    """uint8 table mapping every raw entity id to its compact id."""
+    compact_ids = {entity_id: index for index, (_, entity_id) in enumerate(ENTITY_VOCABULARY)}
+    lookup = np.full(256, compact_ids[OTHER_ENTITY], dtype=np.uint8)
+    for entity_id, compact_id in compact_ids.items():
+        lookup[entity_id] = compact_id
+    return lookup
+
+
+def parse_vision_mode(spec: str) -> Tuple[str, int]:
+    """"full", "crop:<N>" or "pool:<N>" -> (mode, size)."""
+    match = re.fullmatch(r"(full|crop|pool)(?::(\d+))?", spec.strip())
+    if match is None:
+        raise ValueError(f"Unknown vision mode: {spec}")
+    mode, size = match.group(1), match.group(2)
+    if mode == "full":
+        if size is not None and int(size) != GAME_VISION_SIZE:
+            raise ValueError(f"Vision mode full is always {GAME_VISION_SIZE}x{GAME_VISION_SIZE}")
+        return mode, GAME_VISION_SIZE
+    return mode, DEFAULT_REDUCED_VISION_SIZE if size is None else int(size)
+
+
+class VisionTransform:
+    """Turns the game's vision grid into the env's, see module docstring."""
+
+    def __init__(self, mode: str = DEFAULT_VISION_MODE, size: int = GAME_VISION_SIZE, compact: bool = False,
+                 source_size: int = GAME_VISION_SIZE):
+        if mode not in VISION_MODES:
+            raise ValueError(f"Unknown vision mode: {mode}")
+        if mode == "full" and size != source_size:
+            raise ValueError(f"Vision mode full needs size {source_size}, got {size}")
+        if not 0 < size <= source_size:
+            raise ValueError(f"Vision size {size} doesn't fit in {source_size}x{source_size}")
+        if mode == "pool" and source_size % size != 0:
+            raise ValueError(f"Pooling needs a size dividing {source_size}, got {size}")
+        self.mode = mode
+        self.size = size
+        self.compact = compact
+        self.source_size = source_size
+        self.num_entities = len(ENTITY_VOCABULARY) if compact else 256
+        self.identity = mode == "full" and not compact
+        self._lookup = compact_entity_lookup() if compact else None
+        self._crop_offset = (source_size - size) // 2
+        self._pool = source_size // size
+        # Remapped cells before pooling, and the pooling passes
+        self._compacted = np.zeros((size, size) if mode == "crop" else (source_size, source_size), dtype=np.uint8)
+        self._pooled_columns = np.zeros((source_size, size), dtype=np.uint8)
+        self._pooled = np.zeros((size, size), dtype=np.uint8)
+
+    @classmethod
+    def from_env(cls) -> VisionTransform:
+        mode, size = parse_vision_mode(os.environ.get(VISION_MODE_ENV_VAR, DEFAULT_VISION_MODE))
+        vocabulary = os.environ.get(VISION_VOCABULARY_ENV_VAR, DEFAULT_VISION_VOCABULARY)
+        if vocabulary not in ("raw", "compact"):
+            raise ValueError(f"Unknown vision vocabulary: {vocabulary}")
+        return cls(mode, size, vocabulary == "compact")
+
+    def __repr__(self):
+        mode = self.mode if self.mode == "full" else f"{self.mode}:{self.size}"
+        return f"VisionTransform({mode}, {'compact' if self.compact else 'raw'})"
+
+    def apply(self, vision: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """
+        Write the transform of `vision`, the game's (source_size, source_size[, 1]) grid, into `out` of shape
+        (size, size, 1), which may have any numeric dtype.
+        """
+        grid = vision.reshape(self.source_size, self.source_size)
+        if self.mode == "crop":
+            end = self._crop_offset + self.size
+            grid = grid[self._crop_offset:end, self._crop_offset:end]
+        if self._lookup is not None:
+            np.take(self._lookup, grid, out=self._compacted)
+            grid = self._compacted
+        if self.mode == "pool":
+            grid = self._max_pool(grid)
+        np.copyto(out[..., 0], grid, casting="unsafe")
+        return out
+
+    def _max_pool(self, grid: np.ndarray) -> np.ndarray:
+        # Separable, over columns and then rows, with one np.maximum per offset into the block. Several times
+        # faster than a max over the axes of a (size, pool, size, pool) reshape on grids this small.
+        k, columns, pooled = self._pool, self._pooled_columns, self._pooled
+        if k == 1:
+            np.copyto(pooled, grid)
+            return pooled
+        np.maximum(grid[:, 0::k], grid[:, 1::k], out=columns)
+        for offset in range(2, k):
+            np.maximum(columns, grid[:, offset::k], out=columns)
+        np.maximum(columns[0::k], columns[1::k], out=pooled)
+        for offset in range(2, k):
+            np.maximum(pooled, columns[offset::k], out=pooled)
+        return pooled
@@ -0,0 +1,202 @@
+"""
+Algorithm checkpoints written by a background thread, so training and the policy servers don't stall while one is
+serialized.
+
+The learner only takes a snapshot of the algorithm's state (`Algorithm.__getstate__`: the policies' weights and
+optimizer state as numpy, the config and counters) and queues it. On the CPU those arrays share memory with the live
+tensors, which the next training iteration updates in place, so the snapshot copies them.
+
+The writer thread pickles the snapshot into `<directory>/.checkpoint_<iteration>.tmp`, renames that to
+`checkpoint_<iteration>` once complete (so a `checkpoint_*` directory is always a whole checkpoint), updates the last
+checkpoint file and deletes all but the newest `keep` checkpoints. The result has the layout of `Algorithm.save_checkpoint` and restores with
+`Algorithm.from_checkpoint` and `Policy.from_checkpoint`.
+
+At most one snapshot waits for the writer: if the previous checkpoint is still being written, a newer snapshot
+replaces the waiting one, which is skipped.
+
+`async_checkpoint_callbacks` checkpoints every `frequency` training iterations from `on_train_result` and reports in
+every result, under "checkpointing":
+    blocked_s           how long the learner was blocked by the last checkpoint (taking the snapshot)
+    write_s             how long the writer took for the last checkpoint written
+    written, skipped    checkpoints written, snapshots replaced before being written
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import ray
+import ray.cloudpickle as pickle
+from ray.rllib.algorithms import Algorithm
+from ray.rllib.algorithms.callbacks import DefaultCallbacks
+from ray.rllib.utils.checkpoints import CHECKPOINT_VERSION
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = "checkpoint_"
+TEMPORARY_SUFFIX = ".tmp"
+
+
+def _copy_arrays(value):
+    """`value` with every numpy array in its dicts, lists and tuples copied."""
+    if isinstance(value, np.ndarray):
+        return np.array(value, copy=True)
+    if isinstance(value, dict):
+        return {key: _copy_arrays(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return type(value)(_copy_arrays(item) for item in value)
+    return value
+
+
+class _Snapshot:
+    __slots__ = ("name", "state", "policy_states", "policies")
+
+    def __init__(self, name: str, state: dict, policy_states: dict, policies: dict):
+        self.name = name
+        self.state = state
+        self.policy_states = policy_states
+        self.policies = policies
+
+
+class AsyncCheckpointWriter:
+
+    def __init__(self, directory: str, keep: int = 3, last_checkpoint_file: Optional[str] = None):
+        """
+        Args:
+            directory: Where the checkpoint_<iteration> directories go.
+            keep: Number of checkpoints to keep, older ones are deleted after every checkpoint written.
+            last_checkpoint_file: File updated with the path of every checkpoint written.
+        """
+        self.directory = os.path.abspath(directory)
+        self.keep = keep
+        self.last_checkpoint_file = last_checkpoint_file and os.path.abspath(last_checkpoint_file)
+        os.makedirs(self.directory, exist_ok=True)
+        # Left behind by a writer that died mid checkpoint
+        for name in os.listdir(self.directory):
+            if name.startswith("." + CHECKPOINT_PREFIX) and name.endswith(TEMPORARY_SUFFIX):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        self._condition = threading.Condition()
+        self._pending = None  # type: Optional[_Snapshot]
+        self._writing = False
+        self.blocked_s = 0.0
+        self.write_s = 0.0
+        self.written = 0
+        self.skipped = 0
+        self.last_checkpoint = None  # type: Optional[str]
+        threading.Thread(name="checkpoint-writer", target=self._run, daemon=True).start()
+
+    def save(self, algorithm: Algorithm) -> float:
+        """Snapshot `algorithm` for the writer. Returns how long that blocked the caller, in seconds."""
+        if algorithm.config._enable_learner_api:
+            raise ValueError("Asynchronous checkpoints need the policy API (_enable_learner_api=False)")
+        start = time.perf_counter()
+        state = algorithm.__getstate__()
+        # Weights and optimizer state, copied off the tensors the learner keeps updating
+        policy_states = _copy_arrays(state.get("worker", {}).pop("policy_states", {}))
+        state["checkpoint_version"] = CHECKPOINT_VERSION
+        snapshot = _Snapshot(f"{CHECKPOINT_PREFIX}{algorithm.training_iteration:06d}", state, policy_states,
+                             {policy_id: algorithm.get_policy(policy_id) for policy_id in policy_states})
+        with self._condition:
+            if self._pending is not None:
+                logger.warning(f"Checkpoint writer is behind, skipping {self._pending.name}")
+                self.skipped += 1
+            self._pending = snapshot
+            self._condition.notify_all()
+        self.blocked_s = time.perf_counter() - start
+        return self.blocked_s
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every snapshot taken is written. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None and not self._writing, timeout)
+
+    def stats(self) -> Dict[str, float]:
+        return {"blocked_s": self.blocked_s, "write_s": self.write_s, "written": self.written,
+                "skipped": self.skipped}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                snapshot, self._pending = self._pending, None
+                self._writing = True
+            try:
+                start = time.perf_counter()
+                path = self._write(snapshot)
+                self.write_s = time.perf_counter() - start
+                self.written += 1
+                self.last_checkpoint = path
+                logger.info(f"Wrote {path} in {self.write_s:.2f}s, the learner was blocked {self.blocked_s:.3f}s")
+                self._retain()
+            except Exception:
+                logger.exception(f"Writing {snapshot.name} failed")
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def _write(self, snapshot: _Snapshot) -> str:
+        path = os.path.join(self.directory, snapshot.name)
+        temporary = os.path.join(self.directory, f".{snapshot.name}{TEMPORARY_SUFFIX}")
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        # As Algorithm.save_checkpoint, with the paths the checkpoint will have once renamed
+        with open(os.path.join(temporary, "algorithm_state.pkl"), "wb") as f:
+            pickle.dump(snapshot.state, f)
+        with open(os.path.join(temporary, "rllib_checkpoint.json"), "w") as f:
+            json.dump({
+                "type": "Algorithm",
+                "checkpoint_version": str(snapshot.state["checkpoint_version"]),
+                "format": "cloudpickle",
+                "state_file": os.path.join(path, "algorithm_state.pkl"),
+                "policy_ids": list(snapshot.policy_states),
+                "ray_version": ray.__version__,
+                "ray_commit": ray.__commit__,
+            }, f)
+        for policy_id, policy_state in snapshot.policy_states.items():
+            snapshot.policies[policy_id].export_checkpoint(os.path.join(temporary, "policies", policy_id),
+                                                           policy_state=policy_state)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(temporary, path)
+        if self.last_checkpoint_file:
+            with open(self.last_checkpoint_file + TEMPORARY_SUFFIX, "w") as f:
+                f.write(path)
+            os.replace(self.last_checkpoint_file + TEMPORARY_SUFFIX, self.last_checkpoint_file)
+        return path
+
+    def _retain(self):
+        checkpoints = sorted(name for name in os.listdir(self.directory) if name.startswith(CHECKPOINT_PREFIX))
+        for name in checkpoints[:-self.keep] if self.keep > 0 else []:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+def async_checkpoint_callbacks(directory: str, frequency: int, keep: int = 3,
+                               last_checkpoint_file: Optional[str] = None):
+    """
+    Callbacks class checkpointing every `frequency` training iterations with an `AsyncCheckpointWriter`. Every
+    trial writes to its own folder in `directory`, named like its log folder.
+    """
+    directory = os.path.abspath(directory)
+    last_checkpoint_file = last_checkpoint_file and os.path.abspath(last_checkpoint_file)
+
+    class AsyncCheckpointCallbacks(DefaultCallbacks):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.writer = None
+
+        def on_train_result(self, *, algorithm: Algorithm, result: dict, **kwargs) -> None:
+            if self.writer is None:
+                self.writer = AsyncCheckpointWriter(
+                    os.path.join(directory, os.path.basename(os.path.normpath(algorithm.logdir))), keep,
+                    last_checkpoint_file)
+            if algorithm.training_iteration % frequency == 0:
+                self.writer.save(algorithm)
+            result["checkpointing"] = self.writer.stats()
+
+    return AsyncCheckpointCallbacks
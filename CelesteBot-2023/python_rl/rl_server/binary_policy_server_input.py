@@ -0,0 +1,225 @@
+"""
+Server side of the binary transport (see rl_common/binary_protocol.py). Works like RLlib's `PolicyServerInput` in
+remote inference mode: actions are computed by an embedded rollout worker whose samples are fed to the learner
+through `next()`, but clients talk to it over persistent TCP connections with fixed binary frames.
+
+Use it in the server's `_input` factory in place of `PolicyServerInput`, e.g.
+    BinaryPolicyServerInput(ioctx, SERVER_ADDRESS, port)
+"""
+import inspect
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from collections import deque
+from typing import List, Optional
+
+import numpy as np
+from ray.rllib.env.policy_client import _create_embedded_rollout_worker
+from ray.rllib.env.policy_server_input import PolicyServerInput
+from ray.rllib.evaluation.metrics import RolloutMetrics
+from ray.rllib.evaluation.sampler import SamplerInput
+from ray.rllib.offline.input_reader import InputReader
+from ray.rllib.offline.io_context import IOContext
+from ray.rllib.policy.sample_batch import SampleBatch
+
+from python_rl.rl_common.binary_protocol import EPISODE_HANDLE, LOG_RETURNS, START_EPISODE, STEP, MessageType, \
+    ProtocolError, decode_info, recv_frame, send_frame
+from python_rl.rl_common.flat_observation import flat_observation_layout, flat_observation_size, \
+    flat_observation_views, flat_observations_enabled
+from python_rl.rl_common.observation_codec import SCALARS_SIZE, VISION_OFFSET, \
+    PackedObservationDecoder
+from python_rl.rl_common.vision_codec import VisionDeltaDecoder, VisionEncoding
+from python_rl.rl_common.vision_modes import VisionTransform
+
+# PolicyServerInput's, so how often idle learners get empty batches doesn't depend on the transport
+DEFAULT_IDLE_TIMEOUT = inspect.signature(PolicyServerInput.__init__).parameters["idle_timeout"].default
+
+logger = logging.getLogger(__name__)
+
+
+class _MetricsSampler(SamplerInput):
+    """Stands in for the rollout worker's sampler so client metrics reach the learner, as in PolicyServerInput."""
+
+    def __init__(self, metrics_queue):
+        self.metrics_queue = metrics_queue
+
+    def get_data(self):
+        raise NotImplementedError
+
+    def get_extra_batches(self):
+        raise NotImplementedError
+
+    def get_metrics(self) -> List[RolloutMetrics]:
+        completed = []
+        while True:
+            try:
+                completed.append(self.metrics_queue.get_nowait())
+            except queue.Empty:
+                break
+        return completed
+
+
+class _BinaryRequestHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection until it closes."""
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = PackedObservationDecoder(self.server.vision_size)
+        # Decoded straight into flat observations if the policy takes them, see rl_common/flat_observation.py
+        self.flat_layout = flat_observation_layout(self.decoder.new_observation()) \
+            if self.server.flat_observations else None
+        self.episodes = {}  # episode handle -> RLlib episode id
+        self.vision_decoders = {}  # episode handle -> VisionDeltaDecoder, for DELTA episodes
+        self.next_handle = 0
+        # DELTA observations are reassembled into a full packed observation here before decoding
+        self.packed = bytearray(self.decoder.size)
+        self.packed_view = memoryview(self.packed)
+
+    def handle(self):
+        while True:
+            try:
+                message_type, payload = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ProtocolError as e:
+                logger.warning(f"Closing binary client connection: {e}")
+                return
+            try:
+                reply_type, reply = self.execute(message_type, payload)
+            except Exception:
+                reply_type, reply = MessageType.ERROR, traceback.format_exc().encode("utf-8")
+            send_frame(self.request, reply_type, reply)
+
+    def execute(self, message_type: MessageType, payload: memoryview):
+        env = self.server.get_external_env()
+        if message_type == MessageType.START_EPISODE:
+            training_enabled, vision_encoding = START_EPISODE.unpack(payload)
+            handle = self.next_handle
+            self.next_handle += 1
+            self.episodes[handle] = env.start_episode(None, bool(training_enabled))
+            if VisionEncoding(vision_encoding) == VisionEncoding.DELTA:
+                self.vision_decoders[handle] = VisionDeltaDecoder(self.server.vision_size)
+            return MessageType.EPISODE, EPISODE_HANDLE.pack(handle)
+
+        handle, = EPISODE_HANDLE.unpack_from(payload)
+        episode_id = self.episodes[handle]
+        if message_type == MessageType.GET_ACTION:
+            # The embedded worker keeps the observation, so decode into a fresh one
+            observation, _, _ = self.decode_observation(handle, payload[EPISODE_HANDLE.size:])
+            action = env.get_action(episode_id, observation)
+            return MessageType.ACTION, np.asarray(action, dtype=np.uint8).tobytes()
+        elif message_type == MessageType.LOG_RETURNS:
+            _, reward = LOG_RETURNS.unpack_from(payload)
+            env.log_returns(episode_id, reward, info=decode_info(payload[LOG_RETURNS.size:]))
+            return MessageType.OK, b""
+        elif message_type == MessageType.STEP:
+            _, reward = STEP.unpack_from(payload)
+            observation, death, finished_level = self.decode_observation(handle, payload[STEP.size:])
+            env.log_returns(episode_id, reward, info={"Died": death, "Finished Level": finished_level})
+            action = env.get_action(episode_id, observation)
+            return MessageType.ACTION, np.asarray(action, dtype=np.uint8).tobytes()
+        elif message_type == MessageType.END_EPISODE:
+            observation, _, _ = self.decode_observation(handle, payload[EPISODE_HANDLE.size:])
+            env.end_episode(episode_id, observation)
+            del self.episodes[handle]
+            self.vision_decoders.pop(handle, None)
+            return MessageType.OK, b""
+        raise ProtocolError(f"Unexpected client message {message_type.name}")
+
+    def decode_observation(self, handle: int, buffer: memoryview):
+        vision_decoder = self.vision_decoders.get(handle)
+        if vision_decoder is not None:
+            scalars_offset = self.decoder.scalars_offset
+            self.packed_view[:VISION_OFFSET] = buffer[:VISION_OFFSET]
+            self.packed_view[scalars_offset:] = buffer[VISION_OFFSET:VISION_OFFSET + SCALARS_SIZE]
+            vision = vision_decoder.decode(buffer[VISION_OFFSET + SCALARS_SIZE:])
+            self.packed_view[VISION_OFFSET:scalars_offset] = vision
+            buffer = self.packed_view
+        if self.flat_layout is None:
+            return self.decoder.decode(buffer)
+        # A new array per observation, the embedded rollout worker keeps them for the sample batch
+        flat = np.zeros(flat_observation_size(self.flat_layout), dtype=np.float32)
+        _, death, finished_level = self.decoder.decode(buffer, out=flat_observation_views(flat, self.flat_layout))
+        return flat, death, finished_level
+
+
+class BinaryPolicyServerInput(socketserver.ThreadingMixIn, socketserver.TCPServer, InputReader):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, ioctx: IOContext, address: str, port: int, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 max_sample_queue_size: int = 20, vision_size: Optional[int] = None,
+                 flat_observations: Optional[bool] = None):
+        """
+        Args:
+            ioctx: IOContext provided by RLlib.
+            address: Server address (e.g., "127.0.0.1").
+            port: Server port (e.g., 9900).
+            idle_timeout: Put an empty batch on the sample queue after this many seconds, so learners waiting on
+                this worker don't hang while no client is connected. Defaults to PolicyServerInput's default.
+            max_sample_queue_size: Once the sample queue is full, the oldest half of it is dropped.
+            vision_size: Size of the vision grid in the packed observations, by default the size of `CelesteEnv`'s
+                vision mode (rl_common/vision_modes.py).
+            flat_observations: Hand observations to the policy in the flat layout (rl_common/flat_observation.py),
+                by default if CELESTEBOT_OBSERVATION_LAYOUT=flat like `CelesteEnv`.
+        """
+        self.rollout_worker = ioctx.worker
+        self.samples_queue = deque(maxlen=max_sample_queue_size)
+        self.metrics_queue = queue.Queue()
+        self.idle_timeout = idle_timeout
+        self.vision_size = VisionTransform.from_env().size if vision_size is None else vision_size
+        self.flat_observations = flat_observations_enabled() if flat_observations is None else flat_observations
+        self._child_rollout_worker = None
+        self._child_lock = threading.Lock()
+
+        # Forward client metrics into the local rollout worker
+        if self.rollout_worker.sampler is not None:
+            self.rollout_worker.sampler.get_metrics = _MetricsSampler(self.metrics_queue).get_metrics
+        else:
+            self.rollout_worker.sampler = _MetricsSampler(self.metrics_queue)
+
+        socketserver.TCPServer.__init__(self, (address, port), _BinaryRequestHandler)
+        logger.info(f"Starting binary policy server at {address}:{self.server_address[1]}")
+        serving_thread = threading.Thread(name="binary-server", target=self.serve_forever, daemon=True)
+        serving_thread.start()
+        heart_beat_thread = threading.Thread(name="heart-beat", target=self._put_empty_sample_batch_every_n_sec,
+                                             daemon=True)
+        heart_beat_thread.start()
+
+    def next(self):
+        # Blocking wait until there is something in the deque.
+        while len(self.samples_queue) == 0:
+            time.sleep(0.1)
+        # Use the newest samples first to stay as close to on-policy as possible.
+        return self.samples_queue.pop()
+
+    def get_external_env(self):
+        """The ExternalEnv of the embedded rollout worker that computes actions, created on first use."""
+        with self._child_lock:
+            if self._child_rollout_worker is None:
+                self._child_rollout_worker, _ = _create_embedded_rollout_worker(
+                    self.rollout_worker.creation_args(), self._report_data)
+                self._child_rollout_worker.set_weights(self.rollout_worker.get_weights())
+            return self._child_rollout_worker.env
+
+    def _report_data(self, data):
+        batch = data["samples"]
+        batch.decompress_if_needed()
+        self.samples_queue.append(batch)
+        if len(self.samples_queue) == self.samples_queue.maxlen:
+            logger.warning("BinaryPolicyServerInput queue is full! Purging half of the samples (oldest).")
+            for _ in range(self.samples_queue.maxlen // 2):
+                self.samples_queue.popleft()
+        for rollout_metric in data["metrics"]:
+            self.metrics_queue.put(rollout_metric)
+        self._child_rollout_worker.set_weights(self.rollout_worker.get_weights(),
+                                               self.rollout_worker.get_global_vars())
+
+    def _put_empty_sample_batch_every_n_sec(self):
+        while True:
+            time.sleep(self.idle_timeout)
+            self.samples_queue.append(SampleBatch())
@@ -0,0 +1,32 @@
+from ray.rllib.env.policy_client import Commands
+from ray.rllib.env.policy_server_input import PolicyServerInput
+
+from python_rl.rl_common.policy_commands import STEP_COMMAND
+
+
+class CelestePolicyServerInput(PolicyServerInput):
+    """PolicyServerInput that also understands the combined STEP command of `CelestePolicyClient`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        base_handler = self.RequestHandlerClass
+
+        class StepHandler(base_handler):
+            def execute_command(self, args):
+                if args["command"] != STEP_COMMAND:
+                    return super().execute_command(args)
+                super().execute_command({
+                    "command": Commands.LOG_RETURNS,
+                    "episode_id": args["episode_id"],
+                    "reward": args["reward"],
+                    "info": args["info"],
+                    "done": None,
+                })
+                return super().execute_command({
+                    "command": Commands.GET_ACTION,
+                    "episode_id": args["episode_id"],
+                    "observation": args["observation"],
+                })
+
+        # The HTTP server builds a handler per request from this attribute, so swapping it is enough
+        self.RequestHandlerClass = StepHandler
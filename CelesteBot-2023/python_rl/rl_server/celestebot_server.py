@@ -36,10 +36,10 @@ import ray
 from ray import tune, air
 from ray.air import RunConfig, ScalingConfig, CheckpointConfig, FailureConfig
 from ray.rllib.algorithms import Algorithm
+from ray.rllib.algorithms.bc import BCConfig
+from ray.rllib.algorithms.callbacks import DefaultCallbacks, make_multi_callbacks
 from ray.rllib.algorithms.ppo import PPOConfig, PPO
-from ray.rllib.env.policy_server_input import PolicyServerInput
 from ray.rllib.evaluation.collectors.sample_collector import SampleCollector
-from ray.rllib.examples.custom_metrics_and_callbacks import MyCallbacks
 from ray.train import SyncConfig
 from ray.tune import sample_from, run
 from ray.tune.logger import pretty_print
@@ -48,12 +48,18 @@ from ray.tune.schedulers.pb2 import PB2
 from ray.tune.tune import _get_trainable
 
 from python_rl.rl_common.celestebot_env import CelesteEnv
+from python_rl.rl_common.config import SERVER_ADDRESS, SERVER_BASE_PORT
+from python_rl.rl_common.flat_observation_model import FlatObservationModel
+from python_rl.rl_common.port_registry import PortRegistry
+from python_rl.rl_server.async_checkpoint import async_checkpoint_callbacks
+from python_rl.rl_server.binary_policy_server_input import BinaryPolicyServerInput
+from python_rl.rl_server.celeste_policy_server_input import CelestePolicyServerInput
+from python_rl.rl_server.recorded_trajectory_input import RecordedTrajectoryInput
+from python_rl.rl_server.telemetry_callbacks import ClientTelemetryCallbacks
 
-SERVER_ADDRESS = "127.0.0.1"
 # In this example, the user can run the policy server with
 # n workers, opening up listen ports 9900 - 990n (n = num_workers - 1)
 # to each of which different clients may connect.
-SERVER_BASE_PORT = 9900  # + worker-idx - 1
 CHECKPOINT_BASE_PATH = "checkpoints"
 LAST_CHECKPOINT_FILE = "checkpoints/last_checkpoint.out"
 
@@ -94,6 +100,33 @@ def get_cli_args():
         help="The number of workers to use. Each worker will create "
              "its own listening socket for incoming experiences.",
     )
+    parser.add_argument(
+        "--transport",
+        choices=["http", "binary"],
+        default="http",
+        help="How clients talk to the policy server: RLlib's pickled HTTP PolicyClient protocol or the "
+             "persistent-connection binary protocol (clients need CELESTEBOT_TRANSPORT set to match).",
+    )
+    parser.add_argument(
+        "--offline-input",
+        type=str,
+        help="Pretrain with behavior cloning (BC) on trajectory recordings (a recording folder or a folder of them, "
+             "see CELESTEBOT_RECORD_DIR on the client) for --stop-iters iterations instead of training PPO on "
+             "clients. Recordings lack what PPO's loss needs, see recorded_trajectory_input.py.",
+    )
+    parser.add_argument(
+        "--checkpoint-frequency",
+        type=int,
+        default=100,
+        help="Checkpoint every this many training iterations, written in the background (see async_checkpoint.py) "
+             f"to {CHECKPOINT_BASE_PATH}/<trial>. 0 turns it off.",
+    )
+    parser.add_argument(
+        "--checkpoints-to-keep",
+        type=int,
+        default=3,
+        help="Number of checkpoints kept per trial, older ones are deleted.",
+    )
     parser.add_argument(
         "--no-restore",
         action="store_true",
@@ -152,30 +185,13 @@ def get_cli_args():
     return args
 
 
-NUM_WORKERS = 2
-
 if __name__ == "__main__":
     args = get_cli_args()
     ray.init()
 
-    PORT = 9900
-    BASE_PATH = "C:\projects\CelesteBot\CelesteBot-2023"
-
-
-    def try_makedirs(path):
-        try:
-            os.makedirs(os.path.join(BASE_PATH, path))
-            return True
-        except OSError:
-            return False
-
-
-    def try_rm_dirs(path):
-        try:
-            os.rmdir(os.path.join(BASE_PATH, path))
-            return True
-        except OSError:
-            return False
+    PORT = SERVER_BASE_PORT
+    # Created up front so every worker registers in the same directory
+    registry_directory = PortRegistry().directory
 
 
     # `InputReader` generator (returns None if no input reader is needed on
@@ -184,22 +200,22 @@ if __name__ == "__main__":
         # We are remote worker or we are local worker with num_workers=0:
         # Create a PolicyServerInput.
         if ioctx.worker_index > 0 or ioctx.worker.num_workers == 0:
-            base_port = PORT
-            # lock the port
-            while not try_makedirs(str(base_port)):
-                base_port += 1
-            p = PolicyServerInput(
-                ioctx,
-                SERVER_ADDRESS,
-                base_port ,
-                #+ ioctx.worker_index - (1 if ioctx.worker_index > 0 else 0),
-                idle_timeout=0.25,
-                max_sample_queue_size=1000000
+            server_input_cls = BinaryPolicyServerInput if args.transport == "binary" else CelestePolicyServerInput
+            # Claim the first free port from PORT on, the entry is released when the worker exits
+            port, p = PortRegistry(registry_directory).claim(
+                PORT,
+                lambda port: server_input_cls(
+                    ioctx,
+                    SERVER_ADDRESS,
+                    port,
+                    idle_timeout=0.25,
+                    max_sample_queue_size=1000000
+                ),
+                address=SERVER_ADDRESS,
+                transport=args.transport,
+                worker_index=ioctx.worker_index,
             )
-            import time
-            time.sleep(5)
-            # unlock port in case this worker crashes
-            try_rm_dirs(str(base_port))
+            logging.log(logging.INFO, f"Worker {ioctx.worker_index} listening on port {port}")
             return p
         # No InputReader (PolicyServerInput) needed.
         else:
@@ -243,8 +259,13 @@ if __name__ == "__main__":
             # num_learner_workers=1
             # num_gpus=0.25,
         )
-        # Create a "chatty" client/server or not.
-        # .callbacks(MyCallbacks if args.callbacks_verbose else None)
+        # Client telemetry as custom metrics (see telemetry_callbacks.py). Checkpoints are written in the background
+        # instead of stalling the learner, see async_checkpoint.py
+        .callbacks(make_multi_callbacks(
+            [ClientTelemetryCallbacks] +
+            ([async_checkpoint_callbacks(CHECKPOINT_BASE_PATH, args.checkpoint_frequency, args.checkpoints_to_keep,
+                                         LAST_CHECKPOINT_FILE)] if args.checkpoint_frequency > 0 else [])
+        ))
         # Use the `PolicyServerInput` to generate experiences.
         .offline_data(input_=_input, offline_sampling=False, shuffle_buffer_size=0)
         # Use n worker processes to listen on different ports.
@@ -293,7 +314,7 @@ if __name__ == "__main__":
             "model": {
                 "use_lstm": False,
                 "use_attention": True,
-                "dim": CelesteEnv.VISION_SIZE,
+                "dim": env.vision_size,
                 "conv_filters": [[16, [3, 3], 2], [32, [3, 3], 2], [64, [3, 3], 1]],
                 "attention_dim": 256,
                 "attention_head_dim": 128,
@@ -305,6 +326,8 @@ if __name__ == "__main__":
                 # "attention_use_n_prev_rewards": 4,
                 # "attention_use_n_prev_actions": 6,
                 # "entropy_coeff_schedule": [[0, 1e-3]]
+                # Flat observations are one Box, the model splits the vision back out for the conv filters
+                **({"custom_model": FlatObservationModel} if env.flat_layout is not None else {}),
             },
             "normalize_actions": False,
             "count_steps_by": "env_steps",
@@ -347,7 +370,33 @@ if __name__ == "__main__":
                            )
     # Manual training loop (no Ray tune).
     MAX_TIMESTEPS = 1000000
-    if args.policy_checkpoint:
+    if args.offline_input:
+        # Behavior cloning needs only observations and actions. The recordings have no recurrent state, so the model
+        # is the PPO model without attention.
+        bc_config = (
+            BCConfig()
+            .rl_module(_enable_rl_module_api=False)
+            .training(_enable_learner_api=False, train_batch_size=512,
+                      model=dict(config.model, use_attention=False, use_lstm=False))
+            .environment(env=None, observation_space=env.observation_space, action_space=env.action_space)
+            .framework("torch")
+            .callbacks(
+                async_checkpoint_callbacks(CHECKPOINT_BASE_PATH, args.checkpoint_frequency, args.checkpoints_to_keep,
+                                           LAST_CHECKPOINT_FILE) if args.checkpoint_frequency > 0 else DefaultCallbacks
+            )
+            .offline_data(input_=lambda ioctx: RecordedTrajectoryInput(ioctx, args.offline_input))
+            .rollouts(num_rollout_workers=0)
+            # There are no online episodes to evaluate
+            .evaluation(off_policy_estimation_methods={})
+        )
+        tune.Tuner(
+            "BC",
+            param_space=bc_config,
+            run_config=RunConfig(stop={"training_iteration": args.stop_iters}, verbose=2,
+                                 name=f"CelesteBot_BC_{time}", log_to_file=True, failure_config=failure_config,
+                                 storage_path=run_config.storage_path),
+        ).fit()
+    elif args.policy_checkpoint:
         params = json.load(open(r"C:\projects\CelesteBot\CelesteBot-2023\python_rl\rl_server\params.json", "r"))
         config.update_from_dict(params)
 
@@ -446,13 +495,11 @@ if __name__ == "__main__":
         #     # placement_strategy="SPREAD",
         # ))
         # tune.Tuner.restocre(r"C:\Users\Ashvin\ray_results\PPO_2023-11-01_00-23-59","PPO", param_space=config,).fit()
-        base_port = PORT
-
         import sys
 
         sys.stdout.isatty = lambda: False
-        while try_rm_dirs(str(base_port)):
-            base_port += 1
+        # Entries of workers that crashed in an earlier run
+        PortRegistry(registry_directory).prune()
         try:
 
             if args.resume_tuner_checkpoint:
@@ -474,9 +521,7 @@ if __name__ == "__main__":
                     # name=f"CelesteBot_{time}"
                 ).fit()
         finally:
-            base_port = PORT
-            while try_rm_dirs(str(base_port)):
-                base_port += 1
+            PortRegistry(registry_directory).prune()
 
                 # analysis = run(
             #     trainable_with_resources,  scheduler=pb2, stop=stop, verbose=1, num_samples=4,
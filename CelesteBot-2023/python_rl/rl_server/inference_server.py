@@ -0,0 +1,394 @@
+"""
+Standalone inference server for evaluation and demo runs: serves a policy exported by rl_server/policy_export.py to
+unchanged CelesteBot clients, without Ray, RLlib, Tune or a learner. The server itself imports in a quarter of a
+second into about 40 MB, the rest is the model's runtime: torch for a TorchScript artifact takes 2.5 s and 500 MB
+of it (3.7 s to the first action and 530 MB resident on one CPU, see benchmarks/inference_server.py). An ONNX
+artifact only needs onnxruntime, not torch, so given an export directory the server picks the ONNX artifact when
+onnxruntime is installed.
+
+It speaks the client protocols of `celestebot_server.py`, one per server:
+    binary  rl_common/binary_protocol.py, as `BinaryPolicyServerInput`
+    http    RLlib's pickled PolicyClient requests in remote inference mode plus CelesteBot's STEP command, as
+            `CelestePolicyServerInput`. Requests are unpickled without importing Ray.
+and registers its port in the port registry (rl_common/port_registry.py), so clients with discovery find it like a
+training server. Rewards and episode ends are accepted and dropped, nothing is trained.
+
+Every connection decodes its observations straight into rows of the artifact's input and queues them. One inference
+thread takes everything queued (up to --max-batch-size, waiting at most --max-wait-ms for more) and runs one forward
+pass for all of it, so concurrent clients share forward passes instead of taking turns. Actions are the artifact's
+greedy actions. Recurrent state is kept per episode by the server.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.rl_server.inference_server exported/policy_fp32.pt --transport binary
+"""
+import argparse
+import importlib.util
+import io
+import logging
+import os
+import pickle
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+from python_rl.rl_common.binary_protocol import EPISODE_HANDLE, START_EPISODE, STEP, MessageType, ProtocolError, \
+    recv_frame, send_frame
+from python_rl.rl_common.config import SERVER_ADDRESS, SERVER_BASE_PORT
+from python_rl.rl_common.exported_policy import ExportedPolicy, find_exports
+from python_rl.rl_common.flat_observation import flat_observation_layout, flat_observation_views
+from python_rl.rl_common.observation_codec import SCALARS_SIZE, VISION_OFFSET, PackedObservationDecoder
+from python_rl.rl_common.policy_commands import STEP_COMMAND
+from python_rl.rl_common.port_registry import PortRegistry
+from python_rl.rl_common.vision_codec import VisionDeltaDecoder, VisionEncoding
+from python_rl.rl_common.vision_modes import VisionTransform
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = SERVER_BASE_PORT
+DEFAULT_MAX_BATCH_SIZE = 64
+VISION_KEY = "map_entities_vision"
+
+
+class _ActionRequest:
+    __slots__ = ("episode", "observation", "done", "action", "error")
+
+    def __init__(self, episode: Hashable, observation: np.ndarray):
+        self.episode = episode
+        self.observation = observation
+        self.done = threading.Event()
+        self.action = None
+        self.error = None
+
+
+class BatchingPolicy:
+    """
+    Computes actions of an `ExportedPolicy` for many threads at once: `compute_action` queues an observation and
+    blocks until the inference thread has run the batch it ended up in.
+    """
+
+    def __init__(self, policy: ExportedPolicy, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait: float = 0.0):
+        """
+        Args:
+            policy: The exported policy.
+            max_batch_size: Most observations per forward pass.
+            max_wait: Seconds to wait for more observations once one is queued. 0 batches what queued up while the
+                previous forward pass ran, which adds no latency.
+        """
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.observation_size = policy.observation_size
+        self._requests = queue.Queue()
+        self._states = {}  # episode -> recurrent state inputs of its next step, only touched by the inference thread
+        self._ended = queue.Queue()
+        self._batch = np.zeros((max_batch_size, self.observation_size), dtype=np.float32)
+        self.num_batches = 0
+        self.num_requests = 0
+        threading.Thread(name="inference", target=self._serve, daemon=True).start()
+
+    def compute_action(self, episode: Hashable, observation: np.ndarray) -> np.ndarray:
+        """Greedy action for `observation`, a flat float32 row of the policy's input, in episode `episode`."""
+        request = _ActionRequest(episode, observation)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.action
+
+    def end_episode(self, episode: Hashable):
+        """Drop the recurrent state of `episode`."""
+        if self.policy.recurrent:
+            self._ended.put(episode)
+
+    def _serve(self):
+        while True:
+            requests = [self._requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(requests) < self.max_batch_size:
+                try:
+                    timeout = deadline - time.perf_counter()
+                    requests.append(self._requests.get(timeout=timeout) if timeout > 0 else
+                                    self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._run(requests)
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+            for request in requests:
+                request.done.set()
+
+    def _run(self, requests: List[_ActionRequest]):
+        while not self._ended.empty():
+            self._states.pop(self._ended.get_nowait(), None)
+        batch = self._batch[:len(requests)]
+        for row, request in zip(batch, requests):
+            row[:] = request.observation
+        state = self._gather_state(requests)
+        actions, _, _, state_out = self.policy.compute(batch, state)
+        if state:
+            for i, next_state in enumerate(zip(*self.policy.next_state(state, state_out))):
+                self._states[requests[i].episode] = next_state
+        for request, action in zip(requests, actions):
+            request.action = action
+        self.num_batches += 1
+        self.num_requests += len(requests)
+
+    def _gather_state(self, requests: List[_ActionRequest]) -> List[np.ndarray]:
+        if not self.policy.recurrent:
+            return []
+        initial = None
+        rows = []
+        for request in requests:
+            state = self._states.get(request.episode)
+            if state is None:
+                if initial is None:
+                    initial = [s[0] for s in self.policy.initial_state(1)]
+                state = initial
+            rows.append(state)
+        return [np.stack(s) for s in zip(*rows)]
+
+
+def observation_layout(policy: ExportedPolicy, decoder: PackedObservationDecoder) -> Dict[str, tuple]:
+    """key -> (offset, shape) of every observation field in the policy's input rows."""
+    if policy.manifest["observation_layout"] == "flat":
+        return flat_observation_layout(decoder.new_observation())
+    layout = {}
+    offset = 0
+    for key, shape in policy.manifest["observation_keys"]:
+        layout[key] = (offset, tuple(shape))
+        offset += int(np.prod(shape))
+    return layout
+
+
+def policy_vision_size(policy: ExportedPolicy) -> int:
+    """Side of the vision grid the policy takes, for flat layouts the one of the CELESTEBOT_VISION_MODE setting."""
+    for key, shape in policy.manifest["observation_keys"]:
+        if key == VISION_KEY:
+            return shape[0]
+    return VisionTransform.from_env().size
+
+
+class _BinaryInferenceHandler(socketserver.BaseRequestHandler):
+    """Serves one binary client connection until it closes."""
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.policy = self.server.policy  # type: BatchingPolicy
+        self.decoder = PackedObservationDecoder(self.server.vision_size)
+        self.layout = self.server.layout
+        self.vision_decoders = {}  # episode handle -> VisionDeltaDecoder, for DELTA episodes
+        self.episodes = set()
+        self.next_handle = 0
+        # DELTA observations are reassembled into a full packed observation here before decoding
+        self.packed = bytearray(self.decoder.size)
+        self.packed_view = memoryview(self.packed)
+        # Clients wait for the action before sending the next request, so one row per connection is enough
+        self.row = np.zeros(self.policy.observation_size, dtype=np.float32)
+        self.row_views = flat_observation_views(self.row, self.layout)
+
+    def finish(self):
+        for handle in self.episodes:
+            self.policy.end_episode((id(self), handle))
+
+    def handle(self):
+        while True:
+            try:
+                message_type, payload = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ProtocolError as e:
+                logger.warning(f"Closing binary client connection: {e}")
+                return
+            try:
+                reply_type, reply = self.execute(message_type, payload)
+            except Exception:
+                reply_type, reply = MessageType.ERROR, traceback.format_exc().encode("utf-8")
+            send_frame(self.request, reply_type, reply)
+
+    def execute(self, message_type: MessageType, payload: memoryview):
+        if message_type == MessageType.START_EPISODE:
+            _, vision_encoding = START_EPISODE.unpack(payload)
+            handle = self.next_handle
+            self.next_handle += 1
+            self.episodes.add(handle)
+            if VisionEncoding(vision_encoding) == VisionEncoding.DELTA:
+                self.vision_decoders[handle] = VisionDeltaDecoder(self.server.vision_size)
+            return MessageType.EPISODE, EPISODE_HANDLE.pack(handle)
+
+        handle, = EPISODE_HANDLE.unpack_from(payload)
+        if handle not in self.episodes:
+            raise ProtocolError(f"Unknown episode handle {handle}")
+        if message_type == MessageType.GET_ACTION:
+            return self.action(handle, payload[EPISODE_HANDLE.size:])
+        elif message_type == MessageType.STEP:
+            return self.action(handle, payload[STEP.size:])
+        elif message_type == MessageType.LOG_RETURNS:
+            return MessageType.OK, b""
+        elif message_type == MessageType.END_EPISODE:
+            self.episodes.discard(handle)
+            self.vision_decoders.pop(handle, None)
+            self.policy.end_episode((id(self), handle))
+            return MessageType.OK, b""
+        raise ProtocolError(f"Unexpected client message {message_type.name}")
+
+    def action(self, handle: int, buffer: memoryview):
+        vision_decoder = self.vision_decoders.get(handle)
+        if vision_decoder is not None:
+            scalars_offset = self.decoder.scalars_offset
+            self.packed_view[:VISION_OFFSET] = buffer[:VISION_OFFSET]
+            self.packed_view[scalars_offset:] = buffer[VISION_OFFSET:VISION_OFFSET + SCALARS_SIZE]
+            self.packed_view[VISION_OFFSET:scalars_offset] = \
+                vision_decoder.decode(buffer[VISION_OFFSET + SCALARS_SIZE:])
+            buffer = self.packed_view
+        self.decoder.decode(buffer, out=self.row_views)
+        action = self.policy.compute_action((id(self), handle), self.row)
+        return MessageType.ACTION, np.asarray(action, dtype=np.uint8).tobytes()
+
+
+class BinaryInferenceServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: str, port: int, policy: BatchingPolicy):
+        self.policy = policy
+        self.vision_size = policy_vision_size(policy.policy)
+        self.layout = observation_layout(policy.policy, PackedObservationDecoder(self.vision_size))
+        socketserver.TCPServer.__init__(self, (address, port), _BinaryInferenceHandler)
+
+
+class _RayFreeUnpickler(pickle.Unpickler):
+    """Unpickles PolicyClient requests, whose commands are members of RLlib's `Commands` enum, as plain strings."""
+
+    def find_class(self, module, name):
+        if module == "ray.rllib.env.policy_client" and name == "Commands":
+            return str
+        return super().find_class(module, name)
+
+
+class _HTTPInferenceHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length")))
+            args = _RayFreeUnpickler(io.BytesIO(body)).load()
+            response = self.execute_command(args)
+        except Exception:
+            self.send_error(500, traceback.format_exc())
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(pickle.dumps(response))
+
+    def execute_command(self, args: dict) -> dict:
+        command = args["command"]
+        policy = self.server.policy  # type: BatchingPolicy
+        if command == "START_EPISODE":
+            return {"episode_id": args["episode_id"] or uuid.uuid4().hex}
+        elif command in ("GET_ACTION", STEP_COMMAND):
+            return {"action": policy.compute_action(args["episode_id"], self.row(args["observation"]))}
+        elif command in ("LOG_RETURNS", "LOG_ACTION"):
+            return {}
+        elif command == "END_EPISODE":
+            policy.end_episode(args["episode_id"])
+            return {}
+        raise ValueError(f"The inference server only supports remote inference, got {command}")
+
+    def row(self, observation) -> np.ndarray:
+        return self.server.policy.policy.preprocess([observation])[0]
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPInferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: str, port: int, policy: BatchingPolicy):
+        self.policy = policy
+        super().__init__((address, port), _HTTPInferenceHandler)
+
+
+def start_inference_server(policy: BatchingPolicy, transport: str = "binary", port: int = DEFAULT_PORT,
+                           registry: Optional[PortRegistry] = None):
+    """
+    Serve `policy` with `transport` on a daemon thread, from the first free port from `port` on, registered in
+    `registry` if given. Returns the server (call `shutdown()` when done) and its port.
+    """
+    server_cls = BinaryInferenceServer if transport == "binary" else HTTPInferenceServer
+    if registry is None:
+        server = server_cls(SERVER_ADDRESS, port, policy)
+        port = server.server_address[1]
+    else:
+        port, server = registry.claim(port, lambda p: server_cls(SERVER_ADDRESS, p, policy), address=SERVER_ADDRESS,
+                                      transport=transport, worker_index=0, inference_only=True)
+    threading.Thread(name=f"{transport}-inference-server", target=server.serve_forever, daemon=True).start()
+    return server, port
+
+
+def resolve_artifact(path: str) -> str:
+    """
+    `path`, or for an export directory its fp32 ONNX artifact if onnxruntime is installed (it starts faster and
+    smaller than torch), else its fp32 TorchScript one, else its first one.
+    """
+    if not os.path.isdir(path):
+        return path
+    exports = find_exports(path)
+    if not exports:
+        raise FileNotFoundError(f"No exported policy in {path}")
+    preferred_names = ["policy_fp32.pt"]
+    if importlib.util.find_spec("onnxruntime") is not None:
+        preferred_names.insert(0, "policy_fp32.onnx")
+    for name in preferred_names:
+        preferred = [artifact for artifact in exports if os.path.basename(artifact) == name]
+        if preferred:
+            return preferred[0]
+    return exports[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("artifact", help="Exported policy, or a directory of exports.")
+    parser.add_argument("--transport", choices=["http", "binary"], default="binary")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="First port to try.")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=0.0,
+                        help="How long a queued observation waits for others to share its forward pass.")
+    parser.add_argument("--threads", type=int, default=1, help="Intra-op threads of the model runtime.")
+    parser.add_argument("--stats-interval", type=float, default=30.0,
+                        help="Log requests/s and the mean batch size every this many seconds, 0 to turn off.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    start = time.perf_counter()
+    artifact = resolve_artifact(args.artifact)
+    policy = BatchingPolicy(ExportedPolicy(artifact, num_threads=args.threads), args.max_batch_size,
+                            args.max_wait_ms / 1e3)
+    server, port = start_inference_server(policy, args.transport, args.port, PortRegistry())
+    logger.info(f"Serving {artifact} over {args.transport} at {SERVER_ADDRESS}:{port}, "
+                f"ready in {time.perf_counter() - start:.2f}s")
+
+    requests, batches = 0, 0
+    try:
+        while True:
+            time.sleep(args.stats_interval or 3600)
+            if args.stats_interval and policy.num_batches > batches:
+                logger.info(f"{(policy.num_requests - requests) / args.stats_interval:.1f} requests/s, "
+                            f"{(policy.num_requests - requests) / (policy.num_batches - batches):.2f} per batch")
+            requests, batches = policy.num_requests, policy.num_batches
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
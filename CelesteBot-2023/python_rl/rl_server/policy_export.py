@@ -0,0 +1,320 @@
+"""
+Exports the policy network of a CelesteBot PPO checkpoint (an Algorithm or a Policy checkpoint) for inference
+without RLlib, as TorchScript and/or ONNX in fp32 and/or fp16. rl_common/exported_policy.py describes the artifacts
+and runs them.
+
+Only the model's forward pass is kept, for the observation and action spaces the checkpoint was trained on: no
+optimizer state, no sampler, no exploration. Recurrent state (LSTM or attention memory) becomes extra inputs and
+outputs of the artifact.
+
+After writing, every artifact is checked against the RLlib model on a batch of synthetic observations (largest
+absolute difference of logits and values, agreement of the greedy actions) and its CPU inference latency is
+measured. A format or precision that fails to export stops the export with an error.
+
+Run from the CelesteBot-2023 folder:
+    $ python -m python_rl.rl_server.policy_export checkpoints/<checkpoint> --out exported \
+        --formats torchscript onnx --precisions fp32 fp16
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+import torch
+from gymnasium import spaces
+from ray.rllib.models.preprocessors import get_preprocessor
+from ray.rllib.models.torch.modules import GRUGate, MultiHeadAttention, RelativeMultiHeadAttention
+from ray.rllib.policy.policy import Policy
+from ray.rllib.policy.sample_batch import SampleBatch
+
+from python_rl.rl_common.exported_policy import EXPORT_MANIFEST_VERSION, ExportedPolicy, manifest_path
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {"torchscript": "pt", "onnx": "onnx"}
+PRECISIONS = ("fp32", "fp16")
+ONNX_OPSET = 17
+# Run in float32 with autocast off in fp16 exports: CPU autocast doesn't cover the einsums and tensordots of RLlib's
+# attention net (GTrXL), which then mix half and float operands, and runs normalizations in float32, which needs
+# float32 parameters
+FLOAT32_MODULES = (RelativeMultiHeadAttention, MultiHeadAttention, GRUGate, torch.nn.LayerNorm, torch.nn.GroupNorm,
+                   torch.nn.modules.batchnorm._BatchNorm)
+
+
+def load_policy(checkpoint: str, policy_id: str = "default_policy") -> Policy:
+    """The policy of an Algorithm checkpoint (by id) or of a Policy checkpoint."""
+    policy = Policy.from_checkpoint(checkpoint)
+    if isinstance(policy, dict):
+        if policy_id not in policy:
+            raise ValueError(f"No policy {policy_id} in {checkpoint}, it has {list(policy)}")
+        policy = policy[policy_id]
+    return policy
+
+
+def state_specs(model) -> List[dict]:
+    """Shape and memory window of every recurrent state input of the model, in state_in_<i> order."""
+    specs = []
+    i = 0
+    while f"state_in_{i}" in model.view_requirements:
+        requirement = model.view_requirements[f"state_in_{i}"]
+        window = None
+        if requirement.shift_from is not None:
+            window = requirement.shift_to - requirement.shift_from + 1
+        specs.append({"shape": list(requirement.space.shape), "window": window})
+        i += 1
+    return specs
+
+
+class _PolicyExportModule(torch.nn.Module):
+    """(obs, *state) -> (greedy actions, logits, value, *state_out) around an RLlib TorchModelV2."""
+
+    def __init__(self, model, action_nvec: Sequence[int], num_states: int):
+        super().__init__()
+        self.model = model
+        self.action_nvec = [int(n) for n in action_nvec]
+        self.num_states = num_states
+        self.half_precision = False
+
+    def forward(self, obs, *state):
+        # Autocast runs the matmuls and convolutions in half precision even though RLlib's models cast their
+        # inputs to float32
+        with torch.autocast("cpu", dtype=torch.float16, enabled=self.half_precision):
+            seq_lens = torch.ones(obs.shape[0], dtype=torch.int32) if self.num_states else None
+            logits, state_out = self.model({SampleBatch.OBS: obs}, list(state), seq_lens)
+            value = self.model.value_function()
+        logits = logits.float()
+        actions = torch.stack([branch.argmax(-1) for branch in torch.split(logits, self.action_nvec, -1)], -1)
+        return (actions, logits, value.float()) + tuple(s.float() for s in state_out)
+
+
+def _to_float(value):
+    if isinstance(value, torch.Tensor):
+        return value.float() if value.is_floating_point() else value
+    if isinstance(value, (tuple, list)):
+        return type(value)(_to_float(v) for v in value)
+    if isinstance(value, dict):
+        return {key: _to_float(v) for key, v in value.items()}
+    return value
+
+
+class _Float32Module(torch.nn.Module):
+    """Runs `module` in float32 with autocast off inside a half precision model, see FLOAT32_MODULES."""
+
+    def __init__(self, module: torch.nn.Module):
+        super().__init__()
+        self.module = module.float()
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast("cpu", enabled=False):
+            return self.module(*_to_float(args), **_to_float(kwargs))
+
+
+def to_half_precision(model: torch.nn.Module):
+    """Convert `model` to float16 in place, except for the FLOAT32_MODULES in it."""
+    model.half()
+
+    def keep_float32(module):
+        for name, child in list(module.named_children()):
+            if isinstance(child, FLOAT32_MODULES):
+                setattr(module, name, _Float32Module(child))
+            else:
+                keep_float32(child)
+
+    keep_float32(model)
+
+
+def synthetic_observations(policy: Policy, count: int, seed: int = 0) -> np.ndarray:
+    """`count` random observations of the policy's observation space, preprocessed like RLlib does."""
+    space = getattr(policy.observation_space, "original_space", policy.observation_space)
+    space.seed(seed)
+    preprocessor = get_preprocessor(space)(space)
+    return np.stack([preprocessor.transform(space.sample()) for _ in range(count)]).astype(np.float32)
+
+
+def export_manifest(policy: Policy, checkpoint: str, policy_id: str, export_format: str, precision: str,
+                    states: List[dict], batch_size: int = None) -> dict:
+    space = getattr(policy.observation_space, "original_space", policy.observation_space)
+    dict_layout = isinstance(space, spaces.Dict)
+    return {
+        "version": EXPORT_MANIFEST_VERSION,
+        "format": export_format,
+        "precision": precision,
+        "checkpoint": os.path.abspath(checkpoint),
+        "policy_id": policy_id,
+        "observation_layout": "dict" if dict_layout else "flat",
+        "observation_keys": [[key, list(s.shape)] for key, s in space.spaces.items()] if dict_layout else [],
+        "observation_size": int(policy.observation_space.shape[0]),
+        "action_nvec": [int(n) for n in policy.action_space.nvec],
+        "state": states,
+        "batch_size": batch_size,
+    }
+
+
+def _example_inputs(module: _PolicyExportModule, states: List[dict], observations: np.ndarray):
+    obs = torch.from_numpy(observations)
+    state = [torch.from_numpy(s) for s in _initial_state(states, len(observations))]
+    return (obs, *state)
+
+
+def _initial_state(states: List[dict], batch_size: int) -> List[np.ndarray]:
+    return [
+        np.zeros((batch_size,) + ((spec["window"],) if spec["window"] else ()) + tuple(spec["shape"]),
+                 dtype=np.float32)
+        for spec in states
+    ]
+
+
+def trace(module: _PolicyExportModule, inputs):
+    """
+    Trace `module` for any batch size, or for batches of one if its graph depends on the traced batch size (RLlib's
+    recurrent wrappers derive the time dimension from it). Returns the frozen module and its fixed batch size.
+    """
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(module, inputs, check_trace=False))
+        full = traced(*inputs)
+        rows = tuple(i[:3] for i in inputs)
+        try:
+            generic = all(torch.allclose(a, b[:3], rtol=1e-3, atol=1e-5)
+                          for a, b in zip(traced(*rows), full) if a.is_floating_point())
+        except RuntimeError:
+            generic = False
+        if generic:
+            return traced, None
+        rows = tuple(i[:1] for i in inputs)
+        traced = torch.jit.freeze(torch.jit.trace(module, rows, check_trace=False))
+        traced(*rows)
+        return traced, 1
+
+
+def write_onnx(module: _PolicyExportModule, inputs, path: str, num_states: int, batch_size: int = None):
+    if importlib.util.find_spec("onnx") is None:
+        raise RuntimeError("ONNX export needs the onnx package")
+    if batch_size is not None:
+        inputs = tuple(i[:batch_size] for i in inputs)
+    input_names = ["obs"] + [f"state_in_{i}" for i in range(num_states)]
+    output_names = ["actions", "logits", "value"] + [f"state_out_{i}" for i in range(num_states)]
+    with torch.no_grad():
+        torch.onnx.export(module, inputs, path, input_names=input_names, output_names=output_names,
+                          dynamic_axes={name: {0: "batch"} for name in input_names + output_names}
+                          if batch_size is None else None,
+                          opset_version=ONNX_OPSET, dynamo=False)
+
+
+def check_parity(artifact: str, observations: np.ndarray, reference) -> Dict[str, float]:
+    exported = ExportedPolicy(artifact)
+    actions, logits, value, state_out = exported.compute(observations, exported.initial_state(len(observations)))
+    ref_actions, ref_logits, ref_value = reference[:3]
+    parity = {
+        "max_logit_error": float(np.abs(logits - ref_logits).max()),
+        "max_value_error": float(np.abs(value - ref_value).max()),
+        "action_agreement": float((actions == ref_actions).all(axis=1).mean()),
+    }
+    for i, (s, ref) in enumerate(zip(state_out, reference[3:])):
+        parity[f"max_state_out_{i}_error"] = float(np.abs(s - ref).max())
+    return parity
+
+
+def measure_latency(artifact: str, observations: np.ndarray, batch_sizes: Sequence[int], iterations: int,
+                    num_threads: int = None) -> Dict[int, float]:
+    """Median seconds per forward pass for every batch size."""
+    exported = ExportedPolicy(artifact, num_threads=num_threads)
+    latencies = {}
+    for batch_size in batch_sizes:
+        batch = observations[:batch_size]
+        state = exported.initial_state(len(batch))
+        for _ in range(5):
+            exported.compute(batch, state)
+        times = np.empty(iterations)
+        for i in range(iterations):
+            start = time.perf_counter()
+            exported.compute(batch, state)
+            times[i] = time.perf_counter() - start
+        latencies[batch_size] = float(np.median(times))
+    return latencies
+
+
+def export_policy(checkpoint: str, out: str, formats: Sequence[str] = ("torchscript",),
+                  precisions: Sequence[str] = PRECISIONS, policy_id: str = "default_policy",
+                  num_observations: int = 256) -> List[dict]:
+    """
+    Export, check and time the policy of `checkpoint` in every format and precision. Returns one report per
+    artifact written (path, manifest, parity, file size).
+    """
+    policy = load_policy(checkpoint, policy_id)
+    model = policy.model
+    model.eval()
+    for key in (SampleBatch.PREV_ACTIONS, SampleBatch.PREV_REWARDS):
+        if key in model.view_requirements and model.view_requirements[key].used_for_compute_actions:
+            raise ValueError(f"Models that take {key} as input can't be exported")
+    states = state_specs(model)
+    module = _PolicyExportModule(model, policy.action_space.nvec, len(states)).eval()
+    observations = synthetic_observations(policy, num_observations)
+    inputs = _example_inputs(module, states, observations)
+    with torch.no_grad():
+        reference = [output.numpy() for output in module(*inputs)]
+
+    os.makedirs(out, exist_ok=True)
+    reports = []
+    # fp32 first, fp16 converts the model in place
+    for precision in sorted(precisions, key=PRECISIONS.index):
+        if precision == "fp16":
+            to_half_precision(model)
+            module.half_precision = True
+        for export_format in formats:
+            artifact = os.path.join(out, f"policy_{precision}.{FORMAT_EXTENSIONS[export_format]}")
+            try:
+                traced, batch_size = trace(module, inputs)
+                if export_format == "torchscript":
+                    torch.jit.save(traced, artifact)
+                else:
+                    write_onnx(module, inputs, artifact, len(states), batch_size)
+            except Exception as e:
+                raise RuntimeError(f"Exporting {export_format} {precision} failed: {e}") from e
+            manifest = export_manifest(policy, checkpoint, policy_id, export_format, precision, states, batch_size)
+            with open(manifest_path(artifact), "w") as f:
+                json.dump(manifest, f, indent=2)
+            report = {"artifact": artifact, "manifest": manifest, "size_bytes": os.path.getsize(artifact)}
+            try:
+                report["parity"] = check_parity(artifact, observations, reference)
+            except ImportError as e:
+                logger.warning(f"Can't check {artifact} without its runtime: {e}")
+            reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checkpoint", help="Algorithm or Policy checkpoint folder.")
+    parser.add_argument("--out", default="exported")
+    parser.add_argument("--policy-id", default="default_policy")
+    parser.add_argument("--formats", nargs="+", default=["torchscript"], choices=list(FORMAT_EXTENSIONS))
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--observations", type=int, default=256, help="Synthetic observations for the checks.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--threads", type=int, help="Intra-op threads for the latency measurement.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    reports = export_policy(args.checkpoint, args.out, args.formats, args.precisions, args.policy_id,
+                            max(args.observations, max(args.batch_sizes)))
+    if not reports:
+        raise SystemExit("Nothing was exported")
+    observations = synthetic_observations(load_policy(args.checkpoint, args.policy_id), max(args.batch_sizes), 1)
+    header = "".join(f"{f'batch {b} ms':>12}" for b in args.batch_sizes)
+    print(f"{'artifact':<32}{'size KB':>9}{'logit err':>11}{'value err':>11}{'actions':>9}{header}")
+    for report in reports:
+        latency = measure_latency(report["artifact"], observations, args.batch_sizes, args.iterations, args.threads)
+        parity = report.get("parity")
+        errors = (f"{parity['max_logit_error']:>11.2e}{parity['max_value_error']:>11.2e}"
+                  f"{parity['action_agreement']:>9.1%}") if parity else f"{'-':>11}{'-':>11}{'-':>9}"
+        times = "".join(f"{latency[b] * 1e3:>12.3f}" for b in args.batch_sizes)
+        print(f"{os.path.basename(report['artifact']):<32}{report['size_bytes'] / 1024:>9.0f}{errors}{times}")
+
+
+if __name__ == "__main__":
+    main()
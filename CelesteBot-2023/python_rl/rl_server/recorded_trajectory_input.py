@@ -0,0 +1,170 @@
+"""
+RLlib `InputReader` serving SampleBatches straight from trajectory recordings (see rl_common/trajectory_recorder.py),
+for pretraining or behavior cloning on collected play without running the game.
+
+Use it as the input of an offline algorithm, e.g.
+    BCConfig().offline_data(input_=lambda ioctx: RecordedTrajectoryInput(ioctx, "recordings"))
+or start the server with --offline-input, which pretrains the policy with BC.
+
+Every pair of consecutive rows of an episode is one transition: obs is the first row's observation, actions, rewards
+and terminateds come from the second row (prev_action, reward, termination) and new_obs is its observation. Pairs
+across a gap of dropped rows are skipped. Observations are flattened the way RLlib's Dict preprocessor does it (keys
+in order, each flattened to float32), put in the flat layout for policies trained on flat observations (see
+rl_common/flat_observation.py), or left as a dict of arrays with `_disable_preprocessor_api`.
+
+The recordings have no action log-probabilities, value predictions or recurrent state, so the batches suit offline
+algorithms (BC, MARWIL, CQL, ...) with non-recurrent models, not PPO.
+
+Batches are gathered from the memory mapped columns by `num_readers` threads into a queue of `prefetch` batches.
+Each RLlib worker with this input reads its own share of the transitions.
+"""
+import logging
+import math
+import queue
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+from ray.rllib.offline.input_reader import InputReader
+from ray.rllib.offline.io_context import IOContext
+from ray.rllib.policy.sample_batch import SampleBatch, concat_samples
+
+from python_rl.rl_common.flat_observation import flat_observation_layout, flat_observation_size, \
+    flat_observation_views, flat_observations_enabled
+from python_rl.rl_common.trajectory_recorder import find_recordings, open_recording
+
+logger = logging.getLogger(__name__)
+
+# Recording columns that aren't part of the observation
+TRANSITION_COLUMNS = ("prev_action", "reward", "termination", "sequence", "episode", "step", "level")
+
+
+class RecordedTrajectoryInput(InputReader):
+
+    def __init__(self, ioctx: Optional[IOContext], recordings: Union[str, Sequence[str]], shuffle: bool = True,
+                 batch_size: Optional[int] = None, num_readers: int = 2, prefetch: int = 4, seed: int = 0,
+                 flat_observations: Optional[bool] = None):
+        """
+        Args:
+            ioctx: The worker's IO context, used for the batch size, the worker's share of the data and whether
+                observations are flattened. May be None outside of RLlib.
+            recordings: Recording folders, or folders holding recordings.
+            shuffle: Random transitions per batch, reshuffled every pass. Otherwise consecutive transitions, in
+                recording order, so episodes stay together (batches can come out of order with several readers).
+            batch_size: Transitions per batch, by default train_batch_size split over the workers like RLlib's
+                JsonReader.
+            num_readers: Threads gathering batches.
+            prefetch: Batches gathered ahead of `next()`.
+            seed: Seed of the shuffling.
+            flat_observations: Serve observations in the flat layout, by default if
+                CELESTEBOT_OBSERVATION_LAYOUT=flat like `CelesteEnv`.
+        """
+        self.ioctx = ioctx or IOContext()
+        config = self.ioctx.config or {}
+        paths = find_recordings(recordings)
+        if not paths:
+            raise ValueError(f"No recordings found in {recordings}")
+        self.recordings = [open_recording(path) for path in paths]
+        self.observation_keys = [key for key in self.recordings[0] if key not in TRANSITION_COLUMNS]
+        self.flatten_observations = not config.get("_disable_preprocessor_api", False)
+        if flat_observations is None:
+            flat_observations = flat_observations_enabled()
+        self.flat_layout = flat_observation_layout(
+            OrderedDict((key, np.empty(self.recordings[0][key].shape[1:])) for key in self.observation_keys)) \
+            if flat_observations else None
+
+        recording_ids, rows = [], []
+        for recording_id, columns in enumerate(self.recordings):
+            transition_rows = self._transition_rows(columns)
+            recording_ids.append(np.full(len(transition_rows), recording_id, dtype=np.int32))
+            rows.append(transition_rows)
+        recording_ids, rows = np.concatenate(recording_ids), np.concatenate(rows)
+        # This worker's share
+        num_workers = config.get("num_workers", 0) if self.ioctx.worker_index > 0 else 0
+        if num_workers:
+            recording_ids = recording_ids[self.ioctx.worker_index - 1::num_workers]
+            rows = rows[self.ioctx.worker_index - 1::num_workers]
+        if len(rows) == 0:
+            raise ValueError(f"No transitions in {paths}")
+        self.recording_ids, self.rows = recording_ids, rows
+        logger.info(f"Serving {len(rows)} transitions from {len(paths)} recordings")
+
+        if batch_size is None:
+            batch_size = config.get("train_batch_size", 1)
+            if num_workers:
+                batch_size = max(math.ceil(batch_size / num_workers), 1)
+        self.batch_size = min(batch_size, len(rows))
+        self.shuffle = shuffle
+        self.seed = seed
+        self._batches = queue.Queue(maxsize=prefetch)
+        self._readers = [
+            threading.Thread(name=f"RecordedTrajectoryReader{i}", target=self._read_batches, args=(i, num_readers),
+                             daemon=True)
+            for i in range(num_readers)
+        ]  # type: List[threading.Thread]
+        for reader in self._readers:
+            reader.start()
+
+    @staticmethod
+    def _transition_rows(columns) -> np.ndarray:
+        """Rows that start a transition: the next row continues the same episode and the row isn't terminal."""
+        episode, step, termination = columns["episode"], columns["step"], columns["termination"]
+        follows = (episode[1:] == episode[:-1]) & (step[1:] == step[:-1] + 1) & (termination[:-1] == 0)
+        return np.flatnonzero(follows).astype(np.int64)
+
+    def next(self) -> SampleBatch:
+        batch = self._batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def _read_batches(self, reader_index: int, num_readers: int):
+        try:
+            batches_per_pass = len(self.rows) // self.batch_size
+            epoch = 0
+            while True:
+                # Every reader shuffles the same way and takes every num_readers-th batch of the pass
+                order = np.random.default_rng((self.seed, epoch)).permutation(len(self.rows)) if self.shuffle \
+                    else np.arange(len(self.rows))
+                for batch_index in range(reader_index, batches_per_pass, num_readers):
+                    selection = order[batch_index * self.batch_size:(batch_index + 1) * self.batch_size]
+                    self._batches.put(self._gather(selection))
+                epoch += 1
+        except Exception as e:
+            logger.exception("Reading recorded transitions failed")
+            self._batches.put(e)
+
+    def _gather(self, selection: np.ndarray) -> SampleBatch:
+        parts = []
+        recording_ids = self.recording_ids[selection]
+        for recording_id in np.unique(recording_ids):
+            rows = np.sort(self.rows[selection[recording_ids == recording_id]])
+            parts.append(SampleBatch(self._transitions(int(recording_id), rows)))
+        return concat_samples(parts) if len(parts) > 1 else parts[0]
+
+    def _transitions(self, recording_id: int, rows: np.ndarray) -> dict:
+        columns = self.recordings[recording_id]
+        next_rows = rows + 1
+        return {
+            SampleBatch.OBS: self._observations(columns, rows),
+            SampleBatch.NEXT_OBS: self._observations(columns, next_rows),
+            SampleBatch.ACTIONS: columns["prev_action"][next_rows].astype(np.int64),
+            SampleBatch.REWARDS: columns["reward"][next_rows].astype(np.float32),
+            SampleBatch.TERMINATEDS: columns["termination"][next_rows] != 0,
+            SampleBatch.TRUNCATEDS: np.zeros(len(rows), dtype=np.bool_),
+            # Unique across recordings
+            SampleBatch.EPS_ID: (np.int64(recording_id) << 32) + columns["episode"][rows],
+            SampleBatch.T: columns["step"][rows].astype(np.int64),
+        }
+
+    def _observations(self, columns, rows: np.ndarray):
+        if self.flat_layout is not None:
+            flat = np.empty((len(rows), flat_observation_size(self.flat_layout)), dtype=np.float32)
+            for key, view in flat_observation_views(flat, self.flat_layout).items():
+                view[:] = columns[key][rows]
+            return flat
+        if not self.flatten_observations:
+            return OrderedDict((key, np.asarray(columns[key][rows])) for key in self.observation_keys)
+        return np.concatenate(
+            [columns[key][rows].reshape(len(rows), -1).astype(np.float32) for key in self.observation_keys], axis=1)
@@ -0,0 +1,39 @@
+"""
+Client telemetry (see rl_common/client_telemetry.py) as custom metrics. Clients send it in the info of the last reward
+of every episode. `ClientTelemetryCallbacks.on_episode_end` turns it into these episode custom metrics:
+
+    telemetry/steps_per_s, telemetry/timeouts
+    telemetry/action_mean_ms, telemetry/action_p50_ms, telemetry/action_p95_ms, telemetry/action_p99_ms,
+    telemetry/action_max_ms
+    telemetry/port_<port>/steps_per_s
+
+RLlib reports the mean, min and max of each over the iteration's episodes, so they show up in the Tune results
+next to `episode_reward_mean`, e.g. as `custom_metrics/telemetry/action_p95_ms_mean`. Episodes without telemetry
+(older clients, the inference server) add none.
+
+There are no per-client keys: client ids change with every restart, so keys per client would pile up over a long run.
+The summary fields aggregate over all clients, the port keys are bounded by the server's ports.
+
+With "local" inference the client's own rollout worker builds the episodes, so their telemetry doesn't reach the
+server's callbacks.
+"""
+from ray.rllib.algorithms.callbacks import DefaultCallbacks
+
+from python_rl.rl_common.client_telemetry import TELEMETRY_INFO_KEY
+
+METRIC_PREFIX = "telemetry"
+SUMMARY_FIELDS = ("steps_per_s", "timeouts", "action_mean_ms", "action_p50_ms", "action_p95_ms", "action_p99_ms",
+                  "action_max_ms")
+
+
+class ClientTelemetryCallbacks(DefaultCallbacks):
+
+    def on_episode_end(self, *, worker, base_env, policies, episode, env_index=None, **kwargs) -> None:
+        telemetry = (episode.last_info_for() or {}).get(TELEMETRY_INFO_KEY)
+        if not telemetry:
+            return
+        metrics = episode.custom_metrics
+        for field in SUMMARY_FIELDS:
+            if field in telemetry:
+                metrics[f"{METRIC_PREFIX}/{field}"] = telemetry[field]
+        metrics[f"{METRIC_PREFIX}/port_{telemetry['port']}/steps_per_s"] = telemetry["steps_per_s"]